@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量差异比较性能对比
+生成随机的新旧快照，确认batch_compare_positions与逐个调用compare_positions结果一致，并比较耗时
+
+用法:
+    python benchmarks/bench_diff.py [--addresses 5000] [--positions 8]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from diff_engine import PositionFrame, batch_compare_positions, diff_frames  # noqa: E402
+from hyperscan import BaseHyperscanAPI  # noqa: E402
+
+TOKENS = ['BTC', 'ETH', 'SOL', 'HYPE', 'MELANIA', 'TRUMP', 'DOGE', 'WIF', 'PURR', 'ARB', 'SUI', 'kPEPE']
+
+
+def _position(rng):
+    quantity = rng.uniform(1, 1e5)
+    price = rng.uniform(0.5, 100)
+    direction = rng.choice(['LONG', 'SHORT'])
+    return {
+        'token': rng.choice(TOKENS),
+        'direction': direction,
+        'value': quantity * price,
+        'quantity': quantity,
+        'liquidation_price': price * (rng.uniform(0.9, 0.99) if direction == 'LONG' else rng.uniform(1.01, 1.1)),
+    }
+
+
+def make_snapshots(address_count, position_count, seed):
+    rng = random.Random(seed)
+    old_snapshots, new_snapshots = {}, {}
+    for i in range(address_count):
+        address = f'0x{i:040x}'
+        old_positions = [_position(rng) for _ in range(rng.randint(0, position_count))]
+        new_positions = []
+        for position in old_positions:
+            roll = rng.random()
+            if roll < 0.1:
+                continue  # 平仓
+            if roll < 0.15:
+                # 反手
+                direction = 'SHORT' if position['direction'] == 'LONG' else 'LONG'
+                new_positions.append(dict(position, direction=direction))
+                continue
+            drift = rng.uniform(0.5, 1.5) if roll < 0.3 else rng.uniform(0.95, 1.05)
+            new_positions.append(dict(position, value=position['value'] * drift))
+        for _ in range(rng.randint(0, 2)):
+            new_positions.append(_position(rng))
+        # 少量地址没有旧数据或获取失败
+        old_snapshots[address] = {'address': address, 'positions': old_positions} if rng.random() > 0.02 else None
+        new_snapshots[address] = {'address': address, 'positions': new_positions} if rng.random() > 0.02 else None
+    prices = {token: rng.uniform(0.5, 100) for token in TOKENS[::2]}
+    return old_snapshots, new_snapshots, prices
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量差异比较性能对比")
+    parser.add_argument('--addresses', type=int, default=5000)
+    parser.add_argument('--positions', type=int, default=8, help="每个地址最多的持仓数")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    old_snapshots, new_snapshots, prices = make_snapshots(args.addresses, args.positions, args.seed)
+    api = BaseHyperscanAPI.__new__(BaseHyperscanAPI)
+
+    start = time.perf_counter()
+    expected = {address: api.compare_positions(old_snapshots.get(address), data, prices)
+                for address, data in new_snapshots.items()}
+    reference_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = batch_compare_positions(old_snapshots, new_snapshots, prices)
+    batch_time = time.perf_counter() - start
+
+    # 快照已经是NumPy数组时，只需要向量化比较这一步
+    address_ids = {address: i for i, address in enumerate(new_snapshots)}
+    key_ids = {}
+    old_frame = PositionFrame(old_snapshots, address_ids, key_ids, prices)
+    new_frame = PositionFrame(new_snapshots, address_ids, key_ids, prices)
+    start = time.perf_counter()
+    diff_frames(old_frame, new_frame, len(key_ids))
+    array_time = time.perf_counter() - start
+
+    print(f"地址数: {args.addresses}，持仓数: {len(new_frame.positions)}")
+    print(f"compare_positions 逐个比较:         {reference_time * 1000:.1f} ms")
+    print(f"batch_compare_positions(含字典转换): {batch_time * 1000:.1f} ms ({reference_time / batch_time:.1f}x)")
+    print(f"diff_frames(仅数组比较):            {array_time * 1000:.1f} ms ({reference_time / array_time:.1f}x)")
+    print(f"结果一致: {'是' if actual == expected else '否'}")
+    if actual != expected:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
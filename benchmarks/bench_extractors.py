@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+持仓提取引擎性能对比
+在保存的地址页面样本上比较 bs4 / lxml / streaming 三种引擎的吞吐量
+
+用法:
+    python benchmarks/bench_extractors.py [--rounds 200]
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extractors import EXTRACTORS, extract_embedded_positions  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def _comparable(positions):
+    """去掉时间戳后用于比较各引擎的输出是否一致"""
+    return [{k: v for k, v in p.items() if k != 'updated_at'} for p in positions]
+
+
+def bench(func, html, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(html)
+    return rounds / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="持仓提取引擎性能对比")
+    parser.add_argument('--rounds', type=int, default=200, help="每个样本重复解析的次数")
+    args = parser.parse_args()
+
+    fixtures = sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.html')))
+    extractors = {name: cls() for name, cls in EXTRACTORS.items()}
+
+    columns = list(extractors) + ['json']
+    print(f"{'样本':<28}{'大小(KB)':>10}" + ''.join(f"{name + '(页/秒)':>18}" for name in columns) + f"{'加速比':>10}")
+    for path in fixtures:
+        with open(path, encoding='utf-8') as f:
+            html = f.read()
+
+        # 先确认各引擎HTML路径的结果一致
+        reference = _comparable(extractors['bs4'].extract_html(html))
+        for name, extractor in extractors.items():
+            if _comparable(extractor.extract_html(html)) != reference:
+                print(f"警告: {name} 在 {os.path.basename(path)} 上的结果与bs4不一致")
+
+        rates = {name: bench(extractor.extract_html, html, args.rounds) for name, extractor in extractors.items()}
+        if extract_embedded_positions(html) is not None:
+            # 页面带内嵌JSON时，实际运行中会直接走JSON路径
+            rates['json'] = bench(extract_embedded_positions, html, args.rounds)
+        best = max(rate for name, rate in rates.items() if name != 'bs4')
+        print(
+            f"{os.path.basename(path):<28}{len(html) / 1024:>10.1f}"
+            + ''.join(f"{rates[name]:>18.1f}" if name in rates else f"{'-':>18}" for name in columns)
+            + f"{best / rates['bs4']:>9.1f}x"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+持有人排名索引性能测试
+生成两个随机的持有人快照(部分地址增减持、新进和清仓)，测量排名索引的构建、排名查询和快照比较耗时，
+并确认比较结果与逐个地址的字典计算一致
+
+用法:
+    python benchmarks/bench_holders.py [--holders 500000] [--changes 0.01]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hyperscan import HoldersSnapshot  # noqa: E402
+
+
+def make_holders(holder_count, change_fraction, seed):
+    rng = random.Random(seed)
+    old = {f'0x{rng.getrandbits(160):040x}': round(rng.paretovariate(1.2) * 1000, 2) for _ in range(holder_count)}
+    new = dict(old)
+    addresses = list(old)
+    changed = int(holder_count * change_fraction)
+    for address in rng.sample(addresses, changed):
+        new[address] = round(old[address] * rng.uniform(0, 3), 2)
+    for address in rng.sample(addresses, changed // 10):
+        del new[address]  # 清仓
+    for _ in range(changed // 10):
+        new[f'0x{rng.getrandbits(160):040x}'] = round(rng.paretovariate(1.2) * 1000, 2)  # 新持有人
+    return old, new
+
+
+def main():
+    parser = argparse.ArgumentParser(description="持有人排名索引性能测试")
+    parser.add_argument('--holders', type=int, default=500000)
+    parser.add_argument('--changes', type=float, default=0.01, help="两个快照之间持有量改变的地址比例")
+    parser.add_argument('--limit', type=int, default=10, help="增持/减持排行的地址数")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    old, new = make_holders(args.holders, args.changes, args.seed)
+    older = HoldersSnapshot('HYPE', 0, {'holders': old})
+    newer = HoldersSnapshot('HYPE', 0, {'holders': new})
+
+    start = time.perf_counter()
+    older.ranking
+    newer.ranking
+    build_time = (time.perf_counter() - start) / 2
+
+    sample = random.Random(args.seed).sample(list(new), 1000)
+    start = time.perf_counter()
+    for address in sample:
+        newer.rank(address)
+    rank_time = (time.perf_counter() - start) / len(sample)
+
+    start = time.perf_counter()
+    diff = newer.diff(older, args.limit)
+    diff_time = time.perf_counter() - start
+
+    # 参考实现：按地址逐个计算变化量
+    start = time.perf_counter()
+    deltas = {address: new.get(address, 0) - old.get(address, 0) for address in old.keys() | new.keys()}
+    accumulators = sorted((delta for delta in deltas.values() if delta > 0), reverse=True)[:args.limit]
+    distributors = sorted(delta for delta in deltas.values() if delta < 0)[:args.limit]
+    reference_time = time.perf_counter() - start
+
+    matches = (
+        [round(item[3], 6) for item in diff['accumulators']] == [round(delta, 6) for delta in accumulators]
+        and [round(item[3], 6) for item in diff['distributors']] == [round(delta, 6) for delta in distributors]
+    )
+    print(f"持有人数: {len(old)} -> {len(new)}")
+    print(f"构建排名索引(每个快照): {build_time * 1000:.1f} ms")
+    print(f"排名查询(每次):         {rank_time * 1e6:.1f} µs")
+    print(f"快照比较:               {diff_time * 1000:.1f} ms")
+    print(f"字典逐个比较(参考):     {reference_time * 1000:.1f} ms")
+    print(f"结果一致: {'是' if matches else '否'}")
+    if not matches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
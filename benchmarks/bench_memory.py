@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+持仓缓存内存占用对比
+生成与get_address_data格式一致的地址数据，分别存入普通字典和SnapshotCache(紧凑快照)，
+用tracemalloc比较内存占用，并测量读写转换耗时、确认转换前后数据一致
+
+用法:
+    python benchmarks/bench_memory.py [--addresses 10000,50000] [--positions 4]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import SnapshotCache  # noqa: E402
+
+TOKENS = ['BTC', 'ETH', 'SOL', 'HYPE', 'MELANIA', 'TRUMP', 'DOGE', 'WIF', 'PURR', 'ARB', 'SUI', 'kPEPE']
+
+
+def make_address_data(i, positions, rng):
+    address = f'0x{rng.getrandbits(160):040x}'
+    now = int(time.time())
+    items = []
+    for token in rng.sample(TOKENS, rng.randint(0, positions)):
+        quantity = rng.uniform(1, 1e5)
+        price = rng.uniform(0.5, 100)
+        items.append({
+            'token': token,
+            'direction': rng.choice(['LONG', 'SHORT']),
+            'leverage': rng.choice([1, 3, 5, 10, 20]),
+            'value': quantity * price,
+            'quantity': quantity,
+            'token_quantity': f'{quantity} {token}',
+            'entry_price': price,
+            'funding': rng.uniform(-100, 100),
+            'liquidation_price': price * rng.uniform(0.5, 1.5),
+            'updated_at': now
+        })
+    hype = rng.uniform(0, 1e6)
+    return address, {
+        'address': address,
+        'overview': {
+            'perps': {'count': len(items), 'value': sum(p['value'] for p in items)},
+            'spot': {'count': 1 if hype > 0 else 0, 'value': hype},
+            'vault': {'value': 0},
+            'staked': {'value': 0}
+        },
+        'positions': items,
+        'holdings': {'HYPE': hype},
+        'page_hash': f'{rng.getrandbits(128):032x}',
+        'updated_at': now
+    }
+
+
+def measure(build):
+    """返回 (结果, 新分配的字节数)"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description="持仓缓存内存占用对比")
+    parser.add_argument('--addresses', default='10000,50000', help="逗号分隔的地址数")
+    parser.add_argument('--positions', type=int, default=4, help="每个地址最多的持仓数")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'地址数':>8}{'字典(MB)':>12}{'紧凑(MB)':>12}{'节省':>8}{'写入(µs/地址)':>16}{'读取(µs/地址)':>16}{'一致':>6}")
+    for count in (int(level) for level in args.addresses.split(',')):
+        rng = random.Random(args.seed)
+        source = [make_address_data(i, args.positions, rng) for i in range(count)]
+        # 每份缓存都从JSON重新解析，模拟各自独立持有对象(与从网页/数据库得到的数据一样)
+        encoded = [(address, json.dumps(data)) for address, data in source]
+
+        dict_cache, dict_bytes = measure(lambda: {address: json.loads(text) for address, text in encoded})
+        decoded = [(address, json.loads(text)) for address, text in encoded]
+
+        def build_compact():
+            cache = SnapshotCache()
+            for address, data in decoded:
+                cache[address] = data
+            return cache
+
+        compact_cache, compact_bytes = measure(build_compact)
+        start = time.perf_counter()
+        build_compact()
+        write_time = (time.perf_counter() - start) / count
+
+        start = time.perf_counter()
+        restored = {address: compact_cache.get(address) for address, _ in source}
+        read_time = (time.perf_counter() - start) / count
+
+        matches = restored == dict_cache
+        print(f"{count:>8}{dict_bytes / 2**20:>12.1f}{compact_bytes / 2**20:>12.1f}"
+              f"{1 - compact_bytes / dict_bytes:>8.0%}{write_time * 1e6:>16.1f}{read_time * 1e6:>16.1f}"
+              f"{'是' if matches else '否':>6}")
+        if not matches:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监控周期基准测试(离线)
+启动本地模拟服务器(mock_server.py)，分别在10/100/1000/10000个地址下测量:
+    - HyperscanAPI.get_address_data 的吞吐量(同步客户端，线程池并发)
+    - 完整的monitor_loop周期: 首轮(冷启动)和改变部分地址持仓后的第二轮
+报告周期耗时和CPU时间、请求/秒、峰值RSS和提醒延迟(持仓改变到通知发出)
+每个规模在独立的子进程中运行，峰值RSS互不影响
+
+用法:
+    python benchmarks/bench_monitor.py [--levels 10,100,1000,10000] [--latency 0.02] [--error-rate 0.01]
+
+注意: 本地服务器不限流，测试中把主机限流和调度器预算放宽到 --rate，
+测量的是客户端自身的开销；Telegram发送使用不限速的模拟对象
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+ADDRESS_PATTERN = re.compile(r'<code>(0x[0-9a-fA-F]+)</code>')
+
+
+def _request(url, method='GET'):
+    with urllib.request.urlopen(urllib.request.Request(url, method=method)) as response:
+        return json.loads(response.read())
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class FakeTelegramBot:
+    """记录发送时间和消息中涉及的地址，代替真实的Telegram机器人"""
+    def __init__(self):
+        self.alerts = {}  # 地址 -> 第一次发出提醒的时间
+        self.messages = 0
+
+    def send_message(self, chat_id, text, parse_mode=None):
+        now = time.time()
+        self.messages += 1
+        for address in ADDRESS_PATTERN.findall(text):
+            self.alerts.setdefault(address, now)
+
+
+def run_level(args):
+    """在子进程中运行一个规模，结果以JSON输出到标准输出"""
+    # 必须在导入项目模块之前设置，指向模拟服务器和临时状态目录
+    workdir = tempfile.mkdtemp(prefix='bench_monitor_')
+    os.environ['HYPERSCAN_BASE_URL'] = args.url
+    os.environ['HYPERSCAN_API_BASE_URL'] = args.url
+    os.environ['STATE_DB_PATH'] = os.path.join(workdir, 'state.db')
+    os.environ['HISTORY_DIR'] = os.path.join(workdir, 'history')
+
+    import logging
+    import bot as bot_module
+    from hyperscan import HyperscanAPI
+    from notifier import NotificationDispatcher
+    from ratelimit import rate_limiter
+    from urllib.parse import urlparse
+
+    logging.disable(logging.WARNING)
+    rate_limiter.host_limits[urlparse(args.url).hostname] = args.rate
+
+    from mock_server import mock_address
+    addresses = [mock_address(i) for i in range(args.run)]
+    result = {'addresses': args.run}
+
+    # 同步客户端
+    api = HyperscanAPI()
+    sample = addresses[:min(len(addresses), args.sync_limit)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        list(executor.map(api.get_address_data, sample))
+    result['sync_rate'] = len(sample) / (time.perf_counter() - start)
+
+    # 完整的监控周期
+    class BenchScheduler(bot_module.AddressScheduler):
+        def __init__(self):
+            super().__init__(requests_per_second=args.rate)
+            self.done = 0
+
+        def reschedule(self, address, new_data=None, changed=False):
+            super().reschedule(address, new_data, changed)
+            self.done += 1
+
+    monitor = bot_module.HyperMonitorBot()
+    monitor.load_state()
+    telegram = FakeTelegramBot()
+    monitor.notifier = NotificationDispatcher(telegram, global_rate=1e9, chat_rate=1e9, chat_burst=1e9)
+
+    async def cycle():
+        monitor.scheduler = scheduler = BenchScheduler()
+        for i, address in enumerate(addresses):
+            scheduler.subscribe(i % args.users, address)
+            # 只有有订阅者的地址才会写入监控缓存
+            if not bot_module.position_cache.refs(address):
+                bot_module.position_cache.retain(address)
+        stats_before = _request(f'{args.url}/_mock/stats')
+        monitor.is_running = True
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        task = asyncio.ensure_future(monitor.monitor_loop())
+        while scheduler.done < len(addresses):
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        result['cpu'] = time.process_time() - cpu_start
+        monitor.is_running = False
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        stats_after = _request(f'{args.url}/_mock/stats')
+        return elapsed, stats_after.get('requests', 0) - stats_before.get('requests', 0)
+
+    async def run():
+        result['cold_cycle'], _ = await cycle()
+        result['cold_cpu'] = result['cpu']
+        _request(f'{args.url}/_mock/mutate?fraction={args.change_fraction}', method='POST')
+        mutated_at = time.time()
+        result['cycle'], requests = await cycle()
+        result['rps'] = requests / result['cycle']
+        return mutated_at
+
+    mutated_at = asyncio.run(run())
+    monitor.notifier.join()
+
+    changes = _request(f'{args.url}/_mock/changes')
+    latencies = [
+        telegram.alerts[address] - max(changed_at, mutated_at)
+        for address, changed_at in changes.items() if address in telegram.alerts
+    ]
+    result['alerts'] = len(latencies)
+    result['alert_p50'] = _percentile(latencies, 50)
+    result['alert_p95'] = _percentile(latencies, 95)
+    # Linux下ru_maxrss的单位是KB
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    monitor.notifier.close()
+    monitor.store.close()
+    monitor.history.close()
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="监控周期基准测试(离线)")
+    parser.add_argument('--levels', default='10,100,1000,10000', help="逗号分隔的地址数")
+    parser.add_argument('--latency', type=float, default=0.02, help="模拟服务器的基础延迟(秒)")
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--page-format', choices=['html', 'json'], default='html')
+    parser.add_argument('--no-etag', action='store_true', help="模拟服务器不返回ETag(只靠正文哈希去重)")
+    parser.add_argument('--change-fraction', type=float, default=0.1, help="第二轮前改变持仓的地址比例")
+    parser.add_argument('--users', type=int, default=100, help="订阅用户数")
+    parser.add_argument('--rate', type=float, default=1000, help="测试中的每秒请求预算")
+    parser.add_argument('--threads', type=int, default=8, help="同步客户端的并发线程数")
+    parser.add_argument('--sync-limit', type=int, default=500, help="同步客户端最多测试的地址数")
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    parser.add_argument('--run', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_level(args)
+        return
+
+    levels = [int(level) for level in args.levels.split(',')]
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, 'mock_server.py'), '--port', '0',
+         '--addresses', str(max(levels)), '--latency', str(args.latency), '--jitter', str(args.jitter),
+         '--error-rate', str(args.error_rate), '--page-format', args.page_format]
+        + (['--no-etag'] if args.no_etag else []),
+        stdout=subprocess.PIPE, text=True
+    )
+    try:
+        port = int(server.stdout.readline().split()[1])
+        url = f'http://127.0.0.1:{port}'
+        print(f"{'地址数':>8}{'同步(地址/秒)':>16}{'首轮(秒)':>12}{'周期(秒)':>12}{'首轮/周期CPU(秒)':>20}{'请求/秒':>12}"
+              f"{'峰值RSS(MB)':>14}{'提醒数':>10}{'提醒延迟p50/p95(秒)':>24}")
+        for level in levels:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--run', str(level), '--url', url]
+                + [f'--{name}={value}' for name, value in (
+                    ('change-fraction', args.change_fraction), ('users', args.users), ('rate', args.rate),
+                    ('threads', args.threads), ('sync-limit', args.sync_limit))],
+                capture_output=True, text=True, check=True
+            ).stdout
+            r = json.loads(output.strip().splitlines()[-1])
+            print(f"{r['addresses']:>8}{r['sync_rate']:>16.1f}{r['cold_cycle']:>12.2f}{r['cycle']:>12.2f}"
+                  f"{r['cold_cpu']:>13.2f}/{r['cpu']:.2f}"
+                  f"{r['rps']:>12.1f}{r['peak_rss_mb']:>14.1f}{r['alerts']:>10}"
+                  f"{r['alert_p50']:>12.2f}/{r['alert_p95']:.2f}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
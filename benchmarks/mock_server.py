@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地hypurrscan模拟服务器
+提供 holdersAtTime / tokens/{symbol} / token/{symbol} / address/{addr} 接口，
+可配置延迟、抖动和错误率，用于在不访问hypurrscan.io的情况下测量性能
+
+数据来源:
+    --fixtures 目录中存在录制的响应时优先使用:
+        holdersAtTime_<代币>.json  tokens_<代币>.json  address_<地址>.html
+    否则按随机种子生成，格式与benchmarks/fixtures中的页面一致
+
+控制接口(供基准测试使用):
+    POST /_mock/mutate?fraction=0.1  随机改变一部分地址的持仓，返回改变的地址数
+    GET  /_mock/changes              地址 -> 最近一次改变的时间戳
+    GET  /_mock/stats                各接口的请求数和注入的错误数
+
+用法:
+    python benchmarks/mock_server.py [--port 8080] [--addresses 10000] [--latency 0.02] [--error-rate 0.01]
+    然后设置 HYPERSCAN_BASE_URL 和 HYPERSCAN_API_BASE_URL 为 http://127.0.0.1:8080
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+TOKENS = ['BTC', 'ETH', 'SOL', 'HYPE', 'MELANIA', 'TRUMP', 'DOGE', 'WIF', 'PURR', 'ARB', 'SUI', 'kPEPE']
+
+
+def mock_address(i):
+    """第i个模拟地址"""
+    return f'0x{i:040x}'
+
+
+class MockHypurrscan:
+    """
+    模拟服务器的数据和行为
+    参数:
+        addresses (int): 持有人数据中包含的地址数(mock_address(0..addresses-1))
+        positions (int): 每个地址最多的持仓数
+        latency (float): 每个请求的基础延迟(秒)
+        jitter (float): 延迟的随机抖动上限(秒)
+        error_rate (float): 返回503的请求比例
+        page_format (str): 地址页面格式，html(持仓卡片)或json(内嵌assetPositions)
+        fixtures (str): 录制响应所在目录
+        etag (bool): 地址页面是否返回ETag并支持If-None-Match(304)
+    """
+    def __init__(self, addresses=10000, positions=4, latency=0.02, jitter=0.01, error_rate=0.0,
+                 page_format='html', fixtures=None, seed=42, etag=True):
+        self.addresses = addresses
+        self.positions = positions
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.page_format = page_format
+        self.fixtures = fixtures
+        self.seed = seed
+        self.etag = etag
+        self.rng = random.Random(seed)
+        self.versions = {}  # 地址 -> 持仓版本，mutate时递增
+        self.changes = {}  # 地址 -> 最近一次改变的时间戳
+        self.stats = Counter()
+
+    def _fixture(self, name):
+        if not self.fixtures:
+            return None
+        path = os.path.join(self.fixtures, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            return f.read()
+
+    def _positions(self, address):
+        """按(种子, 地址, 版本)确定性地生成持仓，版本变化时持仓随之变化"""
+        base = random.Random(f'{self.seed}:{address}')
+        positions = []
+        for token in base.sample(TOKENS, base.randint(0, self.positions)):
+            size = base.uniform(1e3, 1e5) * base.choice([1, -1])
+            price = base.uniform(0.5, 100)
+            positions.append({'coin': token, 'szi': size, 'entryPx': price, 'markPx': price})
+
+        version = self.versions.get(address, 0)
+        if version:
+            rng = random.Random(f'{self.seed}:{address}:{version}')
+            roll = rng.random()
+            if positions and roll < 0.2:
+                positions.pop(rng.randrange(len(positions)))  # 平仓
+            elif positions and roll < 0.3:
+                flipped = positions[rng.randrange(len(positions))]
+                flipped['szi'] = -flipped['szi']  # 反手
+            elif roll < 0.5:
+                token = rng.choice([t for t in TOKENS if t not in {p['coin'] for p in positions}] or TOKENS)
+                price = rng.uniform(0.5, 100)
+                positions.append({'coin': token, 'szi': rng.uniform(1e3, 1e5), 'entryPx': price, 'markPx': price})
+            for position in positions:
+                position['markPx'] *= rng.uniform(0.7, 1.3)
+        return positions
+
+    def render_address(self, address):
+        recorded = self._fixture(f'address_{address}.html')
+        if recorded is not None:
+            return recorded
+        positions = self._positions(address)
+        if self.page_format == 'json':
+            state = {'assetPositions': [{'type': 'oneWay', 'position': {
+                'coin': p['coin'],
+                'szi': f"{p['szi']:.2f}",
+                'entryPx': f"{p['entryPx']:.4f}",
+                'positionValue': f"{abs(p['szi']) * p['markPx']:.2f}",
+                'liquidationPx': f"{p['entryPx'] * (0.8 if p['szi'] > 0 else 1.2):.4f}",
+                'leverage': {'type': 'cross', 'value': 5},
+                'cumFunding': {'allTime': '0.0', 'sinceOpen': '0.0', 'sinceChange': '0.0'},
+            }} for p in positions]}
+            body = (
+                '<script id="__NEXT_DATA__" type="application/json">'
+                + json.dumps({'props': {'pageProps': {'address': address, 'clearinghouseState': state}}})
+                + '</script>'
+            )
+        else:
+            cards = ''.join(
+                '<div class="position-card">\n'
+                f'  <div class="position-header"><span class="position-token">{p["coin"]}</span> '
+                f'<span class="position-direction">{"Long" if p["szi"] > 0 else "Short"} 5x</span></div>\n'
+                f'  <div class="position-body"><span class="label">Value</span> '
+                f'<span class="position-value">${abs(p["szi"]) * p["markPx"]:,.2f}</span>\n'
+                f'  <span class="label">Entry</span> <span class="position-entry">${p["entryPx"]:,.4f}</span></div>\n'
+                '</div>\n'
+                for p in positions
+            )
+            body = (
+                '<main class="address-page">'
+                f'<section class="address-overview"><h1 class="address-title">{address}</h1></section>'
+                f'<section class="positions-section"><h2>Perps</h2><div class="positions-list">\n{cards}</div></section>'
+                '</main>'
+            )
+        return f'<!DOCTYPE html><html><head><title>Address | Hypurrscan</title></head><body>{body}</body></html>'
+
+    def holders(self, symbol):
+        recorded = self._fixture(f'holdersAtTime_{symbol}.json')
+        if recorded is not None:
+            return json.loads(recorded)
+        rng = random.Random(f'{self.seed}:holders:{symbol}')
+        holders = {mock_address(i): round(rng.uniform(0, 1e6), 2) for i in range(self.addresses)}
+        return {'token': symbol, 'holdersCount': len(holders), 'holders': holders}
+
+    def price(self, symbol):
+        recorded = self._fixture(f'tokens_{symbol}.json')
+        if recorded is not None:
+            return json.loads(recorded)
+        return {'symbol': symbol, 'price': str(round(random.Random(f'{self.seed}:{symbol}').uniform(0.5, 100), 4))}
+
+    def mutate(self, fraction):
+        """随机改变一部分地址的持仓"""
+        count = max(1, int(self.addresses * fraction)) if fraction > 0 else 0
+        now = time.time()
+        for i in self.rng.sample(range(self.addresses), min(count, self.addresses)):
+            address = mock_address(i)
+            self.versions[address] = self.versions.get(address, 0) + 1
+            self.changes[address] = now
+        return count
+
+    # aiohttp处理函数
+
+    async def _simulate(self, route):
+        self.stats[route] += 1
+        self.stats['requests'] += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            self.stats['errors'] += 1
+            return web.Response(status=503, text='Service Unavailable')
+        return None
+
+    async def handle_holders(self, request):
+        error = await self._simulate('holdersAtTime')
+        return error or web.json_response(self.holders(request.match_info['symbol']))
+
+    async def handle_price(self, request):
+        error = await self._simulate('tokens')
+        return error or web.json_response(self.price(request.match_info['symbol']))
+
+    async def handle_token_page(self, request):
+        error = await self._simulate('token')
+        if error:
+            return error
+        price = self.price(request.match_info['symbol'])['price']
+        return web.Response(text=f'<html><body><span class="token-price-value">${price}</span></body></html>',
+                            content_type='text/html')
+
+    async def handle_address(self, request):
+        error = await self._simulate('address')
+        if error:
+            return error
+        address = request.match_info['address']
+        if not self.etag:
+            return web.Response(text=self.render_address(address), content_type='text/html')
+        etag = f'W/"{self.seed}-{self.versions.get(address, 0)}"'
+        if request.headers.get('If-None-Match') == etag:
+            self.stats['not_modified'] += 1
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(text=self.render_address(address), content_type='text/html', headers={'ETag': etag})
+
+    async def handle_mutate(self, request):
+        count = self.mutate(float(request.query.get('fraction', 0.1)))
+        return web.json_response({'changed': count})
+
+    async def handle_changes(self, request):
+        return web.json_response(self.changes)
+
+    async def handle_stats(self, request):
+        return web.json_response(dict(self.stats))
+
+    def make_app(self):
+        app = web.Application()
+        app.add_routes([
+            web.get('/holdersAtTime/{symbol}/{timestamp}', self.handle_holders),
+            web.get('/tokens/{symbol}', self.handle_price),
+            web.get('/token/{symbol}', self.handle_token_page),
+            web.get('/address/{address}', self.handle_address),
+            web.post('/_mock/mutate', self.handle_mutate),
+            web.get('/_mock/changes', self.handle_changes),
+            web.get('/_mock/stats', self.handle_stats),
+        ])
+        return app
+
+
+async def serve(mock, host='127.0.0.1', port=0):
+    """启动服务器并一直运行，启动后打印 READY <端口> 供调用方读取"""
+    runner = web.AppRunner(mock.make_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, backlog=1024)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    print(f'READY {port}', flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地hypurrscan模拟服务器")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080, help="0表示随机端口")
+    parser.add_argument('--addresses', type=int, default=10000)
+    parser.add_argument('--positions', type=int, default=4, help="每个地址最多的持仓数")
+    parser.add_argument('--latency', type=float, default=0.02, help="基础延迟(秒)")
+    parser.add_argument('--jitter', type=float, default=0.01, help="延迟抖动上限(秒)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="返回503的比例")
+    parser.add_argument('--page-format', choices=['html', 'json'], default='html')
+    parser.add_argument('--fixtures', help="录制响应所在目录")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-etag', action='store_true', help="地址页面不返回ETag(测试正文哈希去重)")
+    args = parser.parse_args()
+
+    mock = MockHypurrscan(args.addresses, args.positions, args.latency, args.jitter, args.error_rate,
+                          args.page_format, args.fixtures, args.seed, not args.no_etag)
+    try:
+        asyncio.run(serve(mock, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,36 @@
 import logging
 import asyncio
+import threading
+import heapq
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
 from telegram import Update, ParseMode
 from telegram.ext import (
     Updater, CommandHandler, CallbackContext, 
     MessageHandler, Filters, ConversationHandler
 )
-from config import TELEGRAM_BOT_TOKEN, DEFAULT_ADDRESS, AUTHORIZED_USERS, MIN_POSITION_VALUE, MONITOR_INTERVAL
-from hyperscan import HyperscanAPI
+from config import (
+    TELEGRAM_BOT_TOKEN, DEFAULT_ADDRESS, AUTHORIZED_USERS, MONITOR_INTERVAL,
+    MONITOR_ACTIVE_INTERVAL, MONITOR_MIN_INTERVAL, MONITOR_MAX_INTERVAL, MONITOR_BACKOFF_FACTOR,
+    MONITOR_REQUESTS_PER_SECOND, MONITOR_TICK, MONITOR_DEADLINE_RETRIES, QUERY_MAX_AGE, QUERY_WORKERS, QUERY_CACHE_MAX_BYTES, SHARD_WORKERS,
+    SHARD_SHARE_INTERVAL,
+    WHALES_MAX_COUNT, STATE_FLUSH_INTERVAL
+)
+from hyperscan import HyperscanAPI, AsyncHyperscanAPI
+from store import StateStore
+from history import PositionHistory
+from records import SnapshotCache, QueryCache
+from diff_engine import significant_changes
+from notifier import NotificationDispatcher
+from pipeline import MonitorPipeline
+from shards import ShardedMonitor
+from breaker import endpoint_health
+from subscriptions import SubscriptionRegistry, normalize_address
+from metrics import (
+    timed, start_http_server, NOTIFY_DURATION, MONITOR_PASS_DURATION, MONITOR_ADDRESSES,
+    MONITOR_DRIFT, MONITOR_DELAY, MONITOR_OVERRUNS, MONITOR_ERRORS, QUEUE_DEPTH, SNAPSHOT_CACHE_BYTES, ENDPOINT_STATE
+)
 
 # 配置日志
 logging.basicConfig(
@@ -19,18 +43,324 @@ logger = logging.getLogger(__name__)
 WAITING_ADDRESS = 1
 
 # 全局变量
-monitored_addresses = {}  # 用户ID -> 监控的地址列表
-position_cache = {}  # 地址 -> 上次的持仓数据
+monitored_addresses = SubscriptionRegistry()  # 用户ID -> 监控的地址(写时复制，各线程无锁读取)
+position_cache = SnapshotCache()  # 被监控地址 -> 上次的持仓数据(紧凑存储，按订阅数引用计数)
+
+class AddressScheduler:
+    """
+    按地址去重的自适应监控调度器
+    维护 地址 -> 订阅用户ID集合 的倒排索引，每个地址只获取、比较一次，
+    再把通知分发给所有订阅者，上游请求量只与不同地址的数量有关。
+    每个地址有独立的下次检查时间(最小堆)：有变化或持有杠杆仓位的地址检查更频繁，
+    长期无仓位的地址逐步退避到上限；出堆受全局每秒请求数预算限制
+    """
+    def __init__(self, base_interval=MONITOR_INTERVAL, active_interval=MONITOR_ACTIVE_INTERVAL,
+                 min_interval=MONITOR_MIN_INTERVAL, max_interval=MONITOR_MAX_INTERVAL,
+                 backoff_factor=MONITOR_BACKOFF_FACTOR, requests_per_second=MONITOR_REQUESTS_PER_SECOND):
+        self.base_interval = base_interval
+        self.active_interval = active_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.requests_per_second = requests_per_second
+        self.subscribers = {}  # 地址 -> 订阅用户ID集合
+        self._heap = []  # (到期时间, 序号, 地址)
+        self._due = {}  # 地址 -> 有效的到期时间，堆中不一致的条目出堆时丢弃
+        self._intervals = {}  # 地址 -> 当前轮询间隔
+        self._carried = {}  # 地址 -> 连续超过获取期限的次数
+        self._counter = itertools.count()
+        self.last_delays = []  # 最近一次pop_due中各地址比计划晚的秒数
+        self._tokens = float(requests_per_second)
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _push(self, address, due):
+        self._due[address] = due
+        heapq.heappush(self._heap, (due, next(self._counter), address))
+    
+    def subscribe(self, user_id, address):
+        """添加订阅，新地址立即进入检查队列"""
+        with self._lock:
+            if address not in self.subscribers:
+                self.subscribers[address] = set()
+                self._intervals[address] = self.base_interval
+                self._push(address, time.monotonic())
+            self.subscribers[address].add(user_id)
+    
+    def unsubscribe(self, user_id, address):
+        """取消订阅，地址没有订阅者时从索引中移除"""
+        with self._lock:
+            users = self.subscribers.get(address)
+            if not users:
+                return
+            users.discard(user_id)
+            if not users:
+                del self.subscribers[address]
+                self._due.pop(address, None)
+                self._intervals.pop(address, None)
+                self._carried.pop(address, None)
+    
+    def users(self, address):
+        """返回订阅该地址的用户ID集合的副本"""
+        with self._lock:
+            return set(self.subscribers.get(address, ()))
+    
+    def snapshot(self):
+        """返回当前倒排索引的副本"""
+        with self._lock:
+            return {address: set(users) for address, users in self.subscribers.items()}
+    
+    def _refill(self, now):
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        # 预算最多积累1秒，避免空闲后一次性突发
+        self._tokens = min(float(self.requests_per_second), self._tokens + elapsed * self.requests_per_second)
+    
+    def pop_due(self, limit=None):
+        """
+        取出所有已到期的地址(受请求预算限制)
+        参数:
+            limit (int): 最多取出的地址数(下游队列的剩余容量)，None表示不限
+        返回:
+            list: [(地址, 订阅用户ID集合), ...]
+        """
+        now = time.monotonic()
+        batch = []
+        delays = []
+        with self._lock:
+            self._refill(now)
+            while self._heap and self._heap[0][0] <= now and self._tokens >= 1 and (limit is None or len(batch) < limit):
+                due, _, address = heapq.heappop(self._heap)
+                if self._due.get(address) != due:
+                    continue  # 已取消订阅或已被重新调度
+                del self._due[address]
+                self._tokens -= 1
+                batch.append((address, set(self.subscribers[address])))
+                delays.append(now - due)
+            if batch:
+                self.last_delays = delays
+        return batch
+    
+    def overdue(self):
+        """已到期但尚未检查的地址数"""
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for due in self._due.values() if due <= now)
+    
+    def next_wait(self, max_wait):
+        """距离下一个地址到期(或预算恢复)需要等待的秒数，最多max_wait"""
+        now = time.monotonic()
+        with self._lock:
+            while self._heap and self._due.get(self._heap[0][2]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                return max_wait
+            wait = self._heap[0][0] - now
+            if wait <= 0 and self._tokens < 1:
+                wait = (1 - self._tokens) / self.requests_per_second
+        return min(max(wait, 0), max_wait)
+    
+    def requeue(self, address):
+        """把已取出但未处理完的地址放回队列并立即到期(保留原来的轮询间隔)"""
+        with self._lock:
+            if address in self.subscribers:
+                self._push(address, time.monotonic())
+    
+    def carry_over(self, address, max_carry=MONITOR_DEADLINE_RETRIES):
+        """
+        超过获取期限未完成的地址：放到队列最前面，下一批优先检查
+        连续超过max_carry次时按获取失败处理(基础间隔后重试)，避免一直卡住的地址反复占用获取名额
+        返回:
+            bool: 是否放到了队列最前面
+        """
+        with self._lock:
+            if address not in self.subscribers:
+                return False
+            carried = self._carried[address] = self._carried.get(address, 0) + 1
+            if carried <= max_carry:
+                # 到期时间早于堆顶，保证排在所有已到期的地址之前
+                now = time.monotonic()
+                self._push(address, min(self._heap[0][0] - 1e-6, now) if self._heap else now)
+                return True
+            del self._carried[address]
+        self.reschedule(address)
+        return False
+    
+    def reschedule(self, address, new_data=None, changed=False):
+        """
+        根据本次结果计算下次检查时间
+        参数:
+            address (str): 钱包地址
+            new_data (dict): 最新数据，获取失败时为None
+            changed (bool): compare_positions是否报告了变化
+        """
+        with self._lock:
+            if address not in self.subscribers:
+                return
+            interval = self._intervals.get(address, self.base_interval)
+            if new_data is not None:
+                self._carried.pop(address, None)
+            if new_data is None:
+                # 获取失败，按基础间隔重试
+                interval = self.base_interval
+            elif changed:
+                interval = self.min_interval
+            elif any(p.get('leverage', 0) > 1 for p in new_data.get('positions', [])):
+                interval = self.active_interval
+            else:
+                # 没有仓位的地址逐步退避
+                interval = min(max(interval, self.base_interval) * self.backoff_factor, self.max_interval)
+            self._intervals[address] = interval
+            self._push(address, time.monotonic() + interval)
+
+class AddressQueryService:
+    """
+    /query命令的数据获取
+    - 监控缓存中的快照足够新时直接使用，不发请求
+    - 否则在线程池中获取；同一地址正在获取时，后来的查询共用同一个Future
+    - 未被监控的地址的查询结果放入LRU/TTL缓存，在max_age内可被后续查询复用，
+      总内存不超过max_bytes(不写入监控缓存，以免影响变化检测)
+    - 地址从该缓存中移除(过期或内存不足)时，同时删除它在PageCache中的条目
+    """
+    def __init__(self, api, max_age=QUERY_MAX_AGE, workers=QUERY_WORKERS, max_bytes=QUERY_CACHE_MAX_BYTES):
+        self.api = api
+        self.max_age = max_age
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='query')
+        self._inflight = {}  # 地址 -> Future
+        # 地址 -> 最近一次查询到的数据；地址被移除时一并删除它的页面缓存
+        self.recent = QueryCache(max_bytes, max_age, on_evict=api.forget_address)
+        self._lock = threading.Lock()
+    
+    def cached(self, address):
+        """返回足够新的快照(优先监控缓存)，没有时返回None"""
+        # 先只看更新时间，过期的快照不需要转换
+        updated_at = position_cache.updated_at(address)
+        if updated_at and time.time() - updated_at < self.max_age:
+            return position_cache.get(address)
+        return self.recent.get(address)
+    
+    def take(self, address):
+        """取出查询缓存中未过期的数据(地址开始被监控时使用，不再重复获取)，没有时返回None"""
+        return self.recent.pop(address)
+    
+    def fetch(self, address):
+        """
+        获取地址数据，同一地址并发的请求只发起一次
+        返回:
+            Future: 结果为地址数据(获取失败时为None)
+        """
+        with self._lock:
+            future = self._inflight.get(address)
+            if future is not None:
+                return future
+            future = self._executor.submit(self._fetch, address)
+            self._inflight[address] = future
+            return future
+    
+    def _fetch(self, address):
+        data = None
+        try:
+            data = self.api.get_address_data(address)
+        finally:
+            with self._lock:
+                self._inflight.pop(address, None)
+            # 被监控的地址已有监控缓存
+            if data and not position_cache.refs(address):
+                self.recent.put(address, data)
+        return data
+    
+    def submit(self, fn, *args):
+        """在查询线程池中运行其他较慢的命令(例如/whales、/rank)，返回Future"""
+        return self._executor.submit(fn, *args)
+    
+    def close(self):
+        self._executor.shutdown(wait=False)
 
 class HyperMonitorBot:
     def __init__(self):
         self.api = HyperscanAPI()
+        self.async_api = None  # 在监控线程的事件循环中创建
+        self.pipeline = None
+        self.scheduler = AddressScheduler()
+        self.query_service = AddressQueryService(self.api)
+        self.store = None  # 启动时打开
+        self.history = None
         self.updater = None
+        self.notifier = None  # 启动时创建
+        self.shards = None  # SHARD_WORKERS大于1时启动分片工作进程
         self.monitor_task = None
+        self.monitor_thread = None
         self.is_running = False
+        self._stopped = threading.Event()
+    
+    def load_state(self):
+        """从持久化存储恢复订阅和持仓缓存，重启后第一轮即可比较变化"""
+        self.store = StateStore()
+        self.history = PositionHistory()
+        subscriptions = self.store.load_subscriptions()
+        # 旧版本按原样保存地址：大小写不同的同一地址合并为小写，并更新存储
+        for user_id, addresses in subscriptions.items():
+            for address in addresses:
+                if address != normalize_address(address):
+                    self.store.remove_subscription(user_id, address)
+                    self.store.add_subscription(user_id, normalize_address(address))
+        # 所有订阅一次写入，只发布一个版本
+        current = monitored_addresses.load(subscriptions)
+        for address, user_ids in current.by_address.items():
+            for user_id in user_ids:
+                self.scheduler.subscribe(user_id, address)
+                position_cache.retain(address)
+        snapshots = self.store.load_snapshots()
+        for address in list(snapshots):
+            if address != normalize_address(address):
+                data = snapshots.pop(address)
+                self.store.delete_snapshot(address)
+                snapshots.setdefault(normalize_address(address), data)
+                self.store.save_snapshot(normalize_address(address), data)
+        position_cache.update(snapshots)
+        # 取消订阅后遗留的快照
+        for address in position_cache.unreferenced():
+            del position_cache[address]
+            self.store.delete_snapshot(address)
+        logger.info(f"已恢复 {len(subscriptions)} 个用户的订阅和 {len(snapshots)} 个地址的持仓缓存")
+    
+    def add_subscription(self, user_id, address):
+        """添加订阅(内存、调度器和持久化存储)，地址统一为小写"""
+        address = normalize_address(address)
+        monitored_addresses.add(user_id, address)
+        self.scheduler.subscribe(user_id, address)
+        position_cache.retain(address)
+        self.store.add_subscription(user_id, address)
+        if self.shards:
+            self.shards.assign(address)
+    
+    def remove_subscription(self, user_id, address):
+        """删除订阅(内存、调度器和持久化存储)"""
+        address = normalize_address(address)
+        monitored_addresses.remove(user_id, address)
+        self.scheduler.unsubscribe(user_id, address)
+        self.store.remove_subscription(user_id, address)
+        # 最后一个订阅者取消时移除监控缓存，快照转入查询缓存，过期或内存不足时再移除(连同页面缓存)
+        snapshot = position_cache.release(address)
+        if snapshot is not None:
+            self.store.delete_snapshot(address)
+            self.query_service.recent.put(address, snapshot)
+        if self.shards and not self.scheduler.users(address):
+            self.shards.remove(address)
+    
+    def update_snapshot(self, address, data):
+        """更新地址的持仓缓存，批量写入持久化存储，并追加到持仓历史"""
+        if not position_cache.set_if_referenced(address, data):
+            # 获取期间地址已被取消订阅，不再缓存
+            return
+        self.store.save_snapshot(address, data)
+        self.history.append(data)
     
     def start(self):
         """启动机器人"""
+        # 恢复上次运行保存的状态
+        self.load_state()
+        
         # Clash代理配置
         # 使用HTTP代理
         proxy_url = 'http://127.0.0.1:7890'
@@ -47,6 +377,15 @@ class HyperMonitorBot:
         )
         dispatcher = self.updater.dispatcher
         
+        # 通知由后台线程池发送，不阻塞监控循环
+        self.notifier = NotificationDispatcher(self.updater.bot)
+        
+        # 本地指标服务(Prometheus文本格式)
+        QUEUE_DEPTH.set_function(self.queue_depths)
+        SNAPSHOT_CACHE_BYTES.set_function(self.cache_sizes)
+        ENDPOINT_STATE.set_function(endpoint_health.states)
+        start_http_server()
+        
         # 注册命令处理函数
         dispatcher.add_handler(CommandHandler("start", self.cmd_start))
         dispatcher.add_handler(CommandHandler("help", self.cmd_help))
@@ -54,6 +393,8 @@ class HyperMonitorBot:
         dispatcher.add_handler(CommandHandler("monitor", self.cmd_monitor))
         dispatcher.add_handler(CommandHandler("stop_monitor", self.cmd_stop_monitor))
         dispatcher.add_handler(CommandHandler("status", self.cmd_status))
+        dispatcher.add_handler(CommandHandler("whales", self.cmd_whales))
+        dispatcher.add_handler(CommandHandler("rank", self.cmd_rank))
         
         # 注册地址输入处理
         conv_handler = ConversationHandler(
@@ -68,73 +409,254 @@ class HyperMonitorBot:
         # 注册错误处理
         dispatcher.add_error_handler(self.error_handler)
         
+        # 初始化监控任务
+        self.is_running = True
+        
+        # 多进程分片模式下由工作进程获取和比较，本进程只负责发送通知
+        # 在接收命令之前启动并分配已有的地址，/monitor添加的地址可以直接分配给分片
+        if SHARD_WORKERS > 1:
+            self.shards = ShardedMonitor(position_cache, SHARD_WORKERS)
+            self.shards.start()
+            for address in self.scheduler.snapshot():
+                self.shards.assign(address)
+        
         # 启动机器人
         self.updater.start_polling()
         logger.info("机器人已启动")
         
-        # 初始化监控任务
-        self.is_running = True
-        
         # 使用线程运行异步监控任务
-        import threading
         def run_monitor():
             import asyncio
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
-            loop.run_until_complete(self.monitor_loop())
+            loop.run_until_complete(self.sharded_monitor_loop() if self.shards else self.monitor_loop())
             
-        monitor_thread = threading.Thread(target=run_monitor)
-        monitor_thread.daemon = True
-        monitor_thread.start()
+        self.monitor_thread = threading.Thread(target=run_monitor)
+        self.monitor_thread.daemon = True
+        self.monitor_thread.start()
+        
+        # 定时写入积压的持仓快照和历史(之后没有新数据时也不会一直留在内存中)
+        threading.Thread(target=self.flush_loop, daemon=True).start()
         
-        # 监听Ctrl+C
-        self.updater.idle()
+        # 监听Ctrl+C，退出时写入尚未落盘的快照和历史
+        try:
+            self.updater.idle()
+        finally:
+            self.stop()
+    
+    def flush_loop(self):
+        """每隔STATE_FLUSH_INTERVAL秒检查一次，写入超过写入间隔的快照和历史"""
+        while not self._stopped.wait(STATE_FLUSH_INTERVAL):
+            try:
+                self.store.flush_if_due()
+                self.history.flush_if_due()
+            except Exception as e:
+                logger.error(f"定时写入状态时出错: {str(e)}")
     
     async def monitor_loop(self):
         """监控持仓变化的循环"""
+        # 异步客户端的连接池绑定到当前事件循环，持有人快照缓存、价格服务和页面缓存与同步客户端共用
+        async with AsyncHyperscanAPI(
+            holders_cache=self.api.holders_cache,
+            price_service=self.api.price_service,
+            page_cache=self.api.page_cache,
+            base_url=self.api.base_url,
+            api_base_url=self.api.api_base_url,
+            holdings_tokens=self.api.holdings_tokens
+        ) as async_api:
+            self.async_api = async_api
+            self.pipeline = MonitorPipeline(self, async_api)
+            while self.is_running:
+                try:
+                    # 取出到期的地址(每个地址只获取一次，无论有多少用户订阅)，经过获取、解析、比较各阶段
+                    await self.pipeline.run()
+                except Exception as e:
+                    MONITOR_ERRORS.inc()
+                    logger.error(f"监控循环出错: {str(e)}")
+                    import traceback
+                    logger.error(traceback.format_exc())
+                    await asyncio.sleep(60)  # 出错后等待1分钟再继续
+    
+    async def sharded_monitor_loop(self):
+        """多进程分片模式的监控循环：接收工作进程发回的结果事件，更新缓存并发送通知(工作进程已在start中启动)"""
+        loop = asyncio.get_event_loop()
+        # 持有人快照和价格只在主进程获取，与同步客户端共用缓存
+        async_api = AsyncHyperscanAPI(
+            holders_cache=self.api.holders_cache,
+            price_service=self.api.price_service,
+            base_url=self.api.base_url,
+            api_base_url=self.api.api_base_url,
+            holdings_tokens=self.api.holdings_tokens
+        )
+        await async_api.open()
+        share_task = asyncio.ensure_future(self.share_loop(async_api))
+        try:
+            while self.is_running:
+                try:
+                    # 在线程池中等待事件，不阻塞事件循环
+                    events = await loop.run_in_executor(None, self.shards.get_events, MONITOR_TICK)
+                    
+                    if events:
+                        started_at = time.perf_counter()
+                        for _, address, result in events:
+                            changed = await self.apply_shard_result(address, result)
+                            if result.get('overdue'):
+                                MONITOR_ADDRESSES.inc(result='overdue')
+                                MONITOR_OVERRUNS.inc(reason='deadline')
+                                continue
+                            MONITOR_ADDRESSES.inc(result='changed' if changed else 'ok' if result['ok'] else 'failed')
+                        
+                        await self.notifier.flush()
+                        MONITOR_PASS_DURATION.observe(time.perf_counter() - started_at)
+                    
+                    self.shards.check_workers()
+                    
+                except Exception as e:
+                    MONITOR_ERRORS.inc()
+                    logger.error(f"监控循环出错: {str(e)}")
+                    import traceback
+                    logger.error(traceback.format_exc())
+                    await asyncio.sleep(60)  # 出错后等待1分钟再继续
+        finally:
+            share_task.cancel()
+            await asyncio.gather(share_task, return_exceptions=True)
+            await async_api.close()
+            self.shards.close()
+    
+    async def share_loop(self, async_api):
+        """
+        多进程分片模式下，每隔SHARD_SHARE_INTERVAL秒获取一次持有人快照和价格(订阅地址持仓的代币)，
+        发给所有工作进程；持有人快照只在刷新后才发送
+        """
+        shared_at = {}  # 代币 -> 已发出的持有人快照的获取时间
         while self.is_running:
             try:
-                # 遍历所有用户监控的地址
-                for user_id, addresses in monitored_addresses.items():
-                    for address in addresses:
-                        # 获取最新数据
-                        new_data = self.api.get_address_data(address)
-                        if not new_data:
-                            continue
-                            
-                        # 检查是否有缓存数据
-                        old_data = position_cache.get(address)
-                        
-                        # 检测持仓变化
-                        if old_data:
-                            positions_changes = self.api.compare_positions(old_data, new_data)
-                            
-                            # 发送新开仓通知
-                            new_positions = positions_changes.get('new_positions', [])
-                            for position in new_positions:
-                                # 检查价值是否超过阈值
-                                if position.get('value', 0) >= MIN_POSITION_VALUE:
-                                    await self.notify_new_position(user_id, address, position)
-                            
-                            # 发送持仓变化通知
-                            changed_positions = positions_changes.get('changed_positions', [])
-                            for change_info in changed_positions:
-                                # 只通知重大变化
-                                await self.notify_position_change(user_id, address, change_info)
-                        
-                        # 更新缓存
-                        position_cache[address] = new_data
-                        logger.info(f"已更新地址 {address} 的缓存数据")
-                
-                # 等待下一个检查周期
-                await asyncio.sleep(MONITOR_INTERVAL)  
-                
+                tokens = async_api.holdings_tokens
+                snapshots = await asyncio.gather(*(async_api.get_holders_snapshot(token) for token in tokens))
+                holders = {
+                    token: {'holders': snapshot.index, 'holdersCount': snapshot.holders_count}
+                    for token, snapshot in zip(tokens, snapshots)
+                    if snapshot is not None and shared_at.get(token) != snapshot.fetched_at
+                }
+                await async_api.get_token_prices(itertools.chain(tokens, position_cache.tokens()))
+                self.shards.share(holders, async_api.price_service.entries())
+                shared_at.update(
+                    (token, snapshot.fetched_at) for token, snapshot in zip(tokens, snapshots) if snapshot is not None
+                )
             except Exception as e:
-                logger.error(f"监控循环出错: {str(e)}")
-                import traceback
-                logger.error(traceback.format_exc())
-                await asyncio.sleep(60)  # 出错后等待1分钟再继续
+                logger.error(f"获取分片共用的持有人快照和价格时出错: {str(e)}")
+            await asyncio.sleep(SHARD_SHARE_INTERVAL)
+    
+    async def apply_shard_result(self, address, result):
+        """
+        处理工作进程发回的一个地址的结果(变化已在工作进程中检测)
+        返回:
+            bool: 是否检测到持仓变化
+        """
+        if not result['ok']:
+            return False
+        
+        data = result['data']
+        if data is None:
+            # 页面未变化，工作进程没有发回持仓，复用缓存并刷新更新时间
+            cached = position_cache.get(address)
+            if cached is None:
+                return False
+            updated_at = result['updated_at']
+            data = dict(cached, updated_at=updated_at,
+                        positions=[dict(position, updated_at=updated_at) for position in cached.get('positions', [])])
+        
+        await self.dispatch_changes(address, result['changes'], self.scheduler.users(address))
+        self.update_snapshot(address, data)
+        return result['changed']
+    
+    def record_schedule_drift(self):
+        """记录本批地址比计划晚的时间，超过监控间隔时计为超时"""
+        delays = self.scheduler.last_delays
+        for delay in delays:
+            MONITOR_DELAY.observe(delay)
+        drift = max(delays, default=0)
+        MONITOR_DRIFT.set(drift)
+        if drift > MONITOR_INTERVAL:
+            MONITOR_OVERRUNS.inc(reason='drift')
+            logger.warning(f"地址检查比计划晚了 {drift:.1f} 秒，超过监控间隔 {MONITOR_INTERVAL} 秒")
+    
+    def queue_depths(self):
+        """各队列当前长度，供指标采集"""
+        depths = {}
+        if not self.shards:
+            # 分片模式下由工作进程调度，本进程的调度器只维护订阅索引
+            depths[('scheduler_overdue',)] = self.scheduler.overdue()
+        if self.notifier:
+            depths[('notifier',)] = self.notifier.get_stats()['queue_size']
+        if self.store:
+            depths[('state_store',)] = self.store.pending_count()
+        if self.shards:
+            depths[('shard_events',)] = self.shards.events.qsize()
+        if self.pipeline:
+            for stage, depth in self.pipeline.queue_depths().items():
+                depths[(f'pipeline_{stage}',)] = depth
+        return depths
+    
+    def cache_sizes(self):
+        """监控缓存和查询缓存估算占用的内存，供指标采集"""
+        return {('monitor',): position_cache.nbytes(), ('query',): self.query_service.recent.nbytes()}
+    
+    def cache_stats(self):
+        """监控缓存和查询缓存的命中、未命中和移除统计"""
+        return {'monitor': position_cache.get_stats(), 'query': self.query_service.recent.get_stats()}
     
+    async def process_update(self, address, new_data, user_ids):
+        """
+        对比缓存数据(每个地址只比较一次)，并把通知发送给所有订阅者
+        返回:
+            bool: 是否检测到持仓变化
+        """
+        # 检查是否有缓存数据
+        old_data = position_cache.get(address)
+        changed = False
+        
+        # 检测持仓变化
+        if old_data:
+            changes, changed = significant_changes(
+                self.api.detect_changes(old_data, new_data, self.cached_prices())
+            )
+            await self.dispatch_changes(address, changes, user_ids)
+        
+        # 更新缓存
+        self.update_snapshot(address, new_data)
+        logger.info(f"已更新地址 {address} 的缓存数据")
+        return changed
+    
+    async def dispatch_changes(self, address, changes, user_ids):
+        """把一个地址需要通知的变化(significant_changes的结果)发送给所有订阅者"""
+        for user_id in user_ids:
+            # 发送新开仓通知
+            for position in changes.get('new_positions', []):
+                await self.notify_new_position(user_id, address, position)
+            
+            # 发送持仓变化通知
+            for change_info in changes.get('changed_positions', []):
+                # 只通知重大变化
+                await self.notify_position_change(user_id, address, change_info)
+            
+            # 发送平仓/清算通知
+            for closed_info in changes.get('closed_positions', []):
+                await self.notify_position_closed(user_id, address, closed_info)
+            
+            # 发送反手通知
+            for flip_info in changes.get('flipped_positions', []):
+                await self.notify_position_flipped(user_id, address, flip_info)
+            
+            # 发送清算预警
+            for liquidation_info in changes.get('near_liquidation', []):
+                await self.notify_near_liquidation(user_id, address, liquidation_info)
+    
+    def cached_prices(self):
+        """价格服务中仍可用的代币价格(不发起请求)"""
+        return self.api.price_service.cached_prices()
+    
+    @timed(NOTIFY_DURATION, kind='new_position')
     async def notify_new_position(self, user_id, address, position):
         """发送新开仓通知"""
         token = position.get('token', 'Unknown')
@@ -154,16 +676,10 @@ class HyperMonitorBot:
         if liquidation_price:
             message += f"⚠️ <b>清算价</b>: ${liquidation_price:,.4f}\n"
         
-        try:
-            self.updater.bot.send_message(
-                chat_id=user_id,
-                text=message,
-                parse_mode=ParseMode.HTML
-            )
-            logger.info(f"已向用户 {user_id} 发送新开仓通知: {token} {direction}")
-        except Exception as e:
-            logger.error(f"发送通知失败: {str(e)}")
+        self.notifier.add(user_id, message)
+        logger.info(f"已将发给用户 {user_id} 的新开仓通知加入发送队列: {token} {direction}")
     
+    @timed(NOTIFY_DURATION, kind='position_change')
     async def notify_position_change(self, user_id, address, change_info):
         """发送持仓变化通知"""
         position = change_info.get('position', {})
@@ -184,24 +700,106 @@ class HyperMonitorBot:
         message += f"💰 <b>当前价值</b>: ${value:,.2f}\n"
         message += f"🔄 <b>变化</b>: {change_text} {change_percent:.2f}%\n"
         
-        try:
-            self.updater.bot.send_message(
-                chat_id=user_id,
-                text=message,
-                parse_mode=ParseMode.HTML
-            )
-            logger.info(f"已向用户 {user_id} 发送持仓变化通知: {token} {direction} {change_text} {change_percent:.2f}%")
-        except Exception as e:
-            logger.error(f"发送通知失败: {str(e)}")
+        self.notifier.add(user_id, message)
+        logger.info(f"已将发给用户 {user_id} 的持仓变化通知加入发送队列: {token} {direction} {change_text} {change_percent:.2f}%")
+    
+    @timed(NOTIFY_DURATION, kind='position_closed')
+    async def notify_position_closed(self, user_id, address, closed_info):
+        """发送平仓/清算通知"""
+        position = closed_info.get('position', {})
+        liquidated = closed_info.get('liquidated', False)
+        
+        token = position.get('token', 'Unknown')
+        direction = position.get('direction', 'Unknown')
+        value = position.get('value', 0)
+        liquidation_price = position.get('liquidation_price', 0)
+        
+        if liquidated:
+            message = "💥 <b>疑似被清算</b> 💥\n\n"
+        else:
+            message = "🔒 <b>平仓提醒</b> 🔒\n\n"
+        message += f"📊 <b>地址</b>: <code>{address}</code>\n"
+        message += f"🪙 <b>代币</b>: {token}\n"
+        message += f"📈 <b>方向</b>: {'做多' if direction == 'LONG' else '做空'}\n"
+        message += f"💰 <b>平仓前价值</b>: ${value:,.2f}\n"
+        if liquidation_price:
+            message += f"⚠️ <b>清算价</b>: ${liquidation_price:,.4f}\n"
+        
+        self.notifier.add(user_id, message)
+        logger.info(f"已将发给用户 {user_id} 的{'清算' if liquidated else '平仓'}通知加入发送队列: {token} {direction}")
+    
+    @timed(NOTIFY_DURATION, kind='position_flipped')
+    async def notify_position_flipped(self, user_id, address, flip_info):
+        """发送反手通知"""
+        position = flip_info.get('position', {})
+        previous = flip_info.get('previous', {})
+        
+        token = position.get('token', 'Unknown')
+        direction = position.get('direction', 'Unknown')
+        value = position.get('value', 0)
+        previous_value = previous.get('value', 0)
+        
+        message = "🔁 <b>反手提醒</b> 🔁\n\n"
+        message += f"📊 <b>地址</b>: <code>{address}</code>\n"
+        message += f"🪙 <b>代币</b>: {token}\n"
+        message += f"📈 <b>方向</b>: {'做空 → 做多' if direction == 'LONG' else '做多 → 做空'}\n"
+        message += f"💰 <b>当前价值</b>: ${value:,.2f} (之前 ${previous_value:,.2f})\n"
+        message += f"⚡ <b>杠杆</b>: {position.get('leverage', 0)}x\n"
+        
+        self.notifier.add(user_id, message)
+        logger.info(f"已将发给用户 {user_id} 的反手通知加入发送队列: {token} {direction}")
+    
+    @timed(NOTIFY_DURATION, kind='near_liquidation')
+    async def notify_near_liquidation(self, user_id, address, liquidation_info):
+        """发送清算预警"""
+        position = liquidation_info.get('position', {})
+        price = liquidation_info.get('price', 0)
+        distance_percent = liquidation_info.get('distance_percent', 0)
+        
+        token = position.get('token', 'Unknown')
+        direction = position.get('direction', 'Unknown')
+        value = position.get('value', 0)
+        liquidation_price = position.get('liquidation_price', 0)
+        
+        message = "⚠️ <b>清算预警</b> ⚠️\n\n"
+        message += f"📊 <b>地址</b>: <code>{address}</code>\n"
+        message += f"🪙 <b>代币</b>: {token}\n"
+        message += f"📈 <b>方向</b>: {'做多' if direction == 'LONG' else '做空'}\n"
+        message += f"💰 <b>价值</b>: ${value:,.2f}\n"
+        message += f"💵 <b>当前价</b>: ${price:,.4f}\n"
+        message += f"🎯 <b>清算价</b>: ${liquidation_price:,.4f} (距离 {distance_percent:.2f}%)\n"
+        
+        self.notifier.add(user_id, message)
+        logger.info(f"已将发给用户 {user_id} 的清算预警加入发送队列: {token} {direction} 距离 {distance_percent:.2f}%")
     
     def stop(self):
         """停止机器人"""
         # 设置停止标志，异步循环会自行结束
         self.is_running = False
+        self._stopped.set()
+        
+        # 等待监控线程结束，之后不会再有新的快照写入，关闭存储时不会丢失最后一批
+        if self.monitor_thread and self.monitor_thread.is_alive():
+            self.monitor_thread.join(timeout=MONITOR_TICK * 2)
+        
+        self.query_service.close()
+        
+        if self.shards:
+            self.shards.close()
+        
+        # 发送队列中剩余的通知
+        if self.notifier:
+            self.notifier.close()
         
         if self.updater:
             self.updater.stop()
         
+        # 写入尚未落盘的持仓快照和历史
+        if self.store:
+            self.store.close()
+        if self.history:
+            self.history.close()
+        
         logger.info("机器人已停止")
     
     def is_authorized(self, user_id):
@@ -221,8 +819,8 @@ class HyperMonitorBot:
             return
         
         # 初始化用户的监控地址列表
-        if user_id not in monitored_addresses:
-            monitored_addresses[user_id] = [DEFAULT_ADDRESS]
+        if not monitored_addresses.addresses(user_id):
+            self.add_subscription(user_id, DEFAULT_ADDRESS)
         
         message = (
             f"👋 你好 {user.first_name}!\n\n"
@@ -249,6 +847,8 @@ class HyperMonitorBot:
             "/stop_monitor [地址] - 停止监控指定地址\n"
             "/add_address - 添加新的监控地址\n"
             "/status - 查看当前监控状态\n"
+            "/whales [代币] [数量] - 查看持有人排行和增持/减持最多的地址\n"
+            "/rank [地址] [代币] - 查看地址的持有排名\n"
             "/help - 显示此帮助信息"
         )
         
@@ -263,18 +863,32 @@ class HyperMonitorBot:
             return
         
         # 获取参数中的地址，如果没有提供则使用默认地址
-        address = context.args[0] if context.args else DEFAULT_ADDRESS
+        address = normalize_address(context.args[0] if context.args else DEFAULT_ADDRESS)
+        
+        # 监控缓存中有足够新的数据时直接回复
+        data = self.query_service.cached(address)
+        if data:
+            update.message.reply_text(self.format_address_data(address, data), parse_mode=ParseMode.HTML)
+            return
         
         # 发送等待消息
         wait_message = update.message.reply_text("正在查询数据，请稍候...")
         
-        # 获取数据
-        data = self.api.get_address_data(address)
-        
-        if not data:
-            wait_message.edit_text(f"无法获取地址 {address} 的数据，请确保地址正确。")
-            return
+        # 在线程池中获取数据，完成后再编辑消息，不阻塞命令处理线程
+        def reply(future):
+            try:
+                data = future.result()
+                if not data:
+                    wait_message.edit_text(f"无法获取地址 {address} 的数据，请确保地址正确。")
+                    return
+                wait_message.edit_text(self.format_address_data(address, data), parse_mode=ParseMode.HTML)
+            except Exception as e:
+                logger.error(f"回复查询结果时出错: {str(e)}")
         
+        self.query_service.fetch(address).add_done_callback(reply)
+    
+    def format_address_data(self, address, data):
+        """构建/query的响应消息"""
         # 构建响应消息
         message = f"📊 <b>{address}</b> 持仓情况\n\n"
         
@@ -287,6 +901,8 @@ class HyperMonitorBot:
         
         message += f"🔄 <b>Perps ({perps.get('count', 0)})</b>: ${perps.get('value', 0):,.2f}\n"
         message += f"💱 <b>Spot ({spot.get('count', 0)})</b>: ${spot.get('value', 0):,.2f}\n"
+        if spot.get('unpriced'):
+            message += f"    (不含暂无价格的代币: {', '.join(spot['unpriced'])})\n"
         message += f"🏦 <b>Vault</b>: ${vault.get('value', 0):,.2f}\n"
         message += f"⚓ <b>Staked</b>: ${staked.get('value', 0):,.2f}\n\n"
         
@@ -327,8 +943,7 @@ class HyperMonitorBot:
             update_time = datetime.fromtimestamp(data['updated_at']).strftime('%Y-%m-%d %H:%M:%S')
             message += f"\n🕒 <b>更新时间</b>: {update_time}"
         
-        # 发送消息
-        wait_message.edit_text(message, parse_mode=ParseMode.HTML)
+        return message
     
     def cmd_monitor(self, update: Update, context: CallbackContext):
         """处理/monitor命令"""
@@ -339,25 +954,21 @@ class HyperMonitorBot:
             return
         
         # 获取参数中的地址，如果没有提供则使用默认地址
-        address = context.args[0] if context.args else DEFAULT_ADDRESS
-        
-        # 初始化用户的监控地址列表
-        if user_id not in monitored_addresses:
-            monitored_addresses[user_id] = []
+        address = normalize_address(context.args[0] if context.args else DEFAULT_ADDRESS)
         
         # 检查地址是否已经在监控列表中
-        if address in monitored_addresses[user_id]:
+        if monitored_addresses.contains(user_id, address):
             update.message.reply_text(f"已经在监控地址 {address}")
             return
         
         # 添加到监控列表
-        monitored_addresses[user_id].append(address)
+        self.add_subscription(user_id, address)
         
-        # 初始化持仓缓存
+        # 初始化持仓缓存(刚查询过的地址直接使用查询结果)
         if address not in position_cache:
-            data = self.api.get_address_data(address)
+            data = self.query_service.take(address) or self.api.get_address_data(address)
             if data:
-                position_cache[address] = data
+                self.update_snapshot(address, data)
         
         update.message.reply_text(f"开始监控地址: {address}")
     
@@ -374,16 +985,16 @@ class HyperMonitorBot:
             update.message.reply_text("请指定要停止监控的地址。")
             return
             
-        address = context.args[0]
+        address = normalize_address(context.args[0])
         
         # 检查用户是否有监控地址
-        if user_id not in monitored_addresses or not monitored_addresses[user_id]:
+        if not monitored_addresses.addresses(user_id):
             update.message.reply_text("您当前没有监控任何地址。")
             return
         
         # 从监控列表中移除
-        if address in monitored_addresses[user_id]:
-            monitored_addresses[user_id].remove(address)
+        if monitored_addresses.contains(user_id, address):
+            self.remove_subscription(user_id, address)
             update.message.reply_text(f"已停止监控地址: {address}")
         else:
             update.message.reply_text(f"未找到监控地址: {address}")
@@ -408,23 +1019,20 @@ class HyperMonitorBot:
         if not address.startswith("0x") or len(address) != 42:
             update.message.reply_text("地址格式不正确，请输入有效的以太坊地址。")
             return WAITING_ADDRESS
-        
-        # 初始化用户的监控地址列表
-        if user_id not in monitored_addresses:
-            monitored_addresses[user_id] = []
+        address = normalize_address(address)
         
         # 检查地址是否已经在监控列表中
-        if address in monitored_addresses[user_id]:
+        if monitored_addresses.contains(user_id, address):
             update.message.reply_text(f"已经在监控地址 {address}")
         else:
             # 添加到监控列表
-            monitored_addresses[user_id].append(address)
+            self.add_subscription(user_id, address)
             
-            # 初始化持仓缓存
+            # 初始化持仓缓存(刚查询过的地址直接使用查询结果)
             if address not in position_cache:
-                data = self.api.get_address_data(address)
+                data = self.query_service.take(address) or self.api.get_address_data(address)
                 if data:
-                    position_cache[address] = data
+                    self.update_snapshot(address, data)
             
             update.message.reply_text(f"已添加监控地址: {address}")
         
@@ -443,20 +1051,124 @@ class HyperMonitorBot:
             update.message.reply_text("抱歉，您没有使用此机器人的权限。")
             return
         
-        # 检查用户是否有监控地址
-        if user_id not in monitored_addresses or not monitored_addresses[user_id]:
+        # 检查用户是否有监控地址(取一次当前版本，期间的订阅修改不影响本次输出)
+        addresses = monitored_addresses.addresses(user_id)
+        if not addresses:
             update.message.reply_text("您当前没有监控任何地址。")
             return
         
         # 构建状态消息
         message = "📋 <b>当前监控状态</b>\n\n"
-        message += f"监控地址数量: {len(monitored_addresses[user_id])}\n\n"
+        message += f"监控地址数量: {len(addresses)}\n\n"
         
-        for i, address in enumerate(monitored_addresses[user_id], 1):
+        for i, address in enumerate(addresses, 1):
             message += f"{i}. <code>{address}</code>\n"
         
         update.message.reply_text(message, parse_mode=ParseMode.HTML)
     
+    def holders_token(self, token):
+        """
+        规范化/whales和/rank的代币参数(大写)，只允许HOLDINGS_TOKENS中的代币，避免为任意代币下载和缓存快照
+        返回:
+            str: 配置中的代币符号，不支持时返回None
+        """
+        tokens = {symbol.upper(): symbol for symbol in self.api.holdings_tokens}
+        return tokens.get(token.strip().upper())
+    
+    def reply_when_done(self, wait_message, future):
+        """Future完成后把结果(消息文本)编辑到等待消息中"""
+        def reply(future):
+            try:
+                wait_message.edit_text(future.result(), parse_mode=ParseMode.HTML)
+            except Exception as e:
+                logger.error(f"回复查询结果时出错: {str(e)}")
+        future.add_done_callback(reply)
+    
+    def cmd_whales(self, update: Update, context: CallbackContext):
+        """处理/whales命令：持有人排行和增减持排行(使用缓存的持有人快照)"""
+        user_id = update.effective_user.id
+        
+        if not self.is_authorized(user_id):
+            update.message.reply_text("抱歉，您没有使用此机器人的权限。")
+            return
+        
+        token = self.holders_token(context.args[0] if context.args else "HYPE")
+        if not token:
+            update.message.reply_text(f"只支持查询以下代币的持有人: {', '.join(self.api.holdings_tokens)}")
+            return
+        limit = 10
+        if len(context.args) > 1 and context.args[1].isdigit():
+            limit = min(max(int(context.args[1]), 1), WHALES_MAX_COUNT)
+        
+        # 下载快照和构建排名可能较慢，在线程池中进行，完成后再编辑消息，不阻塞命令处理线程
+        wait_message = update.message.reply_text("正在查询数据，请稍候...")
+        self.reply_when_done(wait_message, self.query_service.submit(self.format_whales, token, limit))
+    
+    def format_whales(self, token, limit):
+        """构建/whales的响应消息"""
+        snapshot = self.api.get_holders_snapshot(token)
+        if not snapshot:
+            return f"无法获取 {token} 的持有人数据，请稍后再试。"
+        
+        message = f"🐋 <b>{token} 持有人排行</b>\n\n"
+        message += f"持有人数量: {len(snapshot.ranking)}\n\n"
+        for i, (address, amount) in enumerate(snapshot.top(limit), 1):
+            message += f"{i}. <code>{address}</code> {amount:,.2f}\n"
+        
+        # 与上一次刷新前的快照比较，不额外请求
+        previous = self.api.holders_cache.previous(token)
+        if previous:
+            diff = snapshot.diff(previous, min(limit, 5))
+            minutes = (snapshot.fetched_at - previous.fetched_at) / 60
+            message += f"\n📈 <b>近 {minutes:.0f} 分钟增持最多</b>\n"
+            for address, _, _, delta in diff['accumulators']:
+                message += f"<code>{address}</code> +{delta:,.2f}\n"
+            if not diff['accumulators']:
+                message += "无\n"
+            message += f"\n📉 <b>近 {minutes:.0f} 分钟减持最多</b>\n"
+            for address, _, _, delta in diff['distributors']:
+                message += f"<code>{address}</code> {delta:,.2f}\n"
+            if not diff['distributors']:
+                message += "无\n"
+        else:
+            message += "\n暂无更早的快照，持有人数据下次刷新后可查看增持/减持排行。"
+        return message
+    
+    def cmd_rank(self, update: Update, context: CallbackContext):
+        """处理/rank命令：地址的持有排名"""
+        user_id = update.effective_user.id
+        
+        if not self.is_authorized(user_id):
+            update.message.reply_text("抱歉，您没有使用此机器人的权限。")
+            return
+        
+        address = normalize_address(context.args[0] if context.args else DEFAULT_ADDRESS)
+        token = self.holders_token(context.args[1] if len(context.args) > 1 else "HYPE")
+        if not token:
+            update.message.reply_text(f"只支持查询以下代币的持有人: {', '.join(self.api.holdings_tokens)}")
+            return
+        
+        wait_message = update.message.reply_text("正在查询数据，请稍候...")
+        self.reply_when_done(wait_message, self.query_service.submit(self.format_rank, address, token))
+    
+    def format_rank(self, address, token):
+        """构建/rank的响应消息"""
+        snapshot = self.api.get_holders_snapshot(token)
+        if not snapshot:
+            return f"无法获取 {token} 的持有人数据，请稍后再试。"
+        
+        rank = snapshot.rank(address)
+        message = f"🏅 <b>{token} 持有排名</b>\n\n"
+        message += f"地址: <code>{address}</code>\n"
+        if rank['rank'] is None:
+            message += f"该地址未持有 {token}。"
+        else:
+            message += f"持有量: {rank['amount']:,.2f}\n"
+            message += f"排名: #{rank['rank']} / {rank['holders']}\n"
+            message += f"超过 {rank['percentile']:.2f}% 的持有人\n"
+            message += f"占总持有量: {rank['share']:.4f}%"
+        return message
+    
     def error_handler(self, update, context):
         """处理错误"""
         logger.error(f"更新 {update} 导致错误 {context.error}")
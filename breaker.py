@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+from collections import Counter, deque
+from urllib.parse import urlparse
+
+from config import BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN, BREAKER_WINDOW
+from metrics import ENDPOINT_DURATION, ENDPOINT_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# 熔断器状态
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """接口处于熔断状态，请求未发出"""
+
+
+def endpoint_for(url):
+    """URL所属的接口: 主机 + 第一段路径，例如 api.hypurrscan.io/tokens、hypurrscan.io/address"""
+    parsed = urlparse(url)
+    segment = parsed.path.strip('/').split('/', 1)[0]
+    return f"{parsed.hostname or ''}/{segment}"
+
+
+class CircuitBreaker:
+    """
+    单个接口的熔断器
+    - closed: 正常放行；连续失败达到failure_threshold次后打开
+    - open: cooldown秒内直接拒绝，不再发请求
+    - half_open: 冷却结束后只放行一个探测请求，成功则关闭，失败则重新打开
+      (探测请求被取消、没有结果时，cooldown秒后再放行下一个)
+    同时记录最近window次请求的耗时和结果，用于统计错误率和延迟
+    """
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN,
+                 window=BREAKER_WINDOW):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0  # 连续失败次数
+        self.opened_at = None
+        self._probing = False
+        self._probe_at = None
+        self._recent = deque(maxlen=window)  # (耗时, 是否成功)
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def allow(self):
+        """是否允许发送请求(半开状态下只有第一个调用者获得探测名额)"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                self._probing = False
+                logger.info(f"接口 {self.name} 冷却结束，发送探测请求")
+            now = time.monotonic()
+            if self.state == HALF_OPEN and (not self._probing or now - self._probe_at >= self.cooldown):
+                self._probing = True
+                self._probe_at = now
+                return True
+            self.stats['rejected'] += 1
+        ENDPOINT_REQUESTS.inc(endpoint=self.name, result='rejected')
+        return False
+
+    def available(self):
+        """是否可能放行请求(不占用半开状态的探测名额)"""
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at >= self.cooldown
+            return self.state == CLOSED or not self._probing or time.monotonic() - self._probe_at >= self.cooldown
+
+    def record(self, ok, duration):
+        """记录一次请求的结果和耗时"""
+        with self._lock:
+            self._recent.append((duration, ok))
+            self.stats['success' if ok else 'failure'] += 1
+            if ok:
+                if self.state != CLOSED:
+                    logger.info(f"接口 {self.name} 已恢复")
+                self.state = CLOSED
+                self.failures = 0
+                self._probing = False
+            else:
+                self.failures += 1
+                if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                    self.state = OPEN
+                    self.opened_at = time.monotonic()
+                    self._probing = False
+                    self.stats['opened'] += 1
+                    logger.warning(f"接口 {self.name} 连续失败 {self.failures} 次，熔断 {self.cooldown} 秒")
+        ENDPOINT_REQUESTS.inc(endpoint=self.name, result='success' if ok else 'failure')
+        ENDPOINT_DURATION.observe(duration, endpoint=self.name)
+
+    def get_stats(self):
+        """返回状态、计数、最近window次请求的错误率和平均/最大耗时"""
+        with self._lock:
+            recent = list(self._recent)
+            stats = dict(self.stats)
+            stats['state'] = self.state
+        durations = [duration for duration, _ in recent]
+        stats['error_rate'] = sum(1 for _, ok in recent if not ok) / len(recent) if recent else 0.0
+        stats['latency_avg'] = sum(durations) / len(durations) if durations else 0.0
+        stats['latency_max'] = max(durations, default=0.0)
+        return stats
+
+
+class EndpointHealth:
+    """
+    按接口划分的健康状态，每个接口一个熔断器
+    所有对hypurrscan.io的请求共享同一个实例
+    """
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN, window=BREAKER_WINDOW):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.window = window
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, url):
+        """URL所属接口的熔断器"""
+        name = endpoint_for(url)
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name, self.failure_threshold, self.cooldown, self.window)
+                self._breakers[name] = breaker
+            return breaker
+
+    def available(self, url):
+        """URL所属接口是否可用，用于决定是否直接走备用路径"""
+        return self.breaker(url).available()
+
+    def states(self):
+        """各接口的状态(0: closed，1: half_open，2: open)，供指标采集"""
+        codes = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {(breaker.name,): codes[breaker.state] for breaker in breakers}
+
+    def get_stats(self):
+        """返回 接口 -> 统计 的字典"""
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.name: breaker.get_stats() for breaker in breakers}
+
+
+# 全局共享的接口健康状态
+endpoint_health = EndpointHealth()
@@ -10,17 +10,136 @@ TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 # 默认监控的钱包地址
 DEFAULT_ADDRESS = "0xf3F496C9486BE5924a93D67e98298733Bb47057c"
 
-# Hyperscan 基础URL
-HYPERSCAN_BASE_URL = "https://hypurrscan.io"
+# Hyperscan 基础URL(可通过环境变量指向本地模拟服务器，见benchmarks/mock_server.py)
+HYPERSCAN_BASE_URL = os.getenv("HYPERSCAN_BASE_URL", "https://hypurrscan.io")
 
 # Hyperscan API 基础URL
-HYPERSCAN_API_BASE_URL = "https://api.hypurrscan.io"
+HYPERSCAN_API_BASE_URL = os.getenv("HYPERSCAN_API_BASE_URL", "https://api.hypurrscan.io")
 
 # 监控间隔(秒)
 MONITOR_INTERVAL = 120  # 2分钟
 
+# 持有人快照缓存有效期(秒)，与监控间隔一致，保证每个监控周期只下载一次
+HOLDERS_CACHE_TTL = MONITOR_INTERVAL
+
+# 跟踪现货持有量的代币(逗号分隔)，每个代币每个周期下载一次持有人快照，所有地址共用
+HOLDINGS_TOKENS = [token.strip() for token in os.getenv("HOLDINGS_TOKENS", "HYPE").split(",") if token.strip()]
+
+# 自适应轮询：每个地址有独立的检查间隔(秒)
+MONITOR_MIN_INTERVAL = 30  # 最近检测到持仓变化的地址
+MONITOR_ACTIVE_INTERVAL = 60  # 持有杠杆仓位的地址
+MONITOR_MAX_INTERVAL = 900  # 长期无仓位地址的退避上限
+MONITOR_BACKOFF_FACTOR = 1.5  # 每次无变化时间隔的增长倍数
+
+# 全局每秒最多检查的地址数
+MONITOR_REQUESTS_PER_SECOND = 5
+
+# 监控循环最长休眠时间(秒)，保证新增的订阅能及时被调度
+MONITOR_TICK = 5
+
+# 获取期限(秒)：单个地址(分片模式下为一批地址)的获取超过该时间即取消，已完成的地址照常比较和通知，
+# 未完成的地址放到队列最前面下一批优先检查；连续超时MONITOR_DEADLINE_RETRIES次后按获取失败处理
+MONITOR_DEADLINE = 45
+MONITOR_DEADLINE_RETRIES = 2
+
+# 监控流水线(获取 → 解析 → 比较 → 通知)：各阶段的并发数和阶段之间队列的容量
+# 下游队列满时上游阶段等待(背压)，调度器不会取出超过流水线容量的地址
+PIPELINE_FETCH_WORKERS = 16
+PIPELINE_PARSE_WORKERS = 4  # 解析在线程池中进行，与网络请求重叠
+PIPELINE_DIFF_WORKERS = 2
+PIPELINE_QUEUE_SIZE = 100
+
+# 代币价格缓存(秒)：有效期内直接使用；过期后的窗口内先返回旧价格并在后台刷新
+PRICE_CACHE_TTL = 30
+PRICE_STALE_TTL = 300
+# 网页抓取价格失败的代币在该时间内不再尝试网页抓取(秒)；API和网页都没有得到价格的代币在该时间内不再请求
+PRICE_NEGATIVE_TTL = 600
+
+# 地址页面持仓提取引擎: lxml(默认) / streaming(读完持仓区域即停止) / bs4(原BeautifulSoup解析)
+# 页面内嵌JSON数据时所有引擎都会直接读取JSON，跳过DOM构建
+HTML_EXTRACTOR = 'lxml'
+
+# HTTP请求超时(秒)
+HTTP_TIMEOUT = 30
+
+# 每个主机每秒允许的请求数(令牌桶)，未列出的主机使用默认值
+HOST_RATE_LIMITS = {
+    'api.hypurrscan.io': 5,
+    'hypurrscan.io': 3,
+}
+DEFAULT_HOST_RATE_LIMIT = 5
+
+# 失败重试：429/5xx/网络错误时按带抖动的指数退避重试
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_BASE = 1.0  # 秒
+HTTP_BACKOFF_MAX = 30.0  # 秒
+HTTP_RETRY_AFTER_MAX = 120.0  # Retry-After最长等待(秒)
+
+# 接口熔断：同一接口(主机 + 第一段路径)连续失败BREAKER_FAILURE_THRESHOLD次后，BREAKER_COOLDOWN秒内不再请求，
+# 冷却结束后先放行一个探测请求；BREAKER_WINDOW为统计错误率和延迟的最近请求数
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_COOLDOWN = 30
+BREAKER_WINDOW = 100
+
+# 异步客户端同时进行的最大请求数
+API_MAX_CONCURRENCY = 10
+
+# 异步客户端连接池大小(长连接复用)
+API_CONNECTION_LIMIT = 20
+
+# 状态数据库路径(订阅和持仓快照)，重启后自动恢复
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "hyper_monitor.db")
+
+# 持仓快照批量写入：累计到指定数量或超过指定秒数时落盘
+STATE_BATCH_SIZE = 100
+STATE_FLUSH_INTERVAL = 5
+
+# 持仓历史目录(按天分区的列式存储)，每次获取的持仓都会追加写入
+HISTORY_DIR = os.getenv("HISTORY_DIR", "history")
+HISTORY_BATCH_SIZE = 1000  # 缓冲的行数达到该值时写入磁盘
+HISTORY_FLUSH_INTERVAL = 60  # 距离上次写入超过该秒数时也写入(地址少时不必等缓冲区满)
+
+# Telegram通知发送：发送线程数和队列容量(队列满时监控循环退避等待，不丢弃提醒)
+NOTIFY_WORKERS = 4
+NOTIFY_QUEUE_SIZE = 1000
+
+# Telegram速率限制：全局每秒消息数，单个聊天每秒消息数及突发上限
+NOTIFY_GLOBAL_RATE = 25
+NOTIFY_CHAT_RATE = 1
+NOTIFY_CHAT_BURST = 3
+
+# 发送失败(限流/网络错误)的重试次数和最长退避(秒)
+NOTIFY_MAX_RETRIES = 3
+NOTIFY_BACKOFF_MAX = 30.0
+
+# /query命令：监控缓存中的快照在该时间内(秒)直接使用，否则重新获取
+QUERY_MAX_AGE = 60
+# /query命令的后台获取线程数
+QUERY_WORKERS = 4
+# 只被/query查询过的地址的缓存内存上限(字节)，超过时移除最久未使用的地址
+QUERY_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+# /whales命令最多显示的持有人数量
+WHALES_MAX_COUNT = 50
+
+# 本地指标服务(Prometheus文本格式，GET /metrics)，端口为0时不启动
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# 多进程分片监控：地址按一致性哈希分配给多个工作进程获取和解析，变化事件发回主进程发送通知
+# 0或1表示在主进程中单线程监控；每秒请求预算和主机限流在工作进程间平分
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))
+# 一致性哈希环上每个工作进程的虚拟节点数(越多分配越均匀)
+SHARD_VIRTUAL_NODES = 64
+# 主进程获取持有人快照和价格、再发给各工作进程的间隔(秒)
+# 小于价格缓存有效期，工作进程不必各自请求，每个周期只下载一次
+SHARD_SHARE_INTERVAL = PRICE_CACHE_TTL / 2
+
 # 授权的用户ID列表(只有这些用户可以使用机器人)
 AUTHORIZED_USERS = [int(id) for id in os.getenv("AUTHORIZED_USERS", "").split(",") if id]
 
 # 开仓警报阈值
-MIN_POSITION_VALUE = 5000  # 美元 
\ No newline at end of file
+MIN_POSITION_VALUE = 5000  # 美元
+
+# 清算预警：当前价格距清算价小于该比例时提醒
+LIQUIDATION_ALERT_DISTANCE = 0.05  # 5% 
\ No newline at end of file
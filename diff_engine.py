@@ -0,0 +1,347 @@
+import threading
+
+import numpy as np
+
+from config import LIQUIDATION_ALERT_DISTANCE, MIN_POSITION_VALUE
+
+# 价值变化超过该比例视为重大变化(与compare_positions一致)
+CHANGE_THRESHOLD = 0.1
+
+# 反向持仓方向
+OPPOSITE_DIRECTION = {'LONG': 'SHORT', 'SHORT': 'LONG'}
+
+
+def current_price(position, prices=None):
+    """
+    持仓代币的当前价格
+    优先使用已缓存的代币价格(不发起请求)，没有时用持仓价值/数量推算标记价格
+    """
+    price = (prices or {}).get(position.get('token'))
+    if price:
+        return price
+    quantity = position.get('quantity') or 0
+    if quantity > 0:
+        return (position.get('value') or 0) / quantity
+    return None
+
+
+def liquidation_distance(position, price):
+    """当前价格距清算价的比例，无法计算时返回None"""
+    liquidation_price = position.get('liquidation_price') or 0
+    if liquidation_price <= 0 or not price:
+        return None
+    return abs(price - liquidation_price) / price
+
+
+def is_near_liquidation(position, prices=None):
+    """持仓是否接近清算价，返回距离比例或None"""
+    distance = liquidation_distance(position, current_price(position, prices))
+    if distance is not None and distance <= LIQUIDATION_ALERT_DISTANCE:
+        return distance
+    return None
+
+
+def is_liquidated(position, prices=None):
+    """已消失的持仓按当前缓存价格判断是否已越过清算价"""
+    price = (prices or {}).get(position.get('token'))
+    liquidation_price = position.get('liquidation_price') or 0
+    if not price or liquidation_price <= 0:
+        return False
+    if position.get('direction') == 'LONG':
+        return price <= liquidation_price
+    return price >= liquidation_price
+
+
+class LiquidationAlertState:
+    """
+    清算预警的去重状态：记录每个地址已经提醒过、仍在预警区间内的持仓键
+    持仓离开预警区间(或已平仓)后清除记录，再次进入时重新提醒
+    监控期间持仓可能一直停留在预警区间内，不能只根据持仓本身判断是否已提醒过
+    """
+    def __init__(self):
+        self._alerted = {}  # 地址 -> 已提醒的持仓键(frozenset)
+        self._lock = threading.Lock()
+
+    def filter(self, address, alerts, key):
+        """
+        过滤掉已经提醒过的清算预警，并把当前在预警区间内的持仓记为已提醒
+        参数:
+            address (str): 钱包地址
+            alerts (list): 当前在预警区间内的持仓(compare_positions返回的near_liquidation)
+            key (callable): 持仓 -> 持仓键
+        返回:
+            list: 刚进入预警区间、需要提醒的持仓
+        """
+        keys = frozenset(key(alert['position']) for alert in alerts)
+        with self._lock:
+            alerted = self._alerted.get(address, frozenset())
+            if keys:
+                self._alerted[address] = keys
+            else:
+                self._alerted.pop(address, None)
+        return [alert for alert in alerts if key(alert['position']) not in alerted]
+
+    def forget(self, address):
+        """地址不再被监控时清除记录"""
+        with self._lock:
+            self._alerted.pop(address, None)
+
+
+def significant_changes(changes):
+    """
+    过滤出需要通知的变化：新开仓、平仓和反手只通知价值不低于MIN_POSITION_VALUE的持仓
+    参数:
+        changes (dict): compare_positions的返回值
+    返回:
+        tuple: (需要通知的变化, 是否有任何变化(用于调整轮询间隔))
+    """
+    changes = changes or {}
+    changed = any(changes.get(kind) for kind in (
+        'new_positions', 'changed_positions', 'closed_positions', 'flipped_positions', 'near_liquidation'
+    ))
+    significant = {
+        'new_positions': [
+            position for position in changes.get('new_positions', [])
+            if position.get('value', 0) >= MIN_POSITION_VALUE
+        ],
+        'changed_positions': changes.get('changed_positions', []),
+        'closed_positions': [
+            closed_info for closed_info in changes.get('closed_positions', [])
+            if closed_info['position'].get('value', 0) >= MIN_POSITION_VALUE
+        ],
+        'flipped_positions': [
+            flip_info for flip_info in changes.get('flipped_positions', [])
+            if flip_info['position'].get('value', 0) >= MIN_POSITION_VALUE
+        ],
+        'near_liquidation': changes.get('near_liquidation', []),
+    }
+    return significant, changed
+
+
+class PositionFrame:
+    """
+    多个地址的持仓，按列存放在NumPy数组中
+    address: 地址编号  key: 持仓键编号  opposite: 反向持仓键编号(-1表示不存在)
+    value/quantity/liquidation_price: 持仓数值  cached_price: 已缓存的代币价格(NaN表示没有)
+    positions: 原始持仓字典(用于输出)
+    """
+    __slots__ = ('address', 'key', 'opposite', 'value', 'quantity', 'liquidation_price',
+                 'cached_price', 'positions')
+
+    def __init__(self, snapshots, address_ids, key_ids, prices=None):
+        prices = prices or {}
+        addresses, keys, opposites, positions = [], [], [], []
+        values, quantities, liquidation_prices, cached_prices = [], [], [], []
+        for address, data in snapshots.items():
+            if not data or address not in address_ids:
+                continue
+            rows = data.get('positions', [])
+            addresses.extend([address_ids[address]] * len(rows))
+            # 持仓键与HyperscanAPI._get_position_key一致；
+            # setdefault的默认值在插入前求值，新键的编号即为当前键数
+            keys.extend([
+                key_ids.setdefault(f"{p.get('token', '')}_{p.get('direction', '')}", len(key_ids))
+                for p in rows
+            ])
+            opposites.extend([
+                key_ids.get(f"{p.get('token', '')}_{OPPOSITE_DIRECTION[p.get('direction')]}", -1)
+                if p.get('direction') in OPPOSITE_DIRECTION else -1
+                for p in rows
+            ])
+            values.extend([p.get('value', 0) for p in rows])
+            quantities.extend([p.get('quantity') or 0 for p in rows])
+            liquidation_prices.extend([p.get('liquidation_price') or 0 for p in rows])
+            cached_prices.extend([prices.get(p.get('token')) or np.nan for p in rows])
+            positions.extend(rows)
+        self.address = np.array(addresses, dtype=np.int64)
+        self.key = np.array(keys, dtype=np.int64)
+        self.opposite = np.array(opposites, dtype=np.int64)
+        self.value = np.array(values, dtype=np.float64)
+        self.quantity = np.array(quantities, dtype=np.float64)
+        self.liquidation_price = np.array(liquidation_prices, dtype=np.float64)
+        self.cached_price = np.array(cached_prices, dtype=np.float64)
+        self.positions = positions
+
+    def current_price(self, use_cache=True):
+        """向量化的current_price，无法计算时为NaN"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mark = np.where(self.quantity > 0, np.nan_to_num(self.value) / self.quantity, np.nan)
+        if use_cache:
+            mark = np.where(np.isnan(self.cached_price), mark, self.cached_price)
+        return mark
+
+    def near_liquidation(self, use_cache=True):
+        """
+        向量化的is_near_liquidation
+        返回:
+            tuple: (是否接近清算的掩码, 价格数组, 距离数组)
+        """
+        price = self.current_price(use_cache)
+        valid = (self.liquidation_price > 0) & ~np.isnan(price) & (price != 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distance = np.abs(price - self.liquidation_price) / price
+        return valid & (distance <= LIQUIDATION_ALERT_DISTANCE), price, distance
+
+
+def _lookup(sorted_keys, keys, side='left'):
+    """在有序数组中查找键，返回(位置, 是否存在)"""
+    if side == 'right':
+        index = np.searchsorted(sorted_keys, keys, side='right') - 1
+    else:
+        index = np.searchsorted(sorted_keys, keys, side='left')
+    found = (index >= 0) & (index < len(sorted_keys))
+    found[found] = sorted_keys[index[found]] == keys[found]
+    return index, found
+
+
+def diff_frames(old_frame, new_frame, key_count):
+    """
+    向量化比较两个PositionFrame
+    返回:
+        dict: 按new_frame行对齐的掩码(opened/changed/flipped/near)和旧价值、
+              匹配到的旧行号，以及按旧行的平仓行号(closed_rows，已按首次出现顺序排列)
+    """
+    old_keys = old_frame.address * key_count + old_frame.key
+    new_keys = new_frame.address * key_count + new_frame.key
+
+    # 稳定排序后取最后一个相同键，与构建字典时后者覆盖前者的行为一致
+    order = np.argsort(old_keys, kind='stable')
+    sorted_old = old_keys[order]
+    index, found = _lookup(sorted_old, new_keys, side='right')
+    matched = np.full(len(new_keys), -1, dtype=np.int64)
+    matched[found] = order[index[found]]
+
+    old_value = np.zeros(len(new_keys), dtype=np.float64)
+    old_value[found] = old_frame.value[matched[found]]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.abs(new_frame.value - old_value) / old_value
+    changed = found & (old_value > 0) & (ratio > CHANGE_THRESHOLD)
+
+    # 反手：新键不在旧数据中，而同代币的反向键在旧数据中且已从新数据中消失
+    sorted_new = np.sort(new_keys)
+    opposite_keys = new_frame.address * key_count + new_frame.opposite
+    has_opposite = ~found & (new_frame.opposite >= 0)
+    _, opposite_in_old = _lookup(sorted_old, opposite_keys)
+    _, opposite_in_new = _lookup(sorted_new, opposite_keys)
+    flipped = has_opposite & opposite_in_old & ~opposite_in_new
+    opened = ~found & ~flipped
+
+    # 清算预警：当前在预警区间内的新持仓(是否已提醒过由LiquidationAlertState判断)
+    near, price, distance = new_frame.near_liquidation()
+
+    # 平仓：按唯一旧键(首次出现的顺序，取最后一次出现的持仓)，不在新数据中且不是反手
+    unique_keys, first_rows = np.unique(old_keys, return_index=True)
+    last_rows = order[np.searchsorted(sorted_old, unique_keys, side='right') - 1]
+    _, in_new = _lookup(sorted_new, unique_keys)
+    flipped_keys = np.unique(opposite_keys[flipped])
+    _, is_flipped = _lookup(flipped_keys, unique_keys)
+    closed = ~in_new & ~is_flipped
+    closed_order = np.argsort(first_rows[closed], kind='stable')
+    closed_rows = last_rows[closed][closed_order]
+
+    return {
+        'opened': opened,
+        'changed': changed,
+        'flipped': flipped,
+        'near': near,
+        'old_value': old_value,
+        'opposite_rows': _opposite_rows(order, sorted_old, opposite_keys, flipped),
+        'price': price,
+        'distance': distance,
+        'closed_rows': closed_rows,
+    }
+
+
+def _opposite_rows(order, sorted_old, opposite_keys, flipped):
+    """反手持仓对应的旧行号(取最后一次出现)"""
+    rows = np.full(len(opposite_keys), -1, dtype=np.int64)
+    if flipped.any():
+        rows[flipped] = order[np.searchsorted(sorted_old, opposite_keys[flipped], side='right') - 1]
+    return rows
+
+
+def _empty_result():
+    return {
+        'new_positions': [],
+        'changed_positions': [],
+        'closed_positions': [],
+        'flipped_positions': [],
+        'near_liquidation': []
+    }
+
+
+def batch_compare_positions(old_snapshots, new_snapshots, prices=None):
+    """
+    一次比较所有地址的新旧持仓，结果与逐个调用compare_positions完全相同
+    参数:
+        old_snapshots (dict): 地址 -> 之前的持仓数据
+        new_snapshots (dict): 地址 -> 最新的持仓数据
+        prices (dict): 已缓存的代币价格
+    返回:
+        dict: 地址 -> compare_positions的返回值
+    """
+    results = {}
+    address_ids = {}
+    for address, new_data in new_snapshots.items():
+        if not old_snapshots.get(address) or not new_data:
+            results[address] = []
+        else:
+            address_ids[address] = len(address_ids)
+            results[address] = _empty_result()
+    if not address_ids:
+        return results
+
+    key_ids = {}
+    old_frame = PositionFrame(old_snapshots, address_ids, key_ids, prices)
+    new_frame = PositionFrame(new_snapshots, address_ids, key_ids, prices)
+    diff = diff_frames(old_frame, new_frame, max(len(key_ids), 1))
+    addresses = list(address_ids)
+
+    opened, changed, flipped, near = diff['opened'], diff['changed'], diff['flipped'], diff['near']
+    rows = np.flatnonzero(opened | changed | flipped | near)
+    # 转换为Python列表后再逐行组装结果，避免逐个访问NumPy标量
+    for row, address_id, is_opened, is_changed, is_flipped, is_near, old, new, opposite_row, price, distance in zip(
+        rows.tolist(),
+        new_frame.address[rows].tolist(),
+        opened[rows].tolist(),
+        changed[rows].tolist(),
+        flipped[rows].tolist(),
+        near[rows].tolist(),
+        diff['old_value'][rows].tolist(),
+        new_frame.value[rows].tolist(),
+        diff['opposite_rows'][rows].tolist(),
+        diff['price'][rows].tolist(),
+        diff['distance'][rows].tolist()
+    ):
+        result = results[addresses[address_id]]
+        position = new_frame.positions[row]
+        if is_opened:
+            result['new_positions'].append(position)
+        elif is_flipped:
+            result['flipped_positions'].append({
+                'position': position,
+                'previous': old_frame.positions[opposite_row]
+            })
+        elif is_changed:
+            result['changed_positions'].append({
+                'position': position,
+                'change_type': 'increase' if new > old else 'decrease',
+                'change_percent': abs(new - old) / old * 100
+            })
+        if is_near:
+            result['near_liquidation'].append({
+                'position': position,
+                'price': price,
+                'distance_percent': distance * 100
+            })
+
+    # 平仓数量很少，逐个判断是否被清算
+    closed_rows = diff['closed_rows']
+    for row, address_id in zip(closed_rows.tolist(), old_frame.address[closed_rows].tolist()):
+        position = old_frame.positions[row]
+        results[addresses[address_id]]['closed_positions'].append({
+            'position': position,
+            'liquidated': is_liquidated(position, prices)
+        })
+    return results
@@ -0,0 +1,253 @@
+import json
+import logging
+import re
+import time
+
+from bs4 import BeautifulSoup
+from lxml import etree, html as lxml_html
+
+from config import HTML_EXTRACTOR
+
+logger = logging.getLogger(__name__)
+
+# 页面中内嵌的JSON数据(例如 <script id="__NEXT_DATA__" type="application/json">)
+EMBEDDED_JSON_PATTERN = re.compile(
+    r'<script[^>]*type=["\']application/json["\'][^>]*>(.*?)</script>',
+    re.DOTALL | re.IGNORECASE
+)
+
+# 流式解析每次喂给解析器的字节数
+STREAM_CHUNK_SIZE = 16 * 1024
+
+
+def _has_class(element, name):
+    return name in (element.get('class') or '').split()
+
+
+def _parse_value(text):
+    value_text = text.strip().replace('$', '').replace(',', '') if text else '0'
+    return float(value_text) if value_text else 0
+
+
+def make_position(token, direction_text, value_text):
+    """根据持仓卡片中的文本构建持仓字典(与原有网页解析结果一致)"""
+    token = token.strip() if token is not None else 'Unknown'
+    direction = 'LONG' if direction_text is not None and 'long' in direction_text.lower() else 'SHORT'
+    value = _parse_value(value_text)
+
+    # 获取其他数据...
+    leverage = 5  # 默认值
+    quantity = 0
+
+    return {
+        'token': token,
+        'direction': direction,
+        'leverage': leverage,
+        'value': value,
+        'quantity': quantity,
+        'token_quantity': f'{quantity} {token}',
+        'entry_price': 0.0,  # 需要从网页解析
+        'funding': 0.0,  # 需要从网页解析
+        'liquidation_price': 0.0,  # 需要从网页解析
+        'updated_at': int(time.time())
+    }
+
+
+def _find_positions(node):
+    """在内嵌JSON中递归查找持仓列表"""
+    if isinstance(node, dict):
+        if isinstance(node.get('assetPositions'), list):
+            return 'assetPositions', node['assetPositions']
+        if isinstance(node.get('positions'), list):
+            return 'positions', node['positions']
+        children = node.values()
+    elif isinstance(node, list):
+        children = node
+    else:
+        return None
+    for child in children:
+        found = _find_positions(child)
+        if found:
+            return found
+    return None
+
+
+def _convert_asset_position(item):
+    """把Hyperliquid clearinghouseState格式的持仓转换为内部格式"""
+    position = item.get('position', item)
+    size = float(position.get('szi') or 0)
+    token = position.get('coin', 'Unknown')
+    quantity = abs(size)
+    leverage = position.get('leverage') or {}
+    funding = position.get('cumFunding') or {}
+    return {
+        'token': token,
+        'direction': 'LONG' if size > 0 else 'SHORT',
+        'leverage': leverage.get('value', 0) if isinstance(leverage, dict) else leverage,
+        'value': float(position.get('positionValue') or 0),
+        'quantity': quantity,
+        'token_quantity': f'{quantity} {token}',
+        'entry_price': float(position.get('entryPx') or 0),
+        'funding': float(funding.get('sinceOpen') or 0) if isinstance(funding, dict) else float(funding),
+        'liquidation_price': float(position.get('liquidationPx') or 0),
+        'updated_at': int(time.time())
+    }
+
+
+def extract_embedded_positions(html):
+    """
+    从页面内嵌的JSON中提取持仓，无需构建DOM
+    返回:
+        list: 持仓列表，页面没有可用的内嵌数据时返回None
+    """
+    if 'assetPositions' not in html and '"positions"' not in html:
+        return None
+    for match in EMBEDDED_JSON_PATTERN.finditer(html):
+        try:
+            data = json.loads(match.group(1))
+        except ValueError:
+            continue
+        found = _find_positions(data)
+        if not found:
+            continue
+        kind, items = found
+        try:
+            if kind == 'assetPositions':
+                return [_convert_asset_position(item) for item in items]
+            return [dict(item, updated_at=item.get('updated_at', int(time.time()))) for item in items]
+        except (TypeError, ValueError, AttributeError) as e:
+            logger.error(f"解析内嵌持仓数据时出错: {str(e)}")
+            return None
+    return None
+
+
+class PositionExtractor:
+    """持仓提取引擎基类：优先使用内嵌JSON，没有时再解析HTML"""
+    name = 'base'
+
+    def extract(self, html):
+        positions = extract_embedded_positions(html)
+        if positions is not None:
+            return positions
+        return self.extract_html(html)
+
+    def extract_html(self, html):
+        raise NotImplementedError
+
+
+class BeautifulSoupExtractor(PositionExtractor):
+    """原有的BeautifulSoup解析方式"""
+    name = 'bs4'
+
+    def extract_html(self, html):
+        soup = BeautifulSoup(html, 'html.parser')
+        positions = []
+
+        # 尝试解析持仓数据
+        for element in soup.select('.position-card'):
+            try:
+                token_elem = element.select_one('.position-token')
+                direction_elem = element.select_one('.position-direction')
+                value_elem = element.select_one('.position-value')
+                positions.append(make_position(
+                    token_elem.text if token_elem else None,
+                    direction_elem.text if direction_elem else None,
+                    value_elem.text if value_elem else None
+                ))
+            except Exception as e:
+                logger.error(f"解析持仓元素时出错: {str(e)}")
+                continue
+        return positions
+
+
+class LxmlExtractor(PositionExtractor):
+    """基于lxml(C实现)的DOM解析，使用XPath查找持仓卡片"""
+    name = 'lxml'
+
+    CARD_XPATH = "//*[contains(concat(' ', normalize-space(@class), ' '), ' position-card ')]"
+
+    def _field(self, card, class_name):
+        for element in card.iter():
+            if element is not card and _has_class(element, class_name):
+                return element.text_content()
+        return None
+
+    def extract_html(self, html):
+        if not html.strip():
+            return []
+        document = lxml_html.fromstring(html)
+        positions = []
+        for card in document.xpath(self.CARD_XPATH):
+            try:
+                positions.append(make_position(
+                    self._field(card, 'position-token'),
+                    self._field(card, 'position-direction'),
+                    self._field(card, 'position-value')
+                ))
+            except Exception as e:
+                logger.error(f"解析持仓元素时出错: {str(e)}")
+                continue
+        return positions
+
+
+class StreamingExtractor(PositionExtractor):
+    """
+    基于lxml增量解析器的流式解析
+    读完持仓卡片所在的容器后立即停止，不再解析页面剩余部分
+    """
+    name = 'streaming'
+
+    FIELDS = ('position-token', 'position-direction', 'position-value')
+
+    def extract_html(self, html):
+        parser = etree.HTMLPullParser(events=('start', 'end'))
+        positions = []
+        card = None
+        section = None
+        fields = {}
+
+        for offset in range(0, len(html), STREAM_CHUNK_SIZE):
+            parser.feed(html[offset:offset + STREAM_CHUNK_SIZE])
+            for event, element in parser.read_events():
+                if event == 'start':
+                    if card is None and _has_class(element, 'position-card'):
+                        card = element
+                        fields = {}
+                        if section is None:
+                            section = element.getparent()
+                    continue
+
+                # end事件
+                if card is not None and element is not card:
+                    for field in self.FIELDS:
+                        if field not in fields and _has_class(element, field):
+                            fields[field] = ''.join(element.itertext())
+                elif element is card:
+                    try:
+                        positions.append(make_position(
+                            fields.get('position-token'),
+                            fields.get('position-direction'),
+                            fields.get('position-value')
+                        ))
+                    except Exception as e:
+                        logger.error(f"解析持仓元素时出错: {str(e)}")
+                    card = None
+                elif section is not None and element is section:
+                    # 持仓区域已经读完
+                    return positions
+        parser.close()
+        return positions
+
+
+EXTRACTORS = {
+    extractor.name: extractor
+    for extractor in (BeautifulSoupExtractor, LxmlExtractor, StreamingExtractor)
+}
+
+
+def get_extractor(name=HTML_EXTRACTOR):
+    """按名称创建持仓提取引擎(bs4 / lxml / streaming)"""
+    try:
+        return EXTRACTORS[name]()
+    except KeyError:
+        raise ValueError(f"未知的HTML提取引擎: {name}，可选: {', '.join(EXTRACTORS)}")
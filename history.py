@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from config import HISTORY_DIR, HISTORY_BATCH_SIZE, HISTORY_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# 每一列对应一个只追加的定长二进制文件
+COLUMNS = (
+    ('timestamp', '<i8'),
+    ('address', '<i4'),  # 地址编号，见字典文件
+    ('token', '<i4'),  # 代币编号，见字典文件
+    ('direction', 'i1'),  # 1 做多，-1 做空
+    ('value', '<f8'),
+    ('entry_price', '<f8'),
+    ('funding', '<f8'),
+    ('liquidation_price', '<f8'),
+)
+COLUMN_DTYPES = dict(COLUMNS)
+
+DICTIONARY_FILE = 'dictionary.json'
+
+
+def _day(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime('%Y-%m-%d')
+
+
+class PositionHistory:
+    """
+    持仓历史时间序列，按天分区的列式存储
+    目录结构:
+        HISTORY_DIR/
+            dictionary.json        地址和代币的编号
+            2024-01-01/            每天一个分区
+                timestamp.bin  address.bin  token.bin  direction.bin
+                value.bin  entry_price.bin  funding.bin  liquidation_price.bin
+    查询时按时间范围只打开涉及的分区，并通过numpy.memmap按需读取，不会把全部历史载入内存
+    """
+    def __init__(self, root=HISTORY_DIR, batch_size=HISTORY_BATCH_SIZE, flush_interval=HISTORY_FLUSH_INTERVAL):
+        self.root = root
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._buffer = []  # 待写入的行
+        self._last_flush = time.monotonic()
+        os.makedirs(root, exist_ok=True)
+        self._addresses, self._tokens = self._load_dictionary()
+        self._address_ids = {address: i for i, address in enumerate(self._addresses)}
+        self._token_ids = {token: i for i, token in enumerate(self._tokens)}
+        self._dictionary_dirty = False
+
+    def _load_dictionary(self):
+        path = os.path.join(self.root, DICTIONARY_FILE)
+        if not os.path.exists(path):
+            return [], []
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return data.get('addresses', []), data.get('tokens', [])
+
+    def _save_dictionary(self):
+        path = os.path.join(self.root, DICTIONARY_FILE)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'addresses': self._addresses, 'tokens': self._tokens}, f)
+        os.replace(tmp_path, path)
+        self._dictionary_dirty = False
+
+    def _encode(self, mapping, values, value):
+        if value not in mapping:
+            mapping[value] = len(values)
+            values.append(value)
+            self._dictionary_dirty = True
+        return mapping[value]
+
+    def append(self, data):
+        """
+        追加一次get_address_data的结果
+        参数:
+            data (dict): 地址数据
+        """
+        if not data:
+            return
+        timestamp = int(data.get('updated_at') or time.time())
+        with self._lock:
+            address_id = self._encode(self._address_ids, self._addresses, data['address'].lower())
+            for position in data.get('positions', []):
+                self._buffer.append((
+                    int(position.get('updated_at') or timestamp),
+                    address_id,
+                    self._encode(self._token_ids, self._tokens, position.get('token', 'Unknown')),
+                    1 if position.get('direction') == 'LONG' else -1,
+                    float(position.get('value') or 0),
+                    float(position.get('entry_price') or 0),
+                    float(position.get('funding') or 0),
+                    float(position.get('liquidation_price') or 0),
+                ))
+            due = (
+                len(self._buffer) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        """把缓冲的行按天分区写入各列文件"""
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+            if self._dictionary_dirty:
+                self._save_dictionary()
+            if not rows:
+                return
+            table = np.array(rows, dtype=list(COLUMNS))
+            days = np.array([_day(ts) for ts in table['timestamp']])
+            for day in np.unique(days):
+                part = table[days == day]
+                directory = os.path.join(self.root, day)
+                os.makedirs(directory, exist_ok=True)
+                self._align_partition(day)
+                for name, _ in COLUMNS:
+                    with open(os.path.join(directory, f'{name}.bin'), 'ab') as f:
+                        f.write(np.ascontiguousarray(part[name]).tobytes())
+
+    def flush_if_due(self):
+        """距离上次写入已超过写入间隔时写入(由定时任务调用)"""
+        with self._lock:
+            due = self._buffer and time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def close(self):
+        self.flush()
+
+    def _partitions(self, start, end):
+        """返回时间范围内的分区目录"""
+        if start is None or end is None:
+            names = sorted(
+                name for name in os.listdir(self.root)
+                if os.path.isdir(os.path.join(self.root, name))
+            )
+            if start is not None:
+                names = [name for name in names if name >= _day(start)]
+            if end is not None:
+                names = [name for name in names if name <= _day(end)]
+            return names
+        names = []
+        day = datetime.fromtimestamp(start, tz=timezone.utc).date()
+        last = datetime.fromtimestamp(end, tz=timezone.utc).date()
+        while day <= last:
+            name = day.strftime('%Y-%m-%d')
+            if os.path.isdir(os.path.join(self.root, name)):
+                names.append(name)
+            day += timedelta(days=1)
+        return names
+
+    def _open_column(self, day, name, rows):
+        path = os.path.join(self.root, day, f'{name}.bin')
+        return np.memmap(path, dtype=COLUMN_DTYPES[name], mode='r', shape=(rows,))
+
+    def _partition_rows(self, day):
+        # 各列文件可能因异常退出长度不一致，以最短的列为准
+        return min(
+            os.path.getsize(os.path.join(self.root, day, f'{name}.bin')) // np.dtype(dtype).itemsize
+            if os.path.exists(os.path.join(self.root, day, f'{name}.bin')) else 0
+            for name, dtype in COLUMNS
+        )
+
+    def _align_partition(self, day):
+        """
+        把各列文件截断到相同的行数：上次写入中途出错时有的列多写了行，
+        不截断的话之后追加的行在各列中的位置不同，读出的每一行都会错位
+        """
+        rows = self._partition_rows(day)
+        for name, dtype in COLUMNS:
+            path = os.path.join(self.root, day, f'{name}.bin')
+            size = rows * np.dtype(dtype).itemsize
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                logger.warning(f"持仓历史分区 {day} 的列 {name} 长度不一致，截断到 {rows} 行")
+                os.truncate(path, size)
+
+    def query(self, address=None, token=None, start=None, end=None, columns=None):
+        """
+        按地址、代币和时间范围查询
+        参数:
+            address (str): 钱包地址，None表示全部
+            token (str): 代币符号，None表示全部
+            start (int): 起始时间戳(包含)
+            end (int): 结束时间戳(包含)
+            columns (list): 需要返回的列，默认全部
+        返回:
+            dict: 列名 -> numpy数组
+        """
+        self.flush()
+        columns = list(columns or COLUMN_DTYPES)
+        empty = {name: np.empty(0, dtype=COLUMN_DTYPES[name]) for name in columns}
+
+        with self._lock:
+            address_id = self._address_ids.get(address.lower()) if address else None
+            token_id = self._token_ids.get(token) if token else None
+        if (address and address_id is None) or (token and token_id is None):
+            return empty
+
+        parts = {name: [] for name in columns}
+        for day in self._partitions(start, end):
+            rows = self._partition_rows(day)
+            if rows == 0:
+                continue
+            mask = np.ones(rows, dtype=bool)
+            if start is not None or end is not None:
+                timestamps = self._open_column(day, 'timestamp', rows)
+                if start is not None:
+                    mask &= timestamps >= start
+                if end is not None:
+                    mask &= timestamps <= end
+            if address_id is not None:
+                mask &= self._open_column(day, 'address', rows) == address_id
+            if token_id is not None:
+                mask &= self._open_column(day, 'token', rows) == token_id
+            if not mask.any():
+                continue
+            for name in columns:
+                # 只复制命中的行
+                parts[name].append(np.asarray(self._open_column(day, name, rows)[mask]))
+
+        return {
+            name: np.concatenate(chunks) if chunks else empty[name]
+            for name, chunks in parts.items()
+        }
+
+    def to_dataframe(self, address=None, token=None, start=None, end=None):
+        """
+        查询结果转换为pandas DataFrame，地址和代币还原为字符串
+        """
+        import pandas as pd
+
+        result = self.query(address, token, start, end)
+        frame = pd.DataFrame(result)
+        with self._lock:
+            addresses = np.array(self._addresses or [''], dtype=object)
+            tokens = np.array(self._tokens or [''], dtype=object)
+        frame['address'] = addresses[frame['address'].to_numpy()] if len(frame) else frame['address']
+        frame['token'] = tokens[frame['token'].to_numpy()] if len(frame) else frame['token']
+        frame['direction'] = np.where(frame['direction'] > 0, 'LONG', 'SHORT')
+        frame['timestamp'] = pd.to_datetime(frame['timestamp'], unit='s', utc=True)
+        return frame
@@ -0,0 +1,128 @@
+import hashlib
+
+import numpy as np
+
+
+KEY_MASK = (1 << 64) - 1
+
+
+def address_key(address):
+    """
+    地址的64位整数键，用于快照之间按地址对齐
+    160位地址按64位分段异或折叠；非十六进制地址退回到哈希
+    """
+    try:
+        value = int(address[2:], 16)
+    except ValueError:
+        return int.from_bytes(hashlib.blake2b(address.encode('utf-8'), digest_size=8).digest(), 'big')
+    return (value ^ (value >> 64) ^ (value >> 128)) & KEY_MASK
+
+
+class HolderRanking:
+    """
+    持有人排名索引(NumPy数组，构建一次后只读)
+    - 按持有量降序排列的地址和持有量：排名、前N名
+    - 升序持有量：二分查找排名和百分位
+    - 按地址键排序的持有量：两个快照之间的向量化比较
+    参数:
+        index (dict): 小写地址 -> 持有量
+    """
+    def __init__(self, index):
+        addresses = np.array(list(index), dtype=object)
+        balances = np.fromiter(index.values(), dtype=np.float64, count=len(index))
+
+        order = np.argsort(-balances, kind='stable')
+        self.ranked_addresses = addresses[order]
+        self.ranked_balances = balances[order]
+        self.ascending_balances = self.ranked_balances[::-1].copy()
+        self.total = float(balances.sum())
+
+        keys = np.fromiter((address_key(address) for address in index), dtype=np.uint64, count=len(index))
+        if len(np.unique(keys)) != len(keys):
+            # 极少见的键冲突：退回到按地址字符串对齐(比较慢，但结果正确)
+            keys = addresses.astype(str)
+        key_order = np.argsort(keys)
+        self.keys = keys[key_order]
+        self.key_addresses = addresses[key_order]
+        self.key_balances = balances[key_order]
+
+    def __len__(self):
+        return len(self.ranked_balances)
+
+    def rank(self, balance):
+        """持有量对应的排名(1表示最多)，持有量为0时返回None"""
+        if balance <= 0:
+            return None
+        return int(len(self.ascending_balances) - np.searchsorted(self.ascending_balances, balance, side='right')) + 1
+
+    def percentile(self, balance):
+        """持有量低于该值的持有人比例(0-100)"""
+        if not len(self):
+            return 0.0
+        return float(np.searchsorted(self.ascending_balances, balance, side='left')) / len(self) * 100
+
+    def balance_at_percentile(self, percent):
+        """第percent百分位的持有量(0-100)"""
+        if not len(self):
+            return 0.0
+        return float(np.percentile(self.ascending_balances, percent))
+
+    def top(self, n=10):
+        """
+        持有量最多的n个地址
+        返回:
+            list: [(地址, 持有量), ...]
+        """
+        return list(zip(self.ranked_addresses[:n].tolist(), self.ranked_balances[:n].tolist()))
+
+    def diff(self, older, limit=10):
+        """
+        与更早的快照比较，找出增持和减持最多的地址(新出现或清仓的地址按0计)
+        参数:
+            older (HolderRanking): 更早的快照索引
+            limit (int): 每个方向返回的地址数
+        返回:
+            dict: {'accumulators': [...], 'distributors': [...]}，元素为 (地址, 旧持有量, 新持有量, 变化量)
+        """
+        new_keys, old_keys = self.keys, older.keys
+        if new_keys.dtype != old_keys.dtype:
+            new_keys, old_keys = self.key_addresses.astype(str), older.key_addresses.astype(str)
+
+        # 当前快照中的每个地址在旧快照中的位置
+        old_balances = np.zeros(len(new_keys))
+        exited = np.ones(len(old_keys), dtype=bool)
+        if len(old_keys):
+            positions = np.searchsorted(old_keys, new_keys)
+            positions[positions == len(old_keys)] = 0
+            matched = old_keys[positions] == new_keys
+            old_balances[matched] = older.key_balances[positions[matched]]
+            exited[positions[matched]] = False
+
+        # 旧快照中已清仓的地址排在当前快照的地址之后
+        exited_indices = np.flatnonzero(exited)
+        before = np.concatenate([old_balances, older.key_balances[exited_indices]])
+        after = np.concatenate([self.key_balances, np.zeros(len(exited_indices))])
+        deltas = after - before
+
+        def pick(indices, sign):
+            picked = []
+            for i in indices:
+                if deltas[i] * sign <= 0:
+                    continue
+                if i < len(new_keys):
+                    address = self.key_addresses[i]
+                else:
+                    address = older.key_addresses[exited_indices[i - len(new_keys)]]
+                picked.append((address, float(before[i]), float(after[i]), float(deltas[i])))
+            return picked
+
+        limit = min(limit, len(deltas))
+        if not limit:
+            return {'accumulators': [], 'distributors': []}
+        # argpartition只对前limit个元素排序，不需要完整排序
+        largest = np.argpartition(-deltas, limit - 1)[:limit]
+        smallest = np.argpartition(deltas, limit - 1)[:limit]
+        return {
+            'accumulators': pick(largest[np.argsort(-deltas[largest])], 1),
+            'distributors': pick(smallest[np.argsort(deltas[smallest])], -1),
+        }
@@ -1,9 +1,24 @@
 import requests
+import aiohttp
+import asyncio
 import logging
 from bs4 import BeautifulSoup
 import json
+import hashlib
 import time
-from config import HYPERSCAN_BASE_URL, HYPERSCAN_API_BASE_URL
+import threading
+from diff_engine import OPPOSITE_DIRECTION, LiquidationAlertState, current_price, is_near_liquidation, is_liquidated
+from extractors import get_extractor
+from holders_index import HolderRanking
+from records import pack_positions, unpack_positions
+from ratelimit import rate_limiter as default_rate_limiter, RETRY_STATUS_CODES
+from breaker import endpoint_health as default_endpoint_health, CircuitOpenError
+from metrics import timed, API_DURATION, API_ERRORS, HTTP_RESPONSES, COMPARE_DURATION, PAGE_CACHE_RESULTS
+from config import (
+    HYPERSCAN_BASE_URL, HYPERSCAN_API_BASE_URL, HOLDERS_CACHE_TTL, HOLDINGS_TOKENS,
+    HTTP_TIMEOUT, API_MAX_CONCURRENCY, API_CONNECTION_LIMIT,
+    PRICE_CACHE_TTL, PRICE_STALE_TTL, PRICE_NEGATIVE_TTL
+)
 
 # 配置日志
 logging.basicConfig(
@@ -12,18 +27,808 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class HyperscanAPI:
+# 请求头，模拟浏览器行为
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'application/json, text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8'
+}
+
+class HoldersSnapshot:
+    """持有人数据快照，每个快照只构建一次地址索引"""
+    def __init__(self, token_symbol, timestamp, data):
+        self.token_symbol = token_symbol
+        self.timestamp = timestamp
+        self.holders_count = data.get('holdersCount', 0)
+        self.fetched_at = time.time()
+        # 地址统一转为小写，查询时无需再遍历原始数据
+        self.index = {address.lower(): amount for address, amount in data.get('holders', {}).items()}
+        self._ranking = None
+        self._lock = threading.Lock()
+
+    def get_amount(self, address):
+        """查询地址的持有量"""
+        return self.index.get(address.lower(), 0)
+
+    @property
+    def ranking(self):
+        """排名索引，第一次使用时构建(监控只按地址查询，不需要排序)"""
+        with self._lock:
+            if self._ranking is None:
+                self._ranking = HolderRanking(self.index)
+            return self._ranking
+
+    def rank(self, address):
+        """
+        查询地址的排名
+        返回:
+            dict: {'amount', 'rank', 'holders', 'percentile', 'share'}，地址未持有时rank为None
+        """
+        ranking = self.ranking
+        amount = self.get_amount(address)
+        return {
+            'amount': amount,
+            'rank': ranking.rank(amount),
+            'holders': len(ranking),
+            'percentile': ranking.percentile(amount),
+            'share': amount / ranking.total * 100 if ranking.total else 0.0,
+        }
+
+    def top(self, n=10):
+        """持有量最多的n个地址 [(地址, 持有量), ...]"""
+        return self.ranking.top(n)
+
+    def diff(self, older, limit=10):
+        """与更早的快照比较，返回增持和减持最多的地址(见HolderRanking.diff)"""
+        return self.ranking.diff(older.ranking, limit)
+
+    def is_expired(self, ttl):
+        return time.time() - self.fetched_at >= ttl
+
+
+class HoldersSnapshotCache:
+    """
+    持有人快照缓存
+    同一个(代币, 时间戳)在有效期内只下载一次，并发调用者共享同一次请求
+    同步客户端和异步客户端可以共用同一个缓存实例
+    """
+    def __init__(self, ttl=HOLDERS_CACHE_TTL):
+        self.ttl = ttl
+        self._snapshots = {}  # (代币, 时间戳) -> HoldersSnapshot
+        self._previous = {}  # (代币, 时间戳) -> 被替换的上一个快照，用于比较持有人变化
+        self._inflight = {}  # (代币, 时间戳) -> threading.Event
+        self._lock = threading.Lock()
+
+    def _acquire(self, key):
+        """返回 (快照, 进行中事件, 是否由调用者负责下载)"""
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot and not snapshot.is_expired(self.ttl):
+                return snapshot, None, False
+            event = self._inflight.get(key)
+            is_owner = event is None
+            if is_owner:
+                event = threading.Event()
+                self._inflight[key] = event
+            return snapshot, event, is_owner
+
+    def _complete(self, key, event, stale_snapshot, data):
+        """保存下载结果并唤醒等待者"""
+        try:
+            if data and 'holders' in data:
+                snapshot = HoldersSnapshot(key[0], key[1], data)
+                with self._lock:
+                    if stale_snapshot is not None:
+                        self._previous[key] = stale_snapshot
+                    self._snapshots[key] = snapshot
+                return snapshot
+            if stale_snapshot:
+                logger.warning(f"刷新{key[0]}持有人快照失败，继续使用过期快照")
+            return stale_snapshot
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def _latest(self, key):
+        with self._lock:
+            return self._snapshots.get(key)
+
+    def get(self, token_symbol, timestamp, fetcher):
+        """
+        获取快照，过期或不存在时调用fetcher下载
+        参数:
+            token_symbol (str): 代币符号
+            timestamp (int): 时间戳
+            fetcher (callable): 返回原始持有人数据的函数
+        返回:
+            HoldersSnapshot: 快照，下载失败时返回过期快照或None
+        """
+        key = (token_symbol, timestamp)
+        snapshot, event, is_owner = self._acquire(key)
+        if event is None:
+            return snapshot
+
+        if not is_owner:
+            # 已有请求在进行中，等待其完成后直接复用结果
+            event.wait()
+            return self._latest(key)
+
+        data = None
+        try:
+            data = fetcher()
+        finally:
+            snapshot = self._complete(key, event, snapshot, data)
+        return snapshot
+
+    async def get_async(self, token_symbol, timestamp, fetcher):
+        """
+        get的异步版本
+        参数:
+            fetcher (callable): 返回协程的函数，协程结果为原始持有人数据
+        """
+        key = (token_symbol, timestamp)
+        snapshot, event, is_owner = self._acquire(key)
+        if event is None:
+            return snapshot
+
+        if not is_owner:
+            # 下载可能由其他线程发起，轮询事件避免阻塞事件循环
+            while not event.is_set():
+                await asyncio.sleep(0.05)
+            return self._latest(key)
+
+        data = None
+        try:
+            data = await fetcher()
+        finally:
+            snapshot = self._complete(key, event, snapshot, data)
+        return snapshot
+
+    def put(self, token_symbol, timestamp, data):
+        """写入在其他地方下载的持有人数据(例如主进程发给分片的快照)，替换的快照保留为上一个快照"""
+        snapshot = HoldersSnapshot(token_symbol, timestamp, data)
+        with self._lock:
+            stale_snapshot = self._snapshots.get((token_symbol, timestamp))
+            if stale_snapshot is not None:
+                self._previous[(token_symbol, timestamp)] = stale_snapshot
+            self._snapshots[(token_symbol, timestamp)] = snapshot
+        return snapshot
+
+    def latest(self, token_symbol, timestamp=0):
+        """当前的快照(可能已过期，不发起请求)，没有时返回None"""
+        return self._latest((token_symbol, timestamp))
+
+    def previous(self, token_symbol, timestamp=0):
+        """上一次刷新前的快照(不发起请求)，没有时返回None"""
+        with self._lock:
+            return self._previous.get((token_symbol, timestamp))
+
+    def invalidate(self, token_symbol=None):
+        """清除缓存的快照"""
+        with self._lock:
+            if token_symbol is None:
+                self._snapshots.clear()
+                self._previous.clear()
+            else:
+                for key in [k for k in self._snapshots if k[0] == token_symbol]:
+                    del self._snapshots[key]
+                for key in [k for k in self._previous if k[0] == token_symbol]:
+                    del self._previous[key]
+
+
+class PriceService:
+    """
+    代币价格服务
+    - 短有效期的内存缓存；过期后在过期窗口内先返回旧价格，同时在后台刷新(stale-while-revalidate)
+    - 同一代币的并发请求共享同一次获取
+    - 网页抓取失败的代币进入负缓存，有效期内不再尝试网页抓取
+    - 整个获取(API和网页)都没有得到价格的代币也进入负缓存，有效期内不再发任何请求
+      (例如只有永续合约的代币，否则每个地址的每次比较都会再请求一次)
+    - get_many_async 每个周期批量获取一组代币的价格
+    同步客户端和异步客户端可以共用同一个实例
+    """
+    def __init__(self, ttl=PRICE_CACHE_TTL, stale_ttl=PRICE_STALE_TTL, negative_ttl=PRICE_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self._prices = {}  # 代币 -> (价格, 获取时间)
+        self._html_failures = {}  # 代币 -> 网页抓取失败的时间(负缓存)
+        self._failures = {}  # 代币 -> 整个获取失败的时间(负缓存)
+        self._inflight = {}  # 代币 -> threading.Event
+        self._background = set()  # 后台刷新任务，保持引用避免被回收
+        self._lock = threading.Lock()
+
+    def _lookup(self, symbol):
+        """返回 (价格, 是否新鲜)，没有可用价格时价格为None"""
+        with self._lock:
+            entry = self._prices.get(symbol)
+        if not entry:
+            return None, False
+        price, fetched_at = entry
+        age = time.time() - fetched_at
+        if age < self.ttl:
+            return price, True
+        if age < self.ttl + self.stale_ttl:
+            return price, False
+        return None, False
+
+    def _begin(self, symbol):
+        """登记进行中的请求，返回 (事件, 是否由调用者负责获取)"""
+        with self._lock:
+            event = self._inflight.get(symbol)
+            if event is not None:
+                return event, False
+            event = threading.Event()
+            self._inflight[symbol] = event
+            return event, True
+
+    def _complete(self, symbol, event, price):
+        with self._lock:
+            if price:
+                self._prices[symbol] = (price, time.time())
+                self._failures.pop(symbol, None)
+            else:
+                self._failures[symbol] = time.time()
+            self._inflight.pop(symbol, None)
+        event.set()
+
+    def is_negative(self, symbol):
+        """代币是否在负缓存中(最近一次获取没有得到价格)，有效期内不再请求"""
+        with self._lock:
+            failed_at = self._failures.get(symbol)
+            if failed_at is None:
+                return False
+            if time.time() - failed_at >= self.negative_ttl:
+                del self._failures[symbol]
+                return False
+            return True
+
+    def html_allowed(self, symbol):
+        """代币是否允许网页抓取(不在负缓存中)"""
+        with self._lock:
+            failed_at = self._html_failures.get(symbol)
+            if failed_at is None:
+                return True
+            if time.time() - failed_at >= self.negative_ttl:
+                del self._html_failures[symbol]
+                return True
+            return False
+
+    def record_html_failure(self, symbol):
+        with self._lock:
+            self._html_failures[symbol] = time.time()
+
+    def record_html_success(self, symbol):
+        with self._lock:
+            self._html_failures.pop(symbol, None)
+
+    def _refresh(self, symbol, fetcher):
+        event, is_owner = self._begin(symbol)
+        if not is_owner:
+            return
+        price = None
+        try:
+            price = fetcher(symbol)
+        finally:
+            self._complete(symbol, event, price)
+
+    def get(self, symbol, fetcher):
+        """
+        获取价格
+        参数:
+            symbol (str): 代币符号
+            fetcher (callable): fetcher(symbol)，返回价格或None
+        返回:
+            float: 价格，获取失败且没有旧价格时返回None
+        """
+        price, fresh = self._lookup(symbol)
+        if fresh:
+            return price
+        if self.is_negative(symbol):
+            # 最近获取失败：不再请求，返回过期窗口内的旧价格(没有时为None)
+            return price
+        if price is not None:
+            # 先返回旧价格，后台刷新
+            thread = threading.Thread(target=self._refresh, args=(symbol, fetcher), daemon=True)
+            thread.start()
+            return price
+
+        event, is_owner = self._begin(symbol)
+        if not is_owner:
+            event.wait()
+            return self._lookup(symbol)[0]
+        price = None
+        try:
+            price = fetcher(symbol)
+        finally:
+            self._complete(symbol, event, price)
+        return price
+
+    async def _refresh_async(self, symbol, fetcher):
+        event, is_owner = self._begin(symbol)
+        if not is_owner:
+            return
+        price = None
+        try:
+            price = await fetcher(symbol)
+        finally:
+            self._complete(symbol, event, price)
+
+    async def get_async(self, symbol, fetcher):
+        """
+        get的异步版本
+        参数:
+            fetcher (callable): fetcher(symbol)，返回协程，协程结果为价格或None
+        """
+        price, fresh = self._lookup(symbol)
+        if fresh:
+            return price
+        if self.is_negative(symbol):
+            # 最近获取失败：不再请求，返回过期窗口内的旧价格(没有时为None)
+            return price
+        if price is not None:
+            task = asyncio.ensure_future(self._refresh_async(symbol, fetcher))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+            return price
+
+        event, is_owner = self._begin(symbol)
+        if not is_owner:
+            # 获取可能由其他线程发起，轮询事件避免阻塞事件循环
+            while not event.is_set():
+                await asyncio.sleep(0.05)
+            return self._lookup(symbol)[0]
+        price = None
+        try:
+            price = await fetcher(symbol)
+        finally:
+            self._complete(symbol, event, price)
+        return price
+
+    async def get_many_async(self, symbols, fetcher):
+        """
+        批量获取一组代币的价格(去重后并发获取，命中缓存或在负缓存中的不发请求)
+        返回:
+            dict: 代币 -> 价格(获取失败的不包含在内)
+        """
+        symbols = sorted({symbol for symbol in symbols if symbol and symbol != 'Unknown'})
+        # 负缓存中的代币直接跳过，只取过期窗口内的旧价格
+        prices = {symbol: self._lookup(symbol)[0] for symbol in symbols if self.is_negative(symbol)}
+        pending = [symbol for symbol in symbols if symbol not in prices]
+        prices.update(zip(pending, await asyncio.gather(*(self.get_async(symbol, fetcher) for symbol in pending))))
+        return {symbol: price for symbol, price in prices.items() if price}
+
+    def entries(self):
+        """
+        所有价格及其获取时间，用于发给其他进程
+        返回:
+            dict: 代币 -> (价格, 获取时间)
+        """
+        with self._lock:
+            return dict(self._prices)
+
+    def merge(self, entries):
+        """写入其他进程获取的价格(只保留获取时间更新的一份)"""
+        with self._lock:
+            for symbol, (price, fetched_at) in entries.items():
+                current = self._prices.get(symbol)
+                if price and (current is None or current[1] < fetched_at):
+                    self._prices[symbol] = (price, fetched_at)
+                    self._failures.pop(symbol, None)
+
+    def cached_prices(self):
+        """所有仍可用(新鲜或在过期窗口内)的价格，不发起请求"""
+        now = time.time()
+        with self._lock:
+            return {
+                symbol: price for symbol, (price, fetched_at) in self._prices.items()
+                if now - fetched_at < self.ttl + self.stale_ttl
+            }
+
+
+class PageCache:
+    """
+    地址页面的条件请求缓存
+    记录每个页面上次响应的ETag/Last-Modified、正文哈希和解析出的持仓(紧凑格式，见records.pack_positions)：
+    - 上游支持时发送If-None-Match/If-Modified-Since，304时不下载也不解析
+    - 不支持时比较正文哈希，内容相同则跳过解析，直接复用上次的持仓
+    条目只在地址不再被监控(position_cache释放)或被查询缓存移除时删除，由调用方通过invalidate清理
+    同步客户端和异步客户端可以共用同一个实例
+    """
     def __init__(self):
-        self.base_url = HYPERSCAN_BASE_URL
-        self.api_base_url = HYPERSCAN_API_BASE_URL
+        self._entries = {}  # URL -> (ETag, Last-Modified, 正文哈希, 代币元组, 打包的持仓)
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """
+        返回:
+            tuple: (ETag, Last-Modified, 正文哈希, 持仓列表)，没有缓存时为None
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+        if entry is None:
+            return None
+        etag, last_modified, digest, tokens, packed = entry
+        return etag, last_modified, digest, unpack_positions(tokens, packed)
+
+    def digest(self, url):
+        """上次响应的正文哈希，没有缓存时返回None"""
+        with self._lock:
+            entry = self._entries.get(url)
+        return entry[2] if entry else None
+
+    def conditional_headers(self, url):
+        """构建条件请求头，没有缓存时返回None"""
+        with self._lock:
+            entry = self._entries.get(url)
+        if not entry:
+            return None
+        etag, last_modified = entry[0], entry[1]
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers or None
+
+    def store(self, url, etag, last_modified, digest, positions):
+        tokens, packed = pack_positions(positions)
+        with self._lock:
+            self._entries[url] = (etag, last_modified, digest, tokens, packed)
+
+    def revalidate(self, url, etag, last_modified):
+        """正文未变化：只更新ETag/Last-Modified，保留已有的持仓"""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry:
+                self._entries[url] = (etag, last_modified) + entry[2:]
+
+    def nbytes(self):
+        """持仓占用的字节数(不含字典和元组本身)"""
+        with self._lock:
+            return sum(len(entry[4]) for entry in self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def invalidate(self, url=None):
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(url, None)
+
+
+class BaseHyperscanAPI:
+    """同步与异步客户端共用的解析和比较逻辑"""
+    def __init__(self, holders_cache=None, extractor=None, price_service=None, base_url=None, api_base_url=None,
+                 page_cache=None, holdings_tokens=None):
+        self.holdings_tokens = list(holdings_tokens or HOLDINGS_TOKENS)
+        self.base_url = (base_url or HYPERSCAN_BASE_URL).rstrip('/')
+        self.api_base_url = (api_base_url or HYPERSCAN_API_BASE_URL).rstrip('/')
+        self.holders_cache = holders_cache or HoldersSnapshotCache()
+        self.extractor = extractor or get_extractor()
+        self.price_service = price_service or PriceService()
+        self.page_cache = page_cache or PageCache()
+        self.liquidation_alerts = LiquidationAlertState()
+
+    def address_url(self, address):
+        return f"{self.base_url}/address/{address}"
+
+    def forget_address(self, address):
+        """地址不再被监控或查询缓存时，删除它的页面缓存和清算预警记录"""
+        self.page_cache.invalidate(self.address_url(address))
+        self.liquidation_alerts.forget(address)
+
+    def _parse_token_price_page(self, html):
+        """从代币网页中解析价格，解析失败返回None"""
+        soup = BeautifulSoup(html, 'html.parser')
+        # 查找包含价格的元素
+        price_element = soup.select_one('.token-price-value')
+        if price_element:
+            price_text = price_element.text.strip().replace('$', '').replace(',', '')
+            return float(price_text)
+        return None
+
+    def _parse_positions_page(self, html):
+        """从地址网页中解析永续合约持仓(使用配置的提取引擎)"""
+        return self.extractor.extract(html)
+
+    def _positions_from_response(self, url, status, html, headers):
+        """
+        处理地址页面的响应，页面未变化(304或正文哈希相同)时复用上次解析的持仓
+        返回:
+            tuple: (持仓列表, 页面哈希)，响应不可用时为 (None, None)
+        """
+        if status == 304:
+            entry = self.page_cache.get(url)
+            if entry is None:
+                return None, None
+            PAGE_CACHE_RESULTS.inc(result='not_modified')
+            return self._reuse_positions(entry[3]), entry[2]
+        if status != 200 or html is None:
+            return None, None
+
+        digest = hashlib.blake2b(html.encode('utf-8'), digest_size=16).hexdigest()
+        etag, last_modified = headers.get('ETag'), headers.get('Last-Modified')
+        if self.page_cache.digest(url) == digest:
+            entry = self.page_cache.get(url)
+            if entry is not None:
+                PAGE_CACHE_RESULTS.inc(result='same_hash')
+                self.page_cache.revalidate(url, etag, last_modified)
+                return self._reuse_positions(entry[3]), digest
+
+        PAGE_CACHE_RESULTS.inc(result='parsed')
+        positions = self._parse_positions_page(html)
+        self.page_cache.store(url, etag, last_modified, digest, positions)
+        return positions, digest
+
+    def _reuse_positions(self, positions):
+        """复用缓存的持仓(PageCache.get每次解包出新的字典，这里只刷新更新时间)"""
+        now = int(time.time())
+        for position in positions:
+            position['updated_at'] = now
+        return positions
+
+    def _fallback_positions(self, address):
+        """无法从网页获取数据时的兜底数据（针对特定地址返回模拟数据）"""
+        if address.lower() == "0xf3f496c9486be5924a93d67e98298733bb47057c".lower():
+            # 获取当前时间戳
+            current_timestamp = int(time.time())
+
+            quantity = 3863043.7
+            entry_price = 0.71745
+
+            return [{
+                'token': 'MELANIA',
+                'direction': 'LONG',
+                'leverage': 5,
+                'value': quantity * entry_price,
+                'quantity': quantity,
+                'token_quantity': f'{quantity} MELANIA',
+                'entry_price': entry_price,
+                'funding': 315.71 + (current_timestamp % 10) / 10.0,
+                'liquidation_price': 0.65333,
+                'updated_at': current_timestamp
+            }]
+
+        # 对于其他地址，返回空列表
+        return []
+
+    def _holdings_from_snapshots(self, address, snapshots):
+        """
+        从各代币的持有人快照中查出地址的持有量
+        参数:
+            snapshots (dict): 代币 -> HoldersSnapshot(获取失败时为None)
+        返回:
+            dict: 持有代币数据，所有代币都获取失败时返回None
+        """
+        holdings = {}
+        for token, snapshot in snapshots.items():
+            if snapshot:
+                holdings[token] = snapshot.get_amount(address)
+            else:
+                logger.error(f"无法获取{token}持有人数据")
+        if not holdings:
+            return None
+        return {'address': address, 'holdings': holdings}
+
+    def _build_address_data(self, address, holdings_data, positions, page_hash=None):
+        """构建完整的地址数据(page_hash为地址页面的内容哈希，相同说明持仓没有变化)"""
+        holdings = {token: 0 for token in self.holdings_tokens}
+        if holdings_data and 'holdings' in holdings_data:
+            holdings.update(holdings_data['holdings'])
+
+        # 现货价值使用已缓存的代币价格(不发起请求)；还没有价格的代币不计入价值，单独列出，
+        # 否则价值会随价格缓存的内容在美元和持有数量之间跳动，被误判为变化
+        prices = self.price_service.cached_prices()
+        held = {token: amount for token, amount in holdings.items() if amount > 0}
+        spot_value = sum(amount * prices[token] for token, amount in held.items() if token in prices)
+        unpriced = [token for token in held if token not in prices]
+
+        result = {
+            'address': address,
+            'overview': {
+                'perps': {'count': len(positions), 'value': sum(p.get('value', 0) for p in positions)},
+                'spot': {'count': len(held), 'value': spot_value},
+                'vault': {'value': 0},
+                'staked': {'value': 0}
+            },
+            'positions': positions,
+            'holdings': holdings,
+            'page_hash': page_hash,
+            'updated_at': int(time.time())
+        }
+        if unpriced:
+            result['overview']['spot']['unpriced'] = unpriced
+
+        held_text = '，'.join(f"{amount} {token}" for token, amount in held.items()) or '无现货持有'
+        logger.info(f"已获取地址 {address} 的数据: {len(positions)} 个持仓，{held_text}")
+        return result
+
+    @timed(COMPARE_DURATION)
+    def compare_positions(self, old_data, new_data, prices=None):
+        """
+        比较新旧持仓数据，检测新开仓、持仓变化、平仓、反手和接近清算
+        near_liquidation包含所有当前在预警区间内的持仓，是否已经提醒过由detect_changes去重
+        参数:
+            old_data (dict): 之前的持仓数据
+            new_data (dict): 最新的持仓数据
+            prices (dict): 已缓存的代币价格(代币 -> 价格)，用于判断清算距离，不会发起请求
+        返回:
+            dict: 各类变化的列表
+        """
+        if not old_data or not new_data:
+            return []
+
+        old_positions = {self._get_position_key(p): p for p in old_data.get('positions', [])}
+        new_positions = new_data.get('positions', [])
+        new_keys = {self._get_position_key(p) for p in new_positions}
+
+        new_opened = []
+        changed_positions = []
+        flipped_positions = []
+        near_liquidation = []
+        flipped_keys = set()
+
+        for position in new_positions:
+            key = self._get_position_key(position)
+            old_position = old_positions.get(key)
+            # 如果持仓在新数据中存在但在旧数据中不存在，则为新开仓或反手
+            if old_position is None:
+                opposite = OPPOSITE_DIRECTION.get(position.get('direction', ''))
+                opposite_key = self._get_position_key({'token': position.get('token', ''), 'direction': opposite})
+                if opposite and opposite_key in old_positions and opposite_key not in new_keys:
+                    flipped_positions.append({
+                        'position': position,
+                        'previous': old_positions[opposite_key]
+                    })
+                    flipped_keys.add(opposite_key)
+                else:
+                    new_opened.append(position)
+            else:
+                # 检查持仓是否有实质性变化 (价值变化超过10%)
+                old_value = old_position.get('value', 0)
+                new_value = position.get('value', 0)
+
+                # 如果价值变化超过10%，视为重大变化
+                if old_value > 0 and abs(new_value - old_value) / old_value > 0.1:
+                    changed_positions.append({
+                        'position': position,
+                        'change_type': 'increase' if new_value > old_value else 'decrease',
+                        'change_percent': abs(new_value - old_value) / old_value * 100
+                    })
+
+            distance = is_near_liquidation(position, prices)
+            if distance is not None:
+                near_liquidation.append({
+                    'position': position,
+                    'price': current_price(position, prices),
+                    'distance_percent': distance * 100
+                })
+
+        # 旧数据中存在但新数据中消失(且不是反手)的持仓为平仓
+        closed_positions = [
+            {'position': position, 'liquidated': is_liquidated(position, prices)}
+            for key, position in old_positions.items()
+            if key not in new_keys and key not in flipped_keys
+        ]
+
+        return {
+            'new_positions': new_opened,
+            'changed_positions': changed_positions,
+            'closed_positions': closed_positions,
+            'flipped_positions': flipped_positions,
+            'near_liquidation': near_liquidation
+        }
+
+    def detect_changes(self, old_data, new_data, prices=None):
+        """
+        检测两次快照之间的持仓变化
+        地址页面内容与上次相同(page_hash一致)时跳过完整比较，只检查清算预警(价格可能已变化)
+        清算预警只在持仓刚进入预警区间时提醒一次，离开区间后再次进入才重新提醒
+        返回:
+            dict: 与compare_positions相同格式的变化
+        """
+        page_hash = (new_data or {}).get('page_hash')
+        if old_data and page_hash and page_hash == old_data.get('page_hash'):
+            changes = {'near_liquidation': self.near_liquidation_alerts(new_data, prices)}
+        else:
+            changes = self.compare_positions(old_data, new_data, prices) or {}
+        if changes:
+            changes['near_liquidation'] = self.liquidation_alerts.filter(
+                new_data.get('address'), changes['near_liquidation'], self._get_position_key
+            )
+        return changes
+
+    def near_liquidation_alerts(self, data, prices=None):
+        """
+        页面内容未变化时代替compare_positions：新旧持仓相同，只需检查清算预警
+        结果与对相同持仓调用compare_positions得到的near_liquidation一致(同样由detect_changes去重)
+        """
+        alerts = []
+        for position in (data or {}).get('positions', []):
+            if not position.get('liquidation_price'):
+                continue
+            distance = is_near_liquidation(position, prices)
+            if distance is not None:
+                alerts.append({
+                    'position': position,
+                    'price': current_price(position, prices),
+                    'distance_percent': distance * 100
+                })
+        return alerts
+
+    def _get_position_key(self, position):
+        """为持仓创建唯一键"""
+        token = position.get('token', '')
+        direction = position.get('direction', '')
+        return f"{token}_{direction}"
+
+    def _extract_number(self, text):
+        """从文本中提取数字"""
+        import re
+        if not text:
+            return 0
+
+        # 移除货币符号和逗号
+        text = text.replace('$', '').replace(',', '')
+
+        # 尝试提取数字
+        match = re.search(r'([0-9]*\.?[0-9]+)', text)
+        if match:
+            return float(match.group(1))
+        return 0
+
+
+class HyperscanAPI(BaseHyperscanAPI):
+    def __init__(self, holders_cache=None, rate_limiter=None, timeout=HTTP_TIMEOUT, extractor=None,
+                 price_service=None, base_url=None, api_base_url=None, page_cache=None, holdings_tokens=None,
+                 endpoint_health=None):
+        super().__init__(holders_cache, extractor, price_service, base_url, api_base_url, page_cache, holdings_tokens)
+        self.rate_limiter = rate_limiter or default_rate_limiter
+        self.endpoint_health = endpoint_health or default_endpoint_health
+        self.timeout = timeout
         self.session = requests.Session()
         # 设置请求头，模拟浏览器行为
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'application/json, text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8'
-        })
-    
+        self.session.headers.update(DEFAULT_HEADERS)
+
+    def _get(self, url, headers=None):
+        """
+        经过熔断、限流和重试的GET请求，重试用尽后返回最后一次响应或抛出最后一次异常
+        接口熔断中(包括重试期间熔断)时抛出CircuitOpenError，不再发请求
+        """
+        breaker = self.endpoint_health.breaker(url)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(f"接口 {breaker.name} 熔断中")
+            self.rate_limiter.acquire(url)
+            started_at = time.perf_counter()
+            try:
+                response = self.session.get(url, timeout=self.timeout, headers=headers)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                breaker.record(False, time.perf_counter() - started_at)
+                HTTP_RESPONSES.inc(client='sync', status='error')
+                if attempt >= self.rate_limiter.max_retries:
+                    self.rate_limiter.record_failure()
+                    raise
+                delay = self.rate_limiter.backoff_delay(attempt)
+                logger.warning(f"请求 {url} 出错: {str(e)}，{delay:.1f}秒后重试")
+            else:
+                breaker.record(response.status_code not in RETRY_STATUS_CODES, time.perf_counter() - started_at)
+                HTTP_RESPONSES.inc(client='sync', status=response.status_code)
+                if not self.rate_limiter.should_retry(response.status_code, attempt):
+                    if response.status_code in RETRY_STATUS_CODES:
+                        self.rate_limiter.record_failure()
+                    return response
+                delay = self.rate_limiter.backoff_delay(attempt, response.headers.get('Retry-After'))
+                logger.warning(f"请求 {url} 返回 {response.status_code}，{delay:.1f}秒后重试")
+            time.sleep(delay)
+            attempt += 1
+
+    @timed(API_DURATION, API_ERRORS, none_is_error=True, method='get_token_holders', client='sync')
     def get_token_holders(self, token_symbol="HYPE", timestamp=0):
         """
         获取代币持有人信息
@@ -36,142 +841,132 @@ class HyperscanAPI:
         try:
             url = f"{self.api_base_url}/holdersAtTime/{token_symbol}/{timestamp}"
             logger.info(f"获取代币持有人数据: {url}")
-            
-            response = self.session.get(url)
+
+            response = self._get(url)
             if response.status_code != 200:
                 logger.error(f"请求失败: {response.status_code}")
                 return None
-            
+
             data = response.json()
             logger.info(f"获取到{data.get('holdersCount', 0)}个持有人数据")
             return data
         except Exception as e:
             logger.error(f"获取代币持有人数据时出错: {str(e)}")
             return None
-    
+
+    def get_holders_snapshot(self, token_symbol="HYPE", timestamp=0):
+        """
+        获取带地址索引的持有人快照(有效期内复用缓存)
+        参数:
+            token_symbol (str): 代币符号，默认为HYPE
+            timestamp (int): 时间戳，0表示最新数据
+        返回:
+            HoldersSnapshot: 持有人快照
+        """
+        return self.holders_cache.get(
+            token_symbol, timestamp,
+            lambda: self.get_token_holders(token_symbol, timestamp)
+        )
+
+    @timed(API_DURATION, API_ERRORS, none_is_error=True, method='get_token_price', client='sync')
     def get_token_price(self, token_symbol):
         """
-        从hypurrscan.io获取代币的实时价格
+        从hypurrscan.io获取代币的实时价格(经过价格缓存)
         参数:
             token_symbol (str): 代币符号，例如MELANIA
         返回:
             float: 代币价格
         """
+        return self.price_service.get(token_symbol, self._fetch_token_price)
+
+    def _fetch_token_price(self, token_symbol):
+        """
+        实际请求代币价格，先请求API，失败时抓取网页(负缓存中的代币跳过网页抓取)
+        API接口熔断中时直接抓取网页，不再先等一次失败的请求
+        """
+        url = f"{self.api_base_url}/tokens/{token_symbol}"
+        if self.endpoint_health.available(url):
+            try:
+                # 尝试从API获取最新价格
+                logger.info(f"从API获取{token_symbol}价格: {url}")
+
+                response = self._get(url)
+                if response.status_code == 200:
+                    data = response.json()
+                    if 'price' in data:
+                        return float(data['price'])
+            except Exception as e:
+                logger.warning(f"从API获取{token_symbol}价格失败: {str(e)}，改为网页获取")
+        else:
+            logger.info(f"价格API熔断中，直接从网页获取{token_symbol}价格")
+
         try:
-            # 尝试从API获取最新价格
-            url = f"{self.api_base_url}/tokens/{token_symbol}"
-            logger.info(f"从API获取{token_symbol}价格: {url}")
-            
-            response = self.session.get(url)
-            if response.status_code == 200:
-                data = response.json()
-                if 'price' in data:
-                    return float(data['price'])
-            
+            if not self.price_service.html_allowed(token_symbol):
+                logger.info(f"{token_symbol}最近网页抓取失败，跳过网页获取")
+                return None
+
             # 如果API请求失败，尝试从网页抓取
             logger.info(f"从网页获取{token_symbol}价格")
             url = f"{self.base_url}/token/{token_symbol}"
-            response = self.session.get(url)
-            
+            response = self._get(url)
+
+            price = None
             if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                # 查找包含价格的元素
-                price_element = soup.select_one('.token-price-value')
-                if price_element:
-                    price_text = price_element.text.strip().replace('$', '').replace(',', '')
-                    return float(price_text)
-            
-
-            
+                price = self._parse_token_price_page(response.text)
+            if price:
+                self.price_service.record_html_success(token_symbol)
+            else:
+                self.price_service.record_html_failure(token_symbol)
+            return price
+
         except Exception as e:
             logger.error(f"获取代币价格时出错: {str(e)}")
-            return 0.0
-    
+            return None
+
     def get_perps_positions(self, address):
         """
         获取地址的永续合约持仓
         参数:
             address (str): 钱包地址
         返回:
-            list: 持仓列表
+            list: 持仓列表，页面获取或解析失败时返回None
+        """
+        return self._get_perps_positions(address)[0]
+
+    @timed(API_DURATION, API_ERRORS, none_is_error=True, method='get_perps_positions', client='sync')
+    def _get_perps_positions(self, address):
+        """
+        获取持仓，返回 (持仓列表, 页面哈希)
+        页面获取失败(非200/304、网络错误、熔断)或解析出错时返回 (None, None)；
+        空列表只表示页面解析成功且没有持仓，否则会被当作全部平仓
         """
         try:
             # 目前API文档中没有直接获取永续合约持仓的端点
-            # 尝试从网页获取数据
-            url = f"{self.base_url}/address/{address}"
+            # 尝试从网页获取数据(页面未变化时不重新解析)
+            url = self.address_url(address)
             logger.info(f"从网页获取持仓数据: {url}")
-            
-            response = self.session.get(url)
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                positions = []
-                
-                # 尝试解析持仓数据
-                position_elements = soup.select('.position-card')
-                if position_elements:
-                    for element in position_elements:
-                        try:
-                            token_elem = element.select_one('.position-token')
-                            token = token_elem.text.strip() if token_elem else 'Unknown'
-                            
-                            direction_elem = element.select_one('.position-direction')
-                            direction = 'LONG' if direction_elem and 'long' in direction_elem.text.lower() else 'SHORT'
-                            
-                            value_elem = element.select_one('.position-value')
-                            value_text = value_elem.text.strip().replace('$', '').replace(',', '') if value_elem else '0'
-                            value = float(value_text) if value_text else 0
-                            
-                            # 获取其他数据...
-                            leverage = 5  # 默认值
-                            quantity = 0
-                            
-                            positions.append({
-                                'token': token,
-                                'direction': direction,
-                                'leverage': leverage,
-                                'value': value,
-                                'quantity': quantity,
-                                'token_quantity': f'{quantity} {token}',
-                                'entry_price': 0.0,  # 需要从网页解析
-                                'funding': 0.0,  # 需要从网页解析
-                                'liquidation_price': 0.0,  # 需要从网页解析
-                                'updated_at': int(time.time())
-                            })
-                        except Exception as e:
-                            logger.error(f"解析持仓元素时出错: {str(e)}")
-                            continue
-                    
-                    if positions:
-                        return positions
-            
-            # 如果无法从网页获取数据，返回模拟数据（针对特定地址）
-            if address.lower() == "0xf3f496c9486be5924a93d67e98298733bb47057c".lower():
-                # 获取当前时间戳
-                current_timestamp = int(time.time())
-                
-                quantity = 3863043.7
-                entry_price = 0.71745
-                
-                return [{
-                    'token': 'MELANIA',
-                    'direction': 'LONG',
-                    'leverage': 5,
-                    'value': quantity * entry_price,
-                    'quantity': quantity,
-                    'token_quantity': f'{quantity} MELANIA',
-                    'entry_price': entry_price,
-                    'funding': 315.71 + (current_timestamp % 10) / 10.0,
-                    'liquidation_price': 0.65333,
-                    'updated_at': current_timestamp
-                }]
-            
-            # 对于其他地址，返回空列表
-            return []
-            
+
+            response = self._get(url, headers=self.page_cache.conditional_headers(url))
+            positions, page_hash = self._positions_from_response(
+                url, response.status_code, response.text, response.headers
+            )
+            if positions is None:
+                logger.error(f"获取地址页面失败: {response.status_code}")
+                return None, None
+            if positions:
+                return positions, page_hash
+
+            # 页面中没有持仓时，返回模拟数据（针对特定地址）
+            return self._fallback_positions(address), page_hash
+
+        except CircuitOpenError as e:
+            logger.warning(f"跳过地址 {address} 的页面: {str(e)}")
+            return None, None
         except Exception as e:
             logger.error(f"获取永续合约持仓时出错: {str(e)}")
-            return []
-    
+            return None, None
+
+    @timed(API_DURATION, API_ERRORS, none_is_error=True, method='get_address_holdings', client='sync')
     def get_address_holdings(self, address):
         """
         获取地址持有的代币数量
@@ -181,26 +976,14 @@ class HyperscanAPI:
             dict: 持有代币数据
         """
         try:
-            # 获取HYPE代币持有人数据
-            holders_data = self.get_token_holders()
-            if not holders_data or 'holders' not in holders_data:
-                logger.error("无法获取持有人数据")
-                return None
-            
-            # 查找特定地址的持有量
-            address_lower = address.lower()
-            hype_amount = holders_data['holders'].get(address_lower, 0)
-            
-            return {
-                'address': address,
-                'holdings': {
-                    'HYPE': hype_amount
-                }
-            }
+            # 每个代币的持有人快照每个周期只下载一次，所有地址共用
+            snapshots = {token: self.get_holders_snapshot(token) for token in self.holdings_tokens}
+            return self._holdings_from_snapshots(address, snapshots)
         except Exception as e:
             logger.error(f"获取地址持有数据时出错: {str(e)}")
             return None
-    
+
+    @timed(API_DURATION, API_ERRORS, none_is_error=True, method='get_address_data', client='sync')
     def get_address_data(self, address):
         """
         获取地址的详细数据
@@ -212,109 +995,321 @@ class HyperscanAPI:
         try:
             # 尝试使用API获取数据
             logger.info(f"尝试从API获取地址 {address} 的数据")
-            
+
             # 获取持有数据
             holdings_data = self.get_address_holdings(address)
-            
-            # 获取永续合约持仓
-            positions = self.get_perps_positions(address)
-            
+
+            # 获取永续合约持仓，页面获取失败时整体按获取失败处理(不比较变化)
+            positions, page_hash = self._get_perps_positions(address)
+            if positions is None:
+                return None
+
             # 构建完整的结果数据
-            hype_amount = 0
-            if holdings_data and 'holdings' in holdings_data:
-                hype_amount = holdings_data['holdings'].get('HYPE', 0)
-            
-            result = {
-                'address': address,
-                'overview': {
-                    'perps': {'count': len(positions), 'value': sum(p.get('value', 0) for p in positions)},
-                    'spot': {'count': 1 if hype_amount > 0 else 0, 'value': hype_amount},
-                    'vault': {'value': 0},
-                    'staked': {'value': 0}
-                },
-                'positions': positions,
-                'holdings': {
-                    'HYPE': hype_amount
-                },
-                'updated_at': int(time.time())
-            }
-            
-            logger.info(f"已获取地址 {address} 的数据: {len(positions)} 个持仓，{hype_amount} HYPE")
-            return result
-            
+            return self._build_address_data(address, holdings_data, positions, page_hash)
+
         except Exception as e:
             logger.error(f"获取地址数据时出错: {str(e)}")
             import traceback
             logger.error(traceback.format_exc())
             return None
 
-    def compare_positions(self, old_data, new_data):
+
+class AsyncHyperscanAPI(BaseHyperscanAPI):
+    """
+    基于aiohttp的异步客户端，方法与HyperscanAPI一致
+    使用长连接池复用TCP连接，并通过信号量限制同时进行的请求数
+    必须在使用它的事件循环中创建会话，建议通过 async with 使用
+    """
+    def __init__(self, holders_cache=None, max_concurrency=API_MAX_CONCURRENCY,
+                 connection_limit=API_CONNECTION_LIMIT, timeout=HTTP_TIMEOUT, rate_limiter=None,
+                 extractor=None, price_service=None, base_url=None, api_base_url=None, page_cache=None,
+                 holdings_tokens=None, endpoint_health=None):
+        super().__init__(holders_cache, extractor, price_service, base_url, api_base_url, page_cache, holdings_tokens)
+        self.rate_limiter = rate_limiter or default_rate_limiter
+        self.endpoint_health = endpoint_health or default_endpoint_health
+        self.max_concurrency = max_concurrency
+        self.connection_limit = connection_limit
+        self.timeout = timeout
+        self.session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        """创建连接池和并发信号量"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.connection_limit, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                headers=DEFAULT_HEADERS,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self):
+        """关闭连接池"""
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def _get(self, url, as_json=False, headers=None, with_headers=False):
         """
-        比较新旧持仓数据，检测新开仓
+        经过熔断、限流和重试的GET请求，接口熔断中时抛出CircuitOpenError
         参数:
-            old_data (dict): 之前的持仓数据
-            new_data (dict): 最新的持仓数据
+            headers (dict): 额外的请求头(例如条件请求头)
+            with_headers (bool): 是否同时返回响应头
         返回:
-            list: 新开仓的持仓列表
+            tuple: (状态码, JSON数据或文本)，with_headers时为 (状态码, 数据, 响应头)
         """
-        if not old_data or not new_data:
-            return []
-            
-        old_positions = {self._get_position_key(p): p for p in old_data.get('positions', [])}
-        new_positions = new_data.get('positions', [])
-        
-        new_opened = []
-        changed_positions = []
-        
-        for position in new_positions:
-            key = self._get_position_key(position)
-            # 如果持仓在新数据中存在但在旧数据中不存在，则为新开仓
-            if key not in old_positions:
-                new_opened.append(position)
+        await self.open()
+        breaker = self.endpoint_health.breaker(url)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(f"接口 {breaker.name} 熔断中")
+            await self.rate_limiter.acquire_async(url)
+            started_at = time.perf_counter()
+            try:
+                async with self._semaphore:
+                    started_at = time.perf_counter()  # 不计入等待并发名额的时间
+                    async with self.session.get(url, headers=headers) as response:
+                        status = response.status
+                        response_headers = response.headers
+                        retry_after = response_headers.get('Retry-After')
+                        breaker.record(status not in RETRY_STATUS_CODES, time.perf_counter() - started_at)
+                        HTTP_RESPONSES.inc(client='async', status=status)
+                        if status == 200:
+                            if as_json:
+                                data = await response.json(content_type=None)
+                            else:
+                                data = await response.text()
+                            return (status, data, response_headers) if with_headers else (status, data)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                breaker.record(False, time.perf_counter() - started_at)
+                HTTP_RESPONSES.inc(client='async', status='error')
+                if attempt >= self.rate_limiter.max_retries:
+                    self.rate_limiter.record_failure()
+                    raise
+                delay = self.rate_limiter.backoff_delay(attempt)
+                logger.warning(f"请求 {url} 出错: {str(e) or type(e).__name__}，{delay:.1f}秒后重试")
             else:
-                # 检查持仓是否有实质性变化 (价值变化超过10%)
-                old_position = old_positions[key]
-                old_value = old_position.get('value', 0)
-                new_value = position.get('value', 0)
-                
-                # 如果价值变化超过10%，视为重大变化
-                if old_value > 0 and abs(new_value - old_value) / old_value > 0.1:
-                    changed_positions.append({
-                        'position': position,
-                        'change_type': 'increase' if new_value > old_value else 'decrease',
-                        'change_percent': abs(new_value - old_value) / old_value * 100
-                    })
-                
-        return {
-            'new_positions': new_opened,
-            'changed_positions': changed_positions
-        }
-    
-    def _get_position_key(self, position):
-        """为持仓创建唯一键"""
-        token = position.get('token', '')
-        direction = position.get('direction', '')
-        return f"{token}_{direction}"
+                if not self.rate_limiter.should_retry(status, attempt):
+                    if status in RETRY_STATUS_CODES:
+                        self.rate_limiter.record_failure()
+                    return (status, None, response_headers) if with_headers else (status, None)
+                delay = self.rate_limiter.backoff_delay(attempt, retry_after)
+                logger.warning(f"请求 {url} 返回 {status}，{delay:.1f}秒后重试")
+            # 退避期间不占用并发名额
+            await asyncio.sleep(delay)
+            attempt += 1
 
-    def _extract_number(self, text):
-        """从文本中提取数字"""
-        import re
-        if not text:
-            return 0
-            
-        # 移除货币符号和逗号
-        text = text.replace('$', '').replace(',', '')
-        
-        # 尝试提取数字
-        match = re.search(r'([0-9]*\.?[0-9]+)', text)
-        if match:
-            return float(match.group(1))
-        return 0
+    @timed(API_DURATION, API_ERRORS, none_is_error=True, method='get_token_holders', client='async')
+    async def get_token_holders(self, token_symbol="HYPE", timestamp=0):
+        """
+        获取代币持有人信息
+        参数:
+            token_symbol (str): 代币符号，默认为HYPE
+            timestamp (int): 时间戳，0表示最新数据
+        返回:
+            dict: 持有人数据
+        """
+        try:
+            url = f"{self.api_base_url}/holdersAtTime/{token_symbol}/{timestamp}"
+            logger.info(f"获取代币持有人数据: {url}")
+
+            status, data = await self._get(url, as_json=True)
+            if status != 200:
+                logger.error(f"请求失败: {status}")
+                return None
+
+            logger.info(f"获取到{data.get('holdersCount', 0)}个持有人数据")
+            return data
+        except Exception as e:
+            logger.error(f"获取代币持有人数据时出错: {str(e)}")
+            return None
+
+    async def get_holders_snapshot(self, token_symbol="HYPE", timestamp=0):
+        """获取带地址索引的持有人快照(有效期内复用缓存)"""
+        return await self.holders_cache.get_async(
+            token_symbol, timestamp,
+            lambda: self.get_token_holders(token_symbol, timestamp)
+        )
+
+    @timed(API_DURATION, API_ERRORS, none_is_error=True, method='get_token_price', client='async')
+    async def get_token_price(self, token_symbol):
+        """
+        从hypurrscan.io获取代币的实时价格(经过价格缓存)
+        参数:
+            token_symbol (str): 代币符号，例如MELANIA
+        返回:
+            float: 代币价格
+        """
+        return await self.price_service.get_async(token_symbol, self._fetch_token_price)
+
+    @timed(API_DURATION, API_ERRORS, method='get_token_prices', client='async')
+    async def get_token_prices(self, token_symbols):
+        """
+        批量获取一组代币的价格，命中缓存的代币不发请求
+        返回:
+            dict: 代币 -> 价格
+        """
+        return await self.price_service.get_many_async(token_symbols, self._fetch_token_price)
+
+    async def _fetch_token_price(self, token_symbol):
+        """
+        实际请求代币价格，先请求API，失败时抓取网页(负缓存中的代币跳过网页抓取)
+        API接口熔断中时直接抓取网页，不再先等一次失败的请求
+        """
+        url = f"{self.api_base_url}/tokens/{token_symbol}"
+        if self.endpoint_health.available(url):
+            try:
+                # 尝试从API获取最新价格
+                logger.info(f"从API获取{token_symbol}价格: {url}")
+
+                status, data = await self._get(url, as_json=True)
+                if status == 200 and 'price' in data:
+                    return float(data['price'])
+            except Exception as e:
+                logger.warning(f"从API获取{token_symbol}价格失败: {str(e)}，改为网页获取")
+        else:
+            logger.info(f"价格API熔断中，直接从网页获取{token_symbol}价格")
+
+        try:
+            if not self.price_service.html_allowed(token_symbol):
+                logger.info(f"{token_symbol}最近网页抓取失败，跳过网页获取")
+                return None
+
+            # 如果API请求失败，尝试从网页抓取
+            logger.info(f"从网页获取{token_symbol}价格")
+            status, html = await self._get(f"{self.base_url}/token/{token_symbol}")
+            price = self._parse_token_price_page(html) if status == 200 else None
+            if price:
+                self.price_service.record_html_success(token_symbol)
+            else:
+                self.price_service.record_html_failure(token_symbol)
+            return price
+
+        except Exception as e:
+            logger.error(f"获取代币价格时出错: {str(e)}")
+            return None
+
+    async def get_perps_positions(self, address):
+        """
+        获取地址的永续合约持仓
+        参数:
+            address (str): 钱包地址
+        返回:
+            list: 持仓列表，页面获取或解析失败时返回None
+        """
+        return (await self._get_perps_positions(address))[0]
+
+    @timed(API_DURATION, API_ERRORS, none_is_error=True, method='get_perps_positions', client='async')
+    async def _get_perps_positions(self, address):
+        """获取持仓，返回 (持仓列表, 页面哈希)，页面获取或解析失败时返回 (None, None)"""
+        try:
+            return self.parse_address_page(address, *await self.fetch_address_page(address))
+        except CircuitOpenError as e:
+            logger.warning(f"跳过地址 {address} 的页面: {str(e)}")
+            return None, None
+        except Exception as e:
+            logger.error(f"获取永续合约持仓时出错: {str(e)}")
+            return None, None
+
+    async def fetch_address_page(self, address):
+        """
+        只请求地址页面，不解析(流水线中网络请求和解析分别在不同阶段进行)
+        返回:
+            tuple: (URL, 状态码, 正文, 响应头)
+        """
+        url = self.address_url(address)
+        logger.info(f"从网页获取持仓数据: {url}")
+        status, html, headers = await self._get(
+            url, headers=self.page_cache.conditional_headers(url), with_headers=True
+        )
+        return url, status, html, headers
+
+    def parse_address_page(self, address, url, status, html, headers):
+        """
+        解析fetch_address_page的结果(CPU密集，可以在线程池中调用)
+        返回:
+            tuple: (持仓列表, 页面哈希)，页面获取失败(非200/304)时为 (None, None)
+        """
+        positions, page_hash = self._positions_from_response(url, status, html, headers)
+        if positions is None:
+            logger.error(f"获取地址页面失败: {status}")
+            return None, None
+        if positions:
+            return positions, page_hash
+        return self._fallback_positions(address), page_hash
+
+    def build_address_data(self, address, holdings_data, page):
+        """
+        由持有数据和fetch_address_page的结果构建地址数据(CPU密集，可以在线程池中调用)
+        参数:
+            holdings_data (dict): get_address_holdings的结果
+            page (tuple): fetch_address_page的结果
+        返回:
+            dict: 与get_address_data格式一致的地址数据，页面获取失败时返回None
+        """
+        positions, page_hash = self.parse_address_page(address, *page)
+        if positions is None:
+            return None
+        return self._build_address_data(address, holdings_data, positions, page_hash)
+
+    @timed(API_DURATION, API_ERRORS, none_is_error=True, method='get_address_holdings', client='async')
+    async def get_address_holdings(self, address):
+        """
+        获取地址持有的代币数量
+        参数:
+            address (str): 钱包地址
+        返回:
+            dict: 持有代币数据
+        """
+        try:
+            # 各代币的快照并发获取，同一代币的并发请求由快照缓存合并
+            snapshots = await asyncio.gather(*(self.get_holders_snapshot(token) for token in self.holdings_tokens))
+            return self._holdings_from_snapshots(address, dict(zip(self.holdings_tokens, snapshots)))
+        except Exception as e:
+            logger.error(f"获取地址持有数据时出错: {str(e)}")
+            return None
+
+    @timed(API_DURATION, API_ERRORS, none_is_error=True, method='get_address_data', client='async')
+    async def get_address_data(self, address):
+        """
+        获取地址的详细数据，持有数据和持仓数据并发获取
+        参数:
+            address (str): 钱包地址
+        返回:
+            dict: 包含地址数据的字典
+        """
+        try:
+            logger.info(f"尝试从API获取地址 {address} 的数据")
+
+            holdings_data, (positions, page_hash) = await asyncio.gather(
+                self.get_address_holdings(address),
+                self._get_perps_positions(address)
+            )
+            # 页面获取失败时整体按获取失败处理(不比较变化)
+            if positions is None:
+                return None
+
+            return self._build_address_data(address, holdings_data, positions, page_hash)
+
+        except Exception as e:
+            logger.error(f"获取地址数据时出错: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+            return None
 
 # 测试代码
 if __name__ == "__main__":
     api = HyperscanAPI()
     from config import DEFAULT_ADDRESS
-    
+
     data = api.get_address_data(DEFAULT_ADDRESS)
-    print(json.dumps(data, indent=2, ensure_ascii=False)) 
\ No newline at end of file
+    print(json.dumps(data, indent=2, ensure_ascii=False))
@@ -0,0 +1,318 @@
+import asyncio
+import functools
+import logging
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+# 耗时直方图的默认分桶(秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """指标基类，按标签值分别计数，线程安全"""
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """返回 [(后缀, 标签值, 额外标签, 数值), ...]"""
+        with self._lock:
+            return [('', key, None, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        for suffix, key, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """
+    可增可减的当前值
+    也可以通过set_function在采集时调用函数取值，函数返回数值，或 标签值元组 -> 数值 的字典
+    """
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def set_function(self, function):
+        self._function = function
+
+    def samples(self):
+        if self._function is None:
+            return super().samples()
+        try:
+            values = self._function()
+        except Exception as e:
+            logger.error(f"采集指标 {self.name} 时出错: {str(e)}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [('', tuple(str(v) for v in key), None, value) for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    """按分桶累计的分布(例如耗时)"""
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    def get_count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state['count'] if state else 0
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, state in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, state['counts']):
+                    cumulative += count
+                    samples.append(('_bucket', key, ('le', _format_value(float(bound))), cumulative))
+                samples.append(('_sum', key, None, state['sum']))
+                samples.append(('_count', key, None, state['count']))
+        return samples
+
+
+class MetricsRegistry:
+    """指标注册表，负责输出Prometheus文本格式"""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, documentation, labelnames=(), **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        """Prometheus文本格式(text/plain; version=0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+# 全局共享的注册表
+registry = MetricsRegistry()
+
+# 热点路径的指标
+API_DURATION = registry.histogram(
+    'hyperscan_api_duration_seconds', 'hypurrscan客户端方法耗时', ('method', 'client'))
+API_ERRORS = registry.counter(
+    'hyperscan_api_errors_total', 'hypurrscan客户端方法失败次数(抛出异常或返回None)', ('method', 'client'))
+HTTP_RESPONSES = registry.counter(
+    'hyperscan_http_responses_total', 'hypurrscan HTTP响应数(按状态码，error表示连接错误或超时)', ('client', 'status'))
+PAGE_CACHE_RESULTS = registry.counter(
+    'hyperscan_page_cache_total', '地址页面处理结果(not_modified: 304，same_hash: 内容未变跳过解析，parsed: 重新解析)',
+    ('result',))
+COMPARE_DURATION = registry.histogram(
+    'compare_positions_duration_seconds', '单个地址持仓比较耗时')
+NOTIFY_DURATION = registry.histogram(
+    'notify_duration_seconds', '通知生成并加入队列的耗时', ('kind',))
+TELEGRAM_SEND_DURATION = registry.histogram(
+    'telegram_send_duration_seconds', 'Telegram消息发送耗时')
+TELEGRAM_ERRORS = registry.counter(
+    'telegram_send_errors_total', 'Telegram消息发送失败次数', ('reason',))
+MONITOR_PASS_DURATION = registry.histogram(
+    'monitor_pass_duration_seconds', '每个地址从出队到处理完成(获取、解析、比较、加入通知队列)的耗时')
+MONITOR_ADDRESSES = registry.counter(
+    'monitor_addresses_checked_total', '已检查的地址数', ('result',))
+MONITOR_DRIFT = registry.gauge(
+    'monitor_schedule_drift_seconds', '最近一批中地址实际检查时间比计划晚的最大秒数')
+MONITOR_DELAY = registry.histogram(
+    'monitor_address_delay_seconds', '每个地址实际检查时间比计划晚的秒数')
+MONITOR_OVERRUNS = registry.counter(
+    'monitor_overruns_total', '监控超时次数(batch: 单个地址处理耗时超过MONITOR_INTERVAL；drift: 地址检查晚于计划超过MONITOR_INTERVAL；'
+    'deadline: 地址获取超过MONITOR_DEADLINE被取消)',
+    ('reason',))
+MONITOR_ERRORS = registry.counter(
+    'monitor_loop_errors_total', '监控循环异常次数')
+PIPELINE_STAGE_DURATION = registry.histogram(
+    'pipeline_stage_duration_seconds', '监控流水线各阶段处理单个地址的耗时', ('stage',))
+PIPELINE_ITEMS = registry.counter(
+    'pipeline_items_total', '监控流水线各阶段处理的地址数', ('stage', 'result'))
+QUEUE_DEPTH = registry.gauge(
+    'queue_depth', '各队列当前长度', ('queue',))
+ENDPOINT_REQUESTS = registry.counter(
+    'endpoint_requests_total', '各接口的请求结果(success/failure，rejected: 熔断中未发出)', ('endpoint', 'result'))
+ENDPOINT_DURATION = registry.histogram(
+    'endpoint_request_duration_seconds', '各接口单次请求(不含重试等待)的耗时', ('endpoint',))
+ENDPOINT_STATE = registry.gauge(
+    'endpoint_circuit_state', '各接口熔断器状态(0: closed，1: half_open，2: open)', ('endpoint',))
+SNAPSHOT_CACHE_EVENTS = registry.counter(
+    'snapshot_cache_events_total', '快照缓存事件(tier: monitor/query；event: hits/misses/evictions及按原因的移除)',
+    ('tier', 'event'))
+SNAPSHOT_CACHE_BYTES = registry.gauge(
+    'snapshot_cache_bytes', '快照缓存估算占用的内存(字节)', ('tier',))
+
+
+def timed(histogram, errors=None, none_is_error=False, **labels):
+    """
+    记录函数耗时的装饰器，支持普通函数和协程函数
+    参数:
+        histogram (Histogram): 记录耗时的直方图
+        errors (Counter): 失败计数器，抛出异常时加一
+        none_is_error (bool): 返回None是否也视为失败(本项目的客户端方法出错时返回None，
+            返回元组的方法出错时第一个元素为None，例如 (None, None))
+        labels: 固定的标签值
+    """
+    def is_none(result):
+        return result is None or (isinstance(result, tuple) and bool(result) and result[0] is None)
+
+    def record(start, failed):
+        histogram.observe(time.perf_counter() - start, **labels)
+        if failed and errors is not None:
+            errors.inc(**labels)
+
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                failed = True
+                try:
+                    result = await func(*args, **kwargs)
+                    failed = none_is_error and is_none(result)
+                    return result
+                finally:
+                    record(start, failed)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = func(*args, **kwargs)
+                failed = none_is_error and is_none(result)
+                return result
+            finally:
+                record(start, failed)
+        return wrapper
+    return decorator
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 不输出每次采集的访问日志
+        pass
+
+
+def start_http_server(port=METRICS_PORT, host=METRICS_HOST):
+    """
+    在后台线程中启动指标HTTP服务(GET /metrics)
+    参数:
+        port (int): 端口，0或None表示不启动
+        host (str): 监听地址，默认只监听本机
+    返回:
+        ThreadingHTTPServer: 服务器实例，未启动时返回None
+    """
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.error(f"启动指标服务失败: {str(e)}")
+        return None
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    logger.info(f"指标服务已启动: http://{host}:{server.server_port}/metrics")
+    return server
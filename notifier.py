@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import queue
+import random
+import threading
+import time
+from collections import Counter
+
+from telegram import ParseMode
+from telegram.error import RetryAfter, TimedOut, NetworkError
+
+from config import (
+    NOTIFY_WORKERS, NOTIFY_QUEUE_SIZE, NOTIFY_GLOBAL_RATE, NOTIFY_CHAT_RATE, NOTIFY_CHAT_BURST,
+    NOTIFY_MAX_RETRIES, NOTIFY_BACKOFF_MAX
+)
+from ratelimit import TokenBucket
+from metrics import TELEGRAM_SEND_DURATION, TELEGRAM_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Telegram单条消息的最大长度
+MESSAGE_MAX_LENGTH = 4096
+
+# 合并多条提醒时的分隔线
+MESSAGE_SEPARATOR = "\n━━━━━━━━━━\n\n"
+
+
+class NotificationDispatcher:
+    """
+    Telegram通知发送器
+    - 监控循环只把消息放入待发送缓冲区，不再在事件循环中同步调用send_message
+    - 每轮结束时(flush)把同一用户的多条提醒合并成尽量少的消息，放入发送队列
+    - 后台线程池负责发送；同一用户总是由同一个线程发送，保证消息顺序
+    - 发送前遵守Telegram的全局和单个聊天的速率限制，收到RetryAfter时按要求等待后重试
+    - 队列已满时调用方退避等待，而不是丢弃提醒
+    """
+    def __init__(self, bot, workers=NOTIFY_WORKERS, queue_size=NOTIFY_QUEUE_SIZE,
+                 global_rate=NOTIFY_GLOBAL_RATE, chat_rate=NOTIFY_CHAT_RATE, chat_burst=NOTIFY_CHAT_BURST,
+                 max_retries=NOTIFY_MAX_RETRIES, backoff_max=NOTIFY_BACKOFF_MAX):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.backoff_max = backoff_max
+        self._global_bucket = TokenBucket(global_rate)
+        self._chat_buckets = {}
+        self._pending = {}  # 用户ID -> 本轮待合并的消息
+        self._lock = threading.Lock()
+        self.stats = Counter()
+        # 每个线程一个队列，按用户ID分配，总容量为queue_size
+        self._queues = [queue.Queue(maxsize=max(1, queue_size // workers)) for _ in range(workers)]
+        self._threads = [
+            threading.Thread(target=self._worker, args=(q,), name=f"notifier-{i}", daemon=True)
+            for i, q in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def add(self, chat_id, message):
+        """把一条提醒加入本轮的待发送缓冲区"""
+        with self._lock:
+            self._pending.setdefault(chat_id, []).append(message)
+            self.stats['alerts'] += 1
+
+    async def flush(self):
+        """
+        合并本轮每个用户的提醒并放入发送队列
+        队列已满时按指数退避等待，不会丢弃消息
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for chat_id, messages in pending.items():
+            for text in merge_messages(messages):
+                await self._put(chat_id, text)
+
+    async def _put(self, chat_id, text):
+        q = self._queues[hash(chat_id) % len(self._queues)]
+        delay = 0.05
+        while True:
+            try:
+                q.put_nowait((chat_id, text))
+                with self._lock:
+                    self.stats['queued'] += 1
+                return
+            except queue.Full:
+                with self._lock:
+                    self.stats['saturated'] += 1
+                logger.warning(f"通知队列已满，{delay:.2f}秒后重试")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.backoff_max)
+
+    def _chat_bucket(self, chat_id):
+        with self._lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+                self._chat_buckets[chat_id] = bucket
+            return bucket
+
+    def _wait_for_budget(self, chat_id):
+        wait = max(self._chat_bucket(chat_id).reserve(), self._global_bucket.reserve())
+        if wait > 0:
+            with self._lock:
+                self.stats['throttled'] += 1
+                self.stats['throttled_seconds'] += wait
+            time.sleep(wait)
+
+    def _worker(self, q):
+        while True:
+            item = q.get()
+            try:
+                if item is None:
+                    return
+                self._send(*item)
+            finally:
+                q.task_done()
+
+    def _send(self, chat_id, text):
+        """发送一条消息，遇到限流或网络错误时重试"""
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_budget(chat_id)
+            started_at = time.perf_counter()
+            try:
+                self.bot.send_message(chat_id=chat_id, text=text, parse_mode=ParseMode.HTML)
+                TELEGRAM_SEND_DURATION.observe(time.perf_counter() - started_at)
+                with self._lock:
+                    self.stats['sent'] += 1
+                return
+            except RetryAfter as e:
+                TELEGRAM_ERRORS.inc(reason='retry_after')
+                # Telegram明确要求的等待时间
+                delay = float(e.retry_after)
+                logger.warning(f"发送给用户 {chat_id} 的消息被限流，{delay:.0f}秒后重试")
+            except (TimedOut, NetworkError) as e:
+                TELEGRAM_ERRORS.inc(reason='network')
+                delay = random.uniform(0, min(self.backoff_max, 2 ** attempt))
+                logger.warning(f"发送给用户 {chat_id} 的消息失败: {str(e)}，{delay:.1f}秒后重试")
+            except Exception as e:
+                TELEGRAM_ERRORS.inc(reason='error')
+                logger.error(f"发送通知失败: {str(e)}")
+                break
+            with self._lock:
+                self.stats['retried'] += 1
+            if attempt < self.max_retries:
+                time.sleep(delay)
+        with self._lock:
+            self.stats['failed'] += 1
+
+    def join(self):
+        """等待队列中的消息全部发送完成"""
+        for q in self._queues:
+            q.join()
+
+    def close(self):
+        """发送剩余消息后停止线程"""
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def get_stats(self):
+        """返回统计计数的副本(包括当前队列长度)"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['queue_size'] = sum(q.qsize() for q in self._queues)
+        return stats
+
+
+def merge_messages(messages):
+    """
+    把多条提醒合并成尽量少的消息，每条不超过Telegram的长度限制
+    参数:
+        messages (list): 消息文本列表
+    返回:
+        list: 合并后的消息文本
+    """
+    merged = []
+    current = ''
+    for message in messages:
+        if current and len(current) + len(MESSAGE_SEPARATOR) + len(message) > MESSAGE_MAX_LENGTH:
+            merged.append(current)
+            current = ''
+        current = current + MESSAGE_SEPARATOR + message if current else message
+    if current:
+        merged.append(current)
+    return merged
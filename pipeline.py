@@ -0,0 +1,282 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from breaker import CircuitOpenError
+from config import (
+    MONITOR_INTERVAL, MONITOR_TICK, MONITOR_DEADLINE, PIPELINE_FETCH_WORKERS, PIPELINE_PARSE_WORKERS,
+    PIPELINE_DIFF_WORKERS, PIPELINE_QUEUE_SIZE
+)
+from metrics import (
+    MONITOR_PASS_DURATION, MONITOR_ADDRESSES, MONITOR_OVERRUNS, PIPELINE_STAGE_DURATION, PIPELINE_ITEMS
+)
+
+logger = logging.getLogger(__name__)
+
+# 通知缓冲区最长多久合并发送一次(秒)，下游一直繁忙时也不会无限积压
+FLUSH_INTERVAL = 1.0
+
+
+class AddressJob:
+    """流水线中的一个地址，各阶段逐步填充"""
+    __slots__ = ('address', 'user_ids', 'popped_at', 'holdings', 'page', 'data')
+
+    def __init__(self, address, user_ids):
+        self.address = address
+        self.user_ids = user_ids
+        self.popped_at = time.monotonic()
+        self.holdings = None
+        self.page = None
+        self.data = None
+
+
+class PipelineStage:
+    """
+    流水线的一个阶段：多个工作协程从输入队列取出地址，处理后放入输出队列
+    输出队列满时put会等待，背压由此逐级传到上游
+    参数:
+        name (str): 阶段名称
+        handler (callable): 处理函数(协程)，返回None表示不再传给下游
+        workers (int): 工作协程数
+        inbox (asyncio.Queue): 输入队列
+        outbox (asyncio.Queue): 输出队列，最后一个阶段为None
+        on_error (callable): 处理出错时的回调，参数为出错的地址
+    """
+    def __init__(self, name, handler, workers, inbox, outbox=None, on_error=None):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.inbox = inbox
+        self.outbox = outbox
+        self.on_error = on_error
+        self.stats = Counter()
+        self.started_at = None
+        self._tasks = []
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self._tasks = [asyncio.ensure_future(self._run()) for _ in range(self.workers)]
+
+    async def _run(self):
+        while True:
+            job = await self.inbox.get()
+            started_at = time.perf_counter()
+            try:
+                result = await self.handler(job)
+            except Exception as e:
+                self.stats['failed'] += 1
+                PIPELINE_ITEMS.inc(stage=self.name, result='failed')
+                logger.error(f"流水线阶段 {self.name} 处理地址 {job.address} 时出错: {str(e)}")
+                if self.on_error:
+                    self.on_error(job)
+                continue
+            finally:
+                duration = time.perf_counter() - started_at
+                self.stats['busy_seconds'] += duration
+                PIPELINE_STAGE_DURATION.observe(duration, stage=self.name)
+                self.inbox.task_done()
+            self.stats['processed'] += 1
+            PIPELINE_ITEMS.inc(stage=self.name, result='ok')
+            if self.outbox is not None and result is not None:
+                waited_at = time.perf_counter()
+                await self.outbox.put(result)
+                # 下游队列已满时的等待时间
+                self.stats['blocked_seconds'] += time.perf_counter() - waited_at
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def get_stats(self):
+        """返回处理数、吞吐量(地址/秒)、忙碌比例、被下游阻塞的时间和输入队列长度"""
+        elapsed = max(time.monotonic() - (self.started_at or time.monotonic()), 1e-9)
+        return {
+            'workers': self.workers,
+            'processed': self.stats['processed'],
+            'failed': self.stats['failed'],
+            'throughput': self.stats['processed'] / elapsed,
+            'utilization': self.stats['busy_seconds'] / (elapsed * self.workers),
+            'blocked_seconds': self.stats['blocked_seconds'],
+            'queue': self.inbox.qsize(),
+        }
+
+
+class MonitorPipeline:
+    """
+    监控流水线：调度 → 获取 → 解析 → 比较 → 通知
+    - 获取: 并发请求地址页面和持有人快照(网络密集)；超过deadline秒未完成的地址取消获取，
+      放到调度队列最前面，不拖慢其他地址的比较和通知
+    - 解析: 在线程池中解析页面并构建地址数据(CPU密集)，与网络请求重叠进行
+    - 比较: 检测变化、更新缓存并生成通知，重新调度地址
+    - 通知: 由NotificationDispatcher的发送线程池负责，队列满时比较阶段退避等待
+    阶段之间是有界队列；调度器只取出获取队列还放得下的地址，背压一直传到调度器
+    参数:
+        bot (HyperMonitorBot): 提供调度器、process_update和通知发送器
+        api (AsyncHyperscanAPI): 异步客户端
+        deadline (float): 单个地址的获取期限(秒)
+    """
+    def __init__(self, bot, api, fetch_workers=PIPELINE_FETCH_WORKERS, parse_workers=PIPELINE_PARSE_WORKERS,
+                 diff_workers=PIPELINE_DIFF_WORKERS, queue_size=PIPELINE_QUEUE_SIZE, deadline=MONITOR_DEADLINE):
+        self.bot = bot
+        self.api = api
+        self.deadline = deadline
+        self.stats = Counter()
+        self.fetch_queue = asyncio.Queue(maxsize=queue_size)
+        self.parse_queue = asyncio.Queue(maxsize=queue_size)
+        self.diff_queue = asyncio.Queue(maxsize=queue_size)
+        self.parse_workers = parse_workers
+        self._parse_executor = None  # 运行时创建
+        self._last_flush = time.monotonic()
+        self._inflight = {}  # 地址 -> 已从调度器取出、尚未处理完的AddressJob
+        self.stages = [
+            PipelineStage('fetch', self._fetch, fetch_workers, self.fetch_queue, self.parse_queue, self._failed),
+            PipelineStage('parse', self._parse, parse_workers, self.parse_queue, self.diff_queue, self._failed),
+            PipelineStage('diff', self._diff, diff_workers, self.diff_queue, None, self._failed),
+        ]
+
+    def _failed(self, job):
+        """地址在某个阶段出错：按获取失败处理并重新调度"""
+        self._inflight.pop(job.address, None)
+        MONITOR_ADDRESSES.inc(result='failed')
+        self.bot.scheduler.reschedule(job.address)
+
+    async def _fetch_page(self, address):
+        """请求地址页面，网络错误时返回None(按获取失败处理，不能当作没有持仓的页面)"""
+        try:
+            return await self.api.fetch_address_page(address)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"获取永续合约持仓时出错: {str(e)}")
+            return None
+
+    async def _fetch(self, job):
+        try:
+            job.holdings, job.page = await asyncio.wait_for(asyncio.gather(
+                self.api.get_address_holdings(job.address),
+                self._fetch_page(job.address)
+            ), timeout=self.deadline)
+        except asyncio.TimeoutError:
+            self._overdue(job)
+            return None
+        except CircuitOpenError:
+            # 地址页面熔断中：不发请求，按获取失败重新调度，其他地址不受影响
+            self.stats['short_circuited'] += 1
+            self._failed(job)
+            return None
+        # 页面获取失败(网络错误或非200/304)时不进入解析和比较，以免误报平仓
+        if job.page is None or job.page[1] not in (200, 304):
+            if job.page is not None:
+                logger.error(f"获取地址 {job.address} 的页面失败: {job.page[1]}")
+            self._failed(job)
+            return None
+        return job
+
+    def _overdue(self, job):
+        """地址的获取超过期限(已取消)：放到调度队列最前面，连续超时过多时按获取失败处理"""
+        self._inflight.pop(job.address, None)
+        self.stats['overdue'] += 1
+        MONITOR_ADDRESSES.inc(result='overdue')
+        MONITOR_OVERRUNS.inc(reason='deadline')
+        if self.bot.scheduler.carry_over(job.address):
+            logger.warning(f"地址 {job.address} 获取超过 {self.deadline} 秒，已取消并放到下一批最前面")
+        else:
+            self.stats['given_up'] += 1
+            logger.warning(f"地址 {job.address} 连续多次获取超时，按获取失败处理")
+
+    async def _parse(self, job):
+        loop = asyncio.get_event_loop()
+        job.data = await loop.run_in_executor(
+            self._parse_executor, self.api.build_address_data, job.address, job.holdings, job.page
+        )
+        job.page = None  # 页面正文不再需要
+        if job.data is None:
+            # 例如304但本地没有缓存的解析结果
+            self._failed(job)
+            return None
+        return job
+
+    async def _diff(self, job):
+        data = job.data
+        # 价格服务中没有的代币才会发请求，同一代币的并发请求会合并
+        await self.api.get_token_prices(itertools.chain(
+            self.api.holdings_tokens, (position.get('token') for position in data.get('positions', []))
+        ))
+        changed = await self.bot.process_update(job.address, data, job.user_ids)
+        self._inflight.pop(job.address, None)
+        MONITOR_ADDRESSES.inc(result='changed' if changed else 'ok')
+        self.bot.scheduler.reschedule(job.address, data, changed)
+
+        duration = time.monotonic() - job.popped_at
+        MONITOR_PASS_DURATION.observe(duration)
+        if duration > MONITOR_INTERVAL:
+            MONITOR_OVERRUNS.inc(reason='batch')
+            logger.warning(f"地址 {job.address} 处理耗时 {duration:.1f} 秒，超过监控间隔 {MONITOR_INTERVAL} 秒")
+
+        # 比较队列空了(或距离上次发送已超过FLUSH_INTERVAL)时，把同一用户的多条提醒合并后发送
+        if self.diff_queue.empty() or time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            self._last_flush = time.monotonic()
+            await self.bot.notifier.flush()
+        return None
+
+    def feed(self):
+        """
+        从调度器取出到期的地址放入获取队列(最多取到队列放满)
+        返回:
+            int: 放入的地址数
+        """
+        free = self.fetch_queue.maxsize - self.fetch_queue.qsize()
+        if free <= 0:
+            return 0
+        batch = self.bot.scheduler.pop_due(limit=free)
+        if batch:
+            self.bot.record_schedule_drift()
+        for address, user_ids in batch:
+            job = self._inflight[address] = AddressJob(address, user_ids)
+            self.fetch_queue.put_nowait(job)
+        return len(batch)
+
+    async def run(self):
+        """运行流水线直到bot.is_running为False"""
+        self._parse_executor = ThreadPoolExecutor(max_workers=self.parse_workers, thread_name_prefix='parse')
+        for stage in self.stages:
+            stage.start()
+        try:
+            while self.bot.is_running:
+                if self.fetch_queue.full():
+                    # 下游处理不过来，稍后再从调度器取
+                    await asyncio.sleep(0.05)
+                    continue
+                self.feed()
+                await asyncio.sleep(self.bot.scheduler.next_wait(MONITOR_TICK))
+        finally:
+            for stage in self.stages:
+                await stage.stop()
+            self._parse_executor.shutdown(wait=False)
+            # 尚未处理完的地址放回调度器，下次运行时优先检查
+            for stage in self.stages:
+                while not stage.inbox.empty():
+                    stage.inbox.get_nowait()
+                    stage.inbox.task_done()
+            for address in self._inflight:
+                self.bot.scheduler.requeue(address)
+            self._inflight.clear()
+
+    def queue_depths(self):
+        """各阶段输入队列的当前长度"""
+        return {stage.name: stage.inbox.qsize() for stage in self.stages}
+
+    def get_stats(self):
+        """各阶段的统计(获取阶段包括超过期限的次数)，通知阶段使用发送器的统计"""
+        stats = {stage.name: stage.get_stats() for stage in self.stages}
+        stats['fetch']['overdue'] = self.stats['overdue']
+        stats['fetch']['given_up'] = self.stats['given_up']
+        stats['fetch']['short_circuited'] = self.stats['short_circuited']
+        if self.bot.notifier:
+            stats['notify'] = self.bot.notifier.get_stats()
+        return stats
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from config import (
+    HOST_RATE_LIMITS, DEFAULT_HOST_RATE_LIMIT,
+    HTTP_MAX_RETRIES, HTTP_BACKOFF_BASE, HTTP_BACKOFF_MAX, HTTP_RETRY_AFTER_MAX
+)
+
+logger = logging.getLogger(__name__)
+
+# 需要重试的HTTP状态码
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """令牌桶，每秒补充rate个令牌，最多积累capacity个"""
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        预定一个令牌
+        返回:
+            float: 调用者需要等待的秒数，0表示可以立即发送
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            # 令牌已透支，按欠额计算等待时间，保证并发调用者依次排队
+            return -self._tokens / self.rate
+
+
+class RateLimiter:
+    """
+    按主机划分预算的限流器
+    所有对hypurrscan.io的请求共享同一个实例，负责限流、重试退避和统计
+    """
+    def __init__(self, host_limits=None, default_rate=DEFAULT_HOST_RATE_LIMIT,
+                 max_retries=HTTP_MAX_RETRIES, backoff_base=HTTP_BACKOFF_BASE,
+                 backoff_max=HTTP_BACKOFF_MAX, retry_after_max=HTTP_RETRY_AFTER_MAX):
+        self.host_limits = dict(HOST_RATE_LIMITS if host_limits is None else host_limits)
+        self.default_rate = default_rate
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def _bucket(self, url):
+        host = urlparse(url).hostname or ''
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(self.host_limits.get(host, self.default_rate))
+                self._buckets[host] = bucket
+            return bucket
+
+    def _reserve(self, url):
+        wait = self._bucket(url).reserve()
+        with self._lock:
+            self.stats['requests'] += 1
+            if wait > 0:
+                self.stats['throttled'] += 1
+                self.stats['throttled_seconds'] += wait
+        return wait
+
+    def acquire(self, url):
+        """阻塞直到该主机的预算允许发送请求"""
+        wait = self._reserve(url)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, url):
+        """acquire的异步版本"""
+        wait = self._reserve(url)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def should_retry(self, status_code, attempt):
+        """状态码是否需要重试"""
+        return status_code in RETRY_STATUS_CODES and attempt < self.max_retries
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """
+        计算第attempt次重试前的等待时间
+        有Retry-After时以其为准，否则使用带随机抖动的指数退避
+        """
+        delay = parse_retry_after(retry_after)
+        if delay is not None:
+            # 避免异常的Retry-After让监控长时间挂起
+            delay = min(delay, self.retry_after_max)
+        else:
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        with self._lock:
+            self.stats['retried'] += 1
+            self.stats['retry_wait_seconds'] += delay
+        return delay
+
+    def record_failure(self):
+        with self._lock:
+            self.stats['failed'] += 1
+
+    def get_stats(self):
+        """返回统计计数的副本"""
+        with self._lock:
+            return dict(self.stats)
+
+
+def parse_retry_after(value):
+    """解析Retry-After头(秒数或HTTP日期)，无法解析时返回None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+# 全局共享的限流器
+rate_limiter = RateLimiter()
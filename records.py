@@ -0,0 +1,357 @@
+import struct
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from metrics import SNAPSHOT_CACHE_EVENTS
+
+# 持仓的数值字段，按固定宽度打包: 方向(int8) + 6个float64 + 更新时间(int64)
+POSITION_FIELDS = ('leverage', 'value', 'quantity', 'entry_price', 'funding', 'liquidation_price')
+POSITION_STRUCT = struct.Struct('<b6dq')
+
+DIRECTION_CODES = {'LONG': 1, 'SHORT': -1}
+DIRECTION_NAMES = {1: 'LONG', -1: 'SHORT', 0: 'Unknown'}
+
+# 地址数据中转换时单独处理的字段，其余字段原样保存在extra中
+SNAPSHOT_FIELDS = {'address', 'overview', 'positions', 'holdings', 'page_hash', 'updated_at'}
+
+_token_tuples = {}  # 代币元组驻留：所有地址共用同一个持有代币列表
+
+
+def _intern_tokens(tokens):
+    tokens = tuple(sys.intern(str(token)) for token in tokens)
+    return _token_tuples.setdefault(tokens, tokens)
+
+
+def _number(value):
+    return float(value) if value else 0.0
+
+
+def pack_positions(positions):
+    """
+    把持仓列表打包为 (代币元组, bytes)，数值字段按POSITION_STRUCT定长打包
+    """
+    tokens = tuple(sys.intern(position.get('token') or 'Unknown') for position in positions)
+    packed = b''.join(
+        POSITION_STRUCT.pack(
+            DIRECTION_CODES.get(position.get('direction'), 0),
+            *(_number(position.get(field)) for field in POSITION_FIELDS),
+            int(position.get('updated_at') or 0)
+        )
+        for position in positions
+    )
+    return tokens, packed
+
+
+def unpack_positions(tokens, packed):
+    """pack_positions的逆操作，返回持仓列表(与提取器返回的字典格式一致)"""
+    positions = []
+    for token, fields in zip(tokens, POSITION_STRUCT.iter_unpack(packed)):
+        direction, leverage, value, quantity, entry_price, funding, liquidation_price, updated_at = fields
+        positions.append({
+            'token': token,
+            'direction': DIRECTION_NAMES[direction],
+            'leverage': int(leverage) if leverage.is_integer() else leverage,
+            'value': value,
+            'quantity': quantity,
+            'token_quantity': f'{quantity} {token}',
+            'entry_price': entry_price,
+            'funding': funding,
+            'liquidation_price': liquidation_price,
+            'updated_at': updated_at
+        })
+    return positions
+
+
+class CompactSnapshot:
+    """
+    紧凑的地址快照
+    - 持仓的代币符号驻留后存为元组，数值字段打包为一个bytes(每个持仓57字节)
+    - 持有量按代币元组 + 打包的float64保存，代币元组在所有地址间共用
+    - 不保存token_quantity字符串和perps概览，转换回字典时重新计算
+    与get_address_data返回的字典格式互相转换: from_dict / to_dict
+    """
+    __slots__ = ('address', 'tokens', 'packed', 'holding_tokens', 'holding_amounts',
+                 'spot_count', 'spot_value', 'spot_unpriced', 'vault_value', 'staked_value', 'page_hash', 'updated_at', 'extra')
+
+    @classmethod
+    def from_dict(cls, data):
+        snapshot = cls()
+        positions = data.get('positions') or []
+        snapshot.address = data.get('address')
+        snapshot.tokens, snapshot.packed = pack_positions(positions)
+        holdings = data.get('holdings') or {}
+        snapshot.holding_tokens = _intern_tokens(holdings)
+        snapshot.holding_amounts = struct.pack(f'<{len(holdings)}d', *(_number(v) for v in holdings.values()))
+        overview = data.get('overview') or {}
+        spot = overview.get('spot') or {}
+        snapshot.spot_count = int(spot.get('count') or 0)
+        snapshot.spot_value = _number(spot.get('value'))
+        snapshot.spot_unpriced = _intern_tokens(spot.get('unpriced') or ())
+        snapshot.vault_value = _number((overview.get('vault') or {}).get('value'))
+        snapshot.staked_value = _number((overview.get('staked') or {}).get('value'))
+        snapshot.page_hash = data.get('page_hash')
+        snapshot.updated_at = data.get('updated_at')
+        extra = {key: value for key, value in data.items() if key not in SNAPSHOT_FIELDS}
+        snapshot.extra = extra or None
+        return snapshot
+
+    def positions(self):
+        """持仓列表(与提取器返回的字典格式一致)"""
+        return unpack_positions(self.tokens, self.packed)
+
+    def to_dict(self):
+        """转换回get_address_data的字典格式"""
+        positions = self.positions()
+        amounts = struct.unpack(f'<{len(self.holding_tokens)}d', self.holding_amounts)
+        data = {
+            'address': self.address,
+            'overview': {
+                'perps': {'count': len(positions), 'value': sum(p['value'] for p in positions)},
+                'spot': {'count': self.spot_count, 'value': self.spot_value},
+                'vault': {'value': self.vault_value},
+                'staked': {'value': self.staked_value}
+            },
+            'positions': positions,
+            'holdings': dict(zip(self.holding_tokens, amounts)),
+            'page_hash': self.page_hash,
+            'updated_at': self.updated_at
+        }
+        if self.spot_unpriced:
+            data['overview']['spot']['unpriced'] = list(self.spot_unpriced)
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def nbytes(self):
+        """估算占用的内存(字节)，驻留的代币符号和共用的代币元组不计入"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.tokens) + sys.getsizeof(self.packed)
+        size += sys.getsizeof(self.holding_amounts) + sys.getsizeof(self.address) + sys.getsizeof(self.page_hash)
+        if self.extra:
+            size += sys.getsizeof(self.extra) + sum(sys.getsizeof(value) for value in self.extra.values())
+        return size
+
+
+class SnapshotCache:
+    """
+    地址 -> 紧凑快照的缓存，接口与字典一致
+    写入时把地址数据转换为CompactSnapshot，读取时转换回字典(每次返回新的字典，修改不会影响缓存)
+    按订阅数引用计数：retain/release，订阅数降为0时移除快照
+    """
+    def __init__(self, snapshots=None):
+        self._snapshots = {}
+        self._refs = Counter()  # 地址 -> 订阅数
+        self._lock = threading.Lock()
+        self.stats = Counter()
+        if snapshots:
+            self.update(snapshots)
+
+    def get(self, address, default=None):
+        snapshot = self._snapshots.get(address)
+        self._count('hits' if snapshot is not None else 'misses')
+        return snapshot.to_dict() if snapshot is not None else default
+
+    def _count(self, event):
+        self.stats[event] += 1
+        SNAPSHOT_CACHE_EVENTS.inc(tier='monitor', event=event)
+
+    def retain(self, address):
+        """地址多了一个订阅者"""
+        with self._lock:
+            self._refs[address] += 1
+
+    def release(self, address):
+        """
+        地址少了一个订阅者，没有订阅者时移除快照
+        返回:
+            CompactSnapshot: 被移除的快照(可以转入查询缓存)，仍有订阅者或没有快照时为None
+        """
+        with self._lock:
+            if self._refs[address] > 1:
+                self._refs[address] -= 1
+                return None
+            self._refs.pop(address, None)
+            snapshot = self._snapshots.pop(address, None)
+        if snapshot is not None:
+            self._count('evictions')
+        return snapshot
+
+    def set_if_referenced(self, address, data):
+        """
+        地址仍有订阅者时写入快照(检查和写入在同一把锁内，不会与release交错)
+        返回:
+            bool: 是否写入
+        """
+        snapshot = CompactSnapshot.from_dict(data)
+        with self._lock:
+            if not self._refs.get(address):
+                return False
+            self._snapshots[address] = snapshot
+        return True
+
+    def refs(self, address):
+        """地址当前的订阅数"""
+        return self._refs.get(address, 0)
+
+    def unreferenced(self):
+        """没有订阅者的地址(例如从旧版本的持久化存储恢复的快照)"""
+        return [address for address in list(self._snapshots) if not self._refs.get(address)]
+
+    def __getitem__(self, address):
+        snapshot = self._snapshots.get(address)
+        self._count('hits' if snapshot is not None else 'misses')
+        if snapshot is None:
+            raise KeyError(address)
+        return snapshot.to_dict()
+
+    def __setitem__(self, address, data):
+        self._snapshots[address] = CompactSnapshot.from_dict(data)
+
+    def __delitem__(self, address):
+        del self._snapshots[address]
+
+    def __contains__(self, address):
+        return address in self._snapshots
+
+    def __iter__(self):
+        return iter(list(self._snapshots))
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    def pop(self, address, default=None):
+        snapshot = self._snapshots.pop(address, None)
+        return snapshot.to_dict() if snapshot is not None else default
+
+    def update(self, snapshots):
+        for address, data in snapshots.items():
+            self[address] = data
+
+    def updated_at(self, address):
+        """快照的更新时间(不转换整个快照)，没有时返回None"""
+        snapshot = self._snapshots.get(address)
+        return snapshot.updated_at if snapshot is not None else None
+
+    def clear(self):
+        self._snapshots.clear()
+
+    def nbytes(self):
+        """所有快照估算占用的内存(字节)"""
+        return sum(snapshot.nbytes() for snapshot in list(self._snapshots.values()))
+
+    def tokens(self):
+        """所有快照中持仓的代币(不转换快照)"""
+        return {token for snapshot in list(self._snapshots.values()) for token in snapshot.tokens}
+
+    def get_stats(self):
+        """返回命中、未命中、移除次数和当前的地址数"""
+        stats = dict(self.stats)
+        stats['entries'] = len(self._snapshots)
+        return stats
+
+
+class QueryCache:
+    """
+    只被/query查询过的地址的缓存(LRU + TTL)
+    - 快照的更新时间超过ttl秒后视为过期，读取时移除
+    - 估算的总内存超过max_bytes时，从最久未使用的地址开始移除
+    参数:
+        max_bytes (int): 内存上限(字节)
+        ttl (float): 数据有效期(秒)
+        on_evict (callable): 地址被移除(过期或内存不足)后的回调，参数为地址，用于清理该地址的其他缓存
+    """
+    def __init__(self, max_bytes, ttl, on_evict=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._snapshots = OrderedDict()  # 地址 -> CompactSnapshot，最近使用的在末尾
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def _count(self, event):
+        self.stats[event] += 1
+        SNAPSHOT_CACHE_EVENTS.inc(tier='query', event=event)
+
+    def _remove(self, address, reason):
+        snapshot = self._snapshots.pop(address)
+        self._bytes -= snapshot.nbytes()
+        self._count(f'evictions_{reason}')
+        return snapshot
+
+    def _evicted(self, addresses):
+        # 在锁外调用，回调中可以访问其他缓存
+        if self.on_evict:
+            for address in addresses:
+                self.on_evict(address)
+
+    def _expired(self, snapshot):
+        return time.time() - (snapshot.updated_at or 0) >= self.ttl
+
+    def get(self, address):
+        """返回未过期的数据(字典)，没有时返回None"""
+        with self._lock:
+            snapshot = self._snapshots.get(address)
+            expired = snapshot is not None and self._expired(snapshot)
+            if expired:
+                self._remove(address, 'expired')
+                snapshot = None
+            if snapshot is None:
+                self._count('misses')
+            else:
+                self._snapshots.move_to_end(address)
+                self._count('hits')
+        if expired:
+            self._evicted([address])
+        return snapshot.to_dict() if snapshot is not None else None
+
+    def put(self, address, data):
+        """
+        写入地址数据(字典或CompactSnapshot)，超过内存上限时移除最久未使用的地址
+        最久未使用的一端已过期的地址也一并移除，不必等到内存不足
+        """
+        snapshot = data if isinstance(data, CompactSnapshot) else CompactSnapshot.from_dict(data)
+        if self._expired(snapshot):
+            self._evicted([address])
+            return
+        evicted = []
+        with self._lock:
+            if address in self._snapshots:
+                self._bytes -= self._snapshots.pop(address).nbytes()
+            self._snapshots[address] = snapshot
+            self._bytes += snapshot.nbytes()
+            while self._snapshots:
+                oldest = next(iter(self._snapshots))
+                if self._bytes > self.max_bytes:
+                    self._remove(oldest, 'memory')
+                elif self._expired(self._snapshots[oldest]):
+                    self._remove(oldest, 'expired')
+                else:
+                    break
+                evicted.append(oldest)
+        self._evicted(evicted)
+
+    def pop(self, address):
+        """取出并移除未过期的数据(地址开始被监控时转入监控缓存)，没有时返回None"""
+        with self._lock:
+            snapshot = self._snapshots.get(address)
+            if snapshot is None:
+                return None
+            self._bytes -= self._snapshots.pop(address).nbytes()
+        return None if self._expired(snapshot) else snapshot.to_dict()
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    def nbytes(self):
+        return self._bytes
+
+    def get_stats(self):
+        """返回命中、未命中、按原因的移除次数、当前地址数和内存占用"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._snapshots)
+            stats['bytes'] = self._bytes
+        stats['max_bytes'] = self.max_bytes
+        return stats
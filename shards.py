@@ -0,0 +1,362 @@
+import asyncio
+import bisect
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+from collections import Counter
+
+from config import (
+    SHARD_WORKERS, SHARD_VIRTUAL_NODES, MONITOR_REQUESTS_PER_SECOND, MONITOR_TICK, MONITOR_DEADLINE
+)
+
+logger = logging.getLogger(__name__)
+
+# 工作进程的调度器中代表主进程的订阅者(真实的用户订阅只保存在主进程)
+SHARD_SUBSCRIBER = 0
+
+
+class HashRing:
+    """
+    一致性哈希环
+    每个节点在环上有replicas个虚拟节点，增删节点时只有相邻区间的地址会换到其他节点
+    """
+    def __init__(self, nodes=(), replicas=SHARD_VIRTUAL_NODES):
+        self.replicas = replicas
+        self.nodes = set()
+        self._keys = []  # 已排序的虚拟节点哈希
+        self._owners = {}  # 虚拟节点哈希 -> 节点
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(str(key).encode('utf-8')).digest()[:8], 'big')
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.replicas):
+            key = self._hash(f'{node}#{i}')
+            self._owners[key] = node
+            bisect.insort(self._keys, key)
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        for i in range(self.replicas):
+            key = self._hash(f'{node}#{i}')
+            if self._owners.pop(key, None) is not None:
+                del self._keys[bisect.bisect_left(self._keys, key)]
+
+    def node_for(self, key):
+        """返回负责key的节点，环为空时返回None"""
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, self._hash(key.lower()))
+        return self._owners[self._keys[index % len(self._keys)]]
+
+
+def _scale_rate_limits(base_limits, base_default_rate, shards):
+    """把本进程的主机限流平分给各工作进程，所有分片合计不超过单进程时的预算"""
+    from ratelimit import rate_limiter
+    with rate_limiter._lock:
+        rate_limiter.host_limits = {host: rate / shards for host, rate in base_limits.items()}
+        rate_limiter.default_rate = base_default_rate / shards
+        rate_limiter._buckets.clear()
+
+
+def _compact_changes(changes):
+    """只保留非空的变化类型，减少进程间传输的数据量"""
+    return {kind: items for kind, items in changes.items() if items}
+
+
+async def _shard_loop(shard_id, shards, commands, events):
+    # 延迟导入，避免与bot.py循环导入
+    from bot import AddressScheduler
+    from diff_engine import significant_changes
+    from hyperscan import AsyncHyperscanAPI, HoldersSnapshotCache
+    from ratelimit import rate_limiter
+
+    scheduler = AddressScheduler(requests_per_second=MONITOR_REQUESTS_PER_SECOND / shards)
+    base_limits, base_default_rate = dict(rate_limiter.host_limits), rate_limiter.default_rate
+    _scale_rate_limits(base_limits, base_default_rate, shards)
+    snapshots = {}  # 地址 -> 本分片最近一次的持仓数据
+
+    # 持有人快照和价格由主进程获取后发来('holders'/'prices'命令)，快照在收到新的之前一直有效；
+    # 只有还没收到(例如刚启动)或价格过期的代币才由本进程自己请求
+    async with AsyncHyperscanAPI(holders_cache=HoldersSnapshotCache(ttl=float('inf'))) as api:
+        while True:
+            # 处理主进程发来的命令
+            while True:
+                try:
+                    command = commands.get_nowait()
+                except queue.Empty:
+                    break
+                if command[0] == 'stop':
+                    return
+                if command[0] == 'add':
+                    _, address, snapshot = command
+                    scheduler.subscribe(SHARD_SUBSCRIBER, address)
+                    if snapshot:
+                        snapshots[address] = snapshot
+                elif command[0] == 'remove':
+                    scheduler.unsubscribe(SHARD_SUBSCRIBER, command[1])
+                    snapshots.pop(command[1], None)
+                    api.forget_address(command[1])
+                elif command[0] == 'holders':
+                    for token_symbol, data in command[1].items():
+                        api.holders_cache.put(token_symbol, 0, data)
+                elif command[0] == 'prices':
+                    api.price_service.merge(command[1])
+                elif command[0] == 'resize':
+                    shards = command[1]
+                    scheduler.requests_per_second = MONITOR_REQUESTS_PER_SECOND / shards
+                    _scale_rate_limits(base_limits, base_default_rate, shards)
+
+            try:
+                batch = scheduler.pop_due()
+                if batch:
+                    # 本批的获取期限：到期时仍未完成的地址取消，放到下一批最前面
+                    tasks = {asyncio.ensure_future(api.get_address_data(address)): address for address, _ in batch}
+                    done, pending = await asyncio.wait(tasks, timeout=MONITOR_DEADLINE)
+                    for task in pending:
+                        task.cancel()
+                        scheduler.carry_over(tasks[task])
+                        events.put(('result', shard_id, tasks[task],
+                                    {'ok': False, 'data': None, 'changes': {}, 'changed': False, 'overdue': True}))
+                    if pending:
+                        await asyncio.gather(*pending, return_exceptions=True)
+
+                    results = [(tasks[task], task.result() if not task.exception() else None) for task in done]
+                    await api.get_token_prices(itertools.chain(
+                        api.holdings_tokens,
+                        (position.get('token') for _, data in results if data for position in data.get('positions', []))
+                    ))
+                    prices = api.price_service.cached_prices()
+
+                    for address, new_data in results:
+                        result = {'ok': new_data is not None, 'data': new_data, 'changes': {}, 'changed': False}
+                        if new_data:
+                            old_data = snapshots.get(address)
+                            result['updated_at'] = new_data['updated_at']
+                            if old_data:
+                                changes, result['changed'] = significant_changes(
+                                    api.detect_changes(old_data, new_data, prices)
+                                )
+                                result['changes'] = _compact_changes(changes)
+                                # 页面未变化时主进程已有相同的持仓，只需刷新时间
+                                if new_data.get('page_hash') and new_data['page_hash'] == old_data.get('page_hash'):
+                                    result['data'] = None
+                            snapshots[address] = new_data
+                        events.put(('result', shard_id, address, result))
+                        scheduler.reschedule(address, new_data, result['changed'])
+
+                await asyncio.sleep(scheduler.next_wait(MONITOR_TICK))
+            except Exception as e:
+                logger.error(f"分片 {shard_id} 监控出错: {str(e)}")
+                await asyncio.sleep(MONITOR_TICK)
+
+
+def run_shard(shard_id, shards, commands, events):
+    """
+    工作进程入口：获取、解析并比较分配给本分片的地址，把变化事件发回主进程
+    参数:
+        shard_id (int): 分片编号
+        shards (int): 分片总数(用于平分请求预算)
+        commands (Queue): 主进程发来的命令 ('add', 地址, 快照) / ('remove', 地址) / ('resize', 分片数) /
+            ('holders', {代币: 持有人数据}) / ('prices', {代币: (价格, 获取时间)}) / ('stop',)
+        events (Queue): 发回主进程的事件 ('result', 分片编号, 地址, 结果)
+    """
+    try:
+        asyncio.run(_shard_loop(shard_id, shards, commands, events))
+    except KeyboardInterrupt:
+        pass
+
+
+class ShardedMonitor:
+    """
+    多进程分片监控(主进程一侧)
+    - 地址按一致性哈希分配给工作进程，每个进程有独立的事件循环、连接池和解析器，绕开GIL
+    - 工作进程只发回精简的结果事件：页面未变化时不带持仓数据，变化只保留非空部分
+    - 增删地址只影响该地址；调整进程数时只迁移归属改变的地址，并带上最新快照以免误报
+    - 工作进程意外退出时自动重启，并重新分配它负责的地址
+    - 持有人快照和价格由主进程获取一次后通过share发给所有工作进程，不按进程数重复下载
+    参数:
+        snapshots (dict): 地址 -> 最新持仓数据(主进程的持仓缓存)，分配地址时随命令发给工作进程
+        workers (int): 工作进程数
+        replicas (int): 每个进程的虚拟节点数
+    """
+    def __init__(self, snapshots, workers=SHARD_WORKERS, replicas=SHARD_VIRTUAL_NODES):
+        self.snapshots = snapshots
+        self.workers = max(1, workers)
+        self.ring = HashRing(range(self.workers), replicas)
+        self._ctx = multiprocessing.get_context('spawn')
+        self.events = self._ctx.Queue()
+        self._processes = {}  # 分片编号 -> (进程, 命令队列)
+        self.assignments = {}  # 地址 -> 分片编号
+        self._holders = {}  # 代币 -> 最近一次发出的持有人数据
+        self._prices = {}  # 代币 -> 最近一次发出的 (价格, 获取时间)
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def _spawn(self, shard_id):
+        commands = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=run_shard, args=(shard_id, self.workers, commands, self.events),
+            name=f'shard-{shard_id}', daemon=True
+        )
+        process.start()
+        self._processes[shard_id] = (process, commands)
+        # 新启动(或重启)的工作进程先收到最近的持有人快照和价格
+        if self._holders:
+            commands.put(('holders', dict(self._holders)))
+        if self._prices:
+            commands.put(('prices', dict(self._prices)))
+
+    def _send(self, shard_id, command):
+        self._processes[shard_id][1].put(command)
+
+    def start(self):
+        """启动所有工作进程"""
+        with self._lock:
+            for shard_id in sorted(self.ring.nodes):
+                self._spawn(shard_id)
+        logger.info(f"已启动 {self.workers} 个分片工作进程")
+
+    def assign(self, address):
+        """把地址分配给对应的分片(已分配时忽略)"""
+        with self._lock:
+            if address in self.assignments:
+                return
+            shard_id = self.ring.node_for(address)
+            self.assignments[address] = shard_id
+            self._send(shard_id, ('add', address, self.snapshots.get(address)))
+
+    def remove(self, address):
+        """地址不再被订阅时从分片中移除"""
+        with self._lock:
+            shard_id = self.assignments.pop(address, None)
+            if shard_id is not None:
+                self._send(shard_id, ('remove', address))
+
+    def share(self, holders=None, prices=None):
+        """
+        把主进程获取的持有人快照和价格发给所有工作进程
+        参数:
+            holders (dict): 代币 -> 持有人数据 {'holders': {地址: 数量}, 'holdersCount': 持有人数}
+            prices (dict): 代币 -> (价格, 获取时间)
+        """
+        with self._lock:
+            if holders:
+                self._holders.update(holders)
+            if prices:
+                self._prices.update(prices)
+            for shard_id in self._processes:
+                if holders:
+                    self._send(shard_id, ('holders', holders))
+                if prices:
+                    self._send(shard_id, ('prices', prices))
+            self.stats['shared'] += 1
+
+    def owner(self, address):
+        """当前负责该地址的分片，未分配时返回None"""
+        with self._lock:
+            return self.assignments.get(address)
+
+    def resize(self, workers):
+        """
+        调整工作进程数，只迁移归属改变的地址
+        返回:
+            int: 迁移的地址数
+        """
+        workers = max(1, workers)
+        with self._lock:
+            old_workers = self.workers
+            self.workers = workers
+            for shard_id in range(old_workers, workers):
+                self.ring.add(shard_id)
+                self._spawn(shard_id)
+            for shard_id in range(workers, old_workers):
+                self.ring.remove(shard_id)
+
+            moved = 0
+            for address, shard_id in self.assignments.items():
+                new_shard_id = self.ring.node_for(address)
+                if new_shard_id == shard_id:
+                    continue
+                if shard_id < workers:
+                    self._send(shard_id, ('remove', address))
+                self._send(new_shard_id, ('add', address, self.snapshots.get(address)))
+                self.assignments[address] = new_shard_id
+                moved += 1
+
+            for shard_id in range(workers, old_workers):
+                self._stop(shard_id)
+            for shard_id in range(min(old_workers, workers)):
+                self._send(shard_id, ('resize', workers))
+            self.stats['moved'] += moved
+        logger.info(f"分片数已从 {old_workers} 调整为 {workers}，迁移了 {moved} 个地址")
+        return moved
+
+    def check_workers(self):
+        """重启意外退出的工作进程，并重新发送它负责的地址"""
+        with self._lock:
+            for shard_id, (process, _) in list(self._processes.items()):
+                if process.is_alive():
+                    continue
+                logger.error(f"分片 {shard_id} 的工作进程已退出(退出码 {process.exitcode})，正在重启")
+                self.stats['restarts'] += 1
+                self._spawn(shard_id)
+                for address, owner in self.assignments.items():
+                    if owner == shard_id:
+                        self._send(shard_id, ('add', address, self.snapshots.get(address)))
+
+    def get_events(self, timeout=MONITOR_TICK, max_events=1000):
+        """
+        取出工作进程发回的事件，最多等待timeout秒(在线程池中调用，不阻塞事件循环)
+        返回:
+            list: [(分片编号, 地址, 结果), ...]，已迁移或已移除地址的过期结果会被丢弃
+        """
+        events = []
+        try:
+            events.append(self.events.get(timeout=timeout))
+            while len(events) < max_events:
+                events.append(self.events.get_nowait())
+        except queue.Empty:
+            pass
+
+        results = []
+        with self._lock:
+            for _, shard_id, address, result in events:
+                self.stats['events'] += 1
+                if self.assignments.get(address) != shard_id:
+                    self.stats['stale'] += 1
+                    continue
+                results.append((shard_id, address, result))
+        return results
+
+    def _stop(self, shard_id):
+        process, commands = self._processes.pop(shard_id)
+        commands.put(('stop',))
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+
+    def close(self):
+        """停止所有工作进程"""
+        with self._lock:
+            for shard_id in list(self._processes):
+                self._stop(shard_id)
+
+    def get_stats(self):
+        """返回统计计数的副本(包括每个分片负责的地址数)"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['addresses'] = dict(Counter(self.assignments.values()))
+            stats['workers'] = self.workers
+        return stats
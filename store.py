@@ -0,0 +1,159 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from config import STATE_DB_PATH, STATE_FLUSH_INTERVAL, STATE_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class StateStore:
+    """
+    监控状态的持久化存储(SQLite, WAL模式)
+    保存用户订阅和每个地址最近一次的持仓快照，重启后可以直接恢复，
+    不会丢失订阅，也不需要重新冷启动一轮才能开始比较。
+    订阅变更立即写入；持仓快照先合并在内存中，按批量大小或时间间隔批量写入
+    """
+    def __init__(self, path=STATE_DB_PATH, flush_interval=STATE_FLUSH_INTERVAL, batch_size=STATE_BATCH_SIZE):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._pending_snapshots = {}  # 地址 -> 待写入的快照
+        self._last_flush = time.monotonic()
+        self._closed = False
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                user_id INTEGER NOT NULL,
+                address TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (user_id, address)
+            );
+            CREATE TABLE IF NOT EXISTS snapshots (
+                address TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+        """)
+
+    # 订阅
+
+    def add_subscription(self, user_id, address):
+        """添加订阅"""
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO subscriptions (user_id, address, created_at) VALUES (?, ?, ?)",
+                (user_id, address, time.time())
+            )
+
+    def remove_subscription(self, user_id, address):
+        """删除订阅"""
+        with self._lock:
+            self.conn.execute(
+                "DELETE FROM subscriptions WHERE user_id = ? AND address = ?",
+                (user_id, address)
+            )
+
+    def load_subscriptions(self):
+        """
+        读取所有订阅
+        返回:
+            dict: 用户ID -> 监控的地址列表(按添加顺序)
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT user_id, address FROM subscriptions ORDER BY created_at, rowid"
+            ).fetchall()
+        subscriptions = {}
+        for user_id, address in rows:
+            subscriptions.setdefault(user_id, []).append(address)
+        return subscriptions
+
+    # 持仓快照
+
+    def save_snapshot(self, address, data):
+        """缓存快照，达到批量大小或写入间隔时统一落盘"""
+        with self._lock:
+            self._pending_snapshots[address] = data
+            due = (
+                len(self._pending_snapshots) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            )
+        if due:
+            self.flush()
+
+    def pending_count(self):
+        """尚未落盘的快照数"""
+        with self._lock:
+            return len(self._pending_snapshots)
+
+    def flush_if_due(self):
+        """距离上次写入已超过写入间隔时写入(由定时任务调用，之后没有新快照时也不会一直积压)"""
+        with self._lock:
+            due = self._pending_snapshots and time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def delete_snapshot(self, address):
+        """删除地址的快照"""
+        with self._lock:
+            self._pending_snapshots.pop(address, None)
+            self.conn.execute("DELETE FROM snapshots WHERE address = ?", (address,))
+
+    def load_snapshots(self):
+        """
+        读取所有快照(包括尚未落盘的)
+        返回:
+            dict: 地址 -> 持仓数据
+        """
+        with self._lock:
+            rows = self.conn.execute("SELECT address, data FROM snapshots").fetchall()
+            pending = dict(self._pending_snapshots)
+        snapshots = {}
+        for address, data in rows:
+            try:
+                snapshots[address] = json.loads(data)
+            except ValueError:
+                logger.error(f"地址 {address} 的快照数据已损坏，已忽略")
+        snapshots.update(pending)
+        return snapshots
+
+    def flush(self):
+        """把待写入的快照在一个事务中批量写入"""
+        with self._lock:
+            if self._closed:
+                return
+            pending, self._pending_snapshots = self._pending_snapshots, {}
+            self._last_flush = time.monotonic()
+            if not pending:
+                return
+            now = time.time()
+            try:
+                self.conn.execute("BEGIN")
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO snapshots (address, data, updated_at) VALUES (?, ?, ?)",
+                    [(address, json.dumps(data, ensure_ascii=False), now) for address, data in pending.items()]
+                )
+                self.conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                self.conn.execute("ROLLBACK")
+                # 写入失败时保留数据，下次再试(不覆盖更新的快照)
+                for address, data in pending.items():
+                    self._pending_snapshots.setdefault(address, data)
+                logger.error(f"写入持仓快照失败: {str(e)}")
+                return
+        logger.info(f"已批量写入 {len(pending)} 个地址的持仓快照")
+
+    def close(self):
+        """写入剩余数据并关闭数据库"""
+        self.flush()
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self.conn.close()
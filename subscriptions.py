@@ -0,0 +1,117 @@
+import threading
+from types import MappingProxyType
+
+
+def normalize_address(address):
+    """地址统一为去掉空白的小写形式，大小写不同的同一地址只订阅、获取一次"""
+    return address.strip().lower()
+
+
+class SubscriptionSnapshot:
+    """
+    订阅的不可变版本
+    by_user: 用户ID -> 地址元组(按订阅顺序)
+    by_address: 地址 -> 用户ID的frozenset
+    """
+    __slots__ = ('version', 'by_user', 'by_address')
+
+    def __init__(self, version, by_user, by_address):
+        self.version = version
+        self.by_user = MappingProxyType(by_user)
+        self.by_address = MappingProxyType(by_address)
+
+
+class SubscriptionRegistry:
+    """
+    写时复制的订阅注册表
+    - 读者通过current取得当前版本后直接遍历，不加锁，也不会遇到"dictionary changed size during iteration"
+    - 写者基于当前版本构建新版本，再原子地替换引用；旧版本对正在使用它的读者保持不变
+    - 写操作先进入待发布列表，同一时间只有一个写者发布，其他写者的操作在下一次发布时合并，
+      大量用户同时订阅时只复制一次
+    - 地址在写入和查询时都会规范化为小写
+    """
+    def __init__(self):
+        self._current = SubscriptionSnapshot(0, {}, {})
+        self._pending = []  # [(操作, 用户ID, 地址), ...]
+        self._pending_lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+
+    @property
+    def current(self):
+        """当前版本(不可变，可以在任何线程中无锁遍历)"""
+        return self._current
+
+    def addresses(self, user_id):
+        """用户订阅的地址元组"""
+        return self._current.by_user.get(user_id, ())
+
+    def subscribers(self, address):
+        """订阅该地址的用户ID集合"""
+        return self._current.by_address.get(normalize_address(address), frozenset())
+
+    def contains(self, user_id, address):
+        return user_id in self.subscribers(address)
+
+    def add(self, user_id, address):
+        """添加订阅，返回写入后的版本"""
+        return self._write([('add', user_id, normalize_address(address))])
+
+    def remove(self, user_id, address):
+        """删除订阅，返回写入后的版本"""
+        return self._write([('remove', user_id, normalize_address(address))])
+
+    def load(self, subscriptions):
+        """
+        批量写入订阅(例如从持久化存储恢复)
+        参数:
+            subscriptions (dict): 用户ID -> 地址列表
+        """
+        return self._write([
+            ('add', user_id, normalize_address(address))
+            for user_id, addresses in subscriptions.items() for address in addresses
+        ])
+
+    def _write(self, operations):
+        with self._pending_lock:
+            self._pending.extend(operations)
+        # 获得发布锁时，自己的操作可能已经被前一个写者一起发布了
+        with self._publish_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, []
+            if pending:
+                self._publish(pending)
+            return self._current
+
+    def _publish(self, operations):
+        current = self._current
+        by_user = dict(current.by_user)
+        by_address = dict(current.by_address)
+        # 只复制被修改的用户和地址的集合
+        users = {}
+        subscribers = {}
+        for operation, user_id, address in operations:
+            if user_id not in users:
+                users[user_id] = list(by_user.get(user_id, ()))
+            if address not in subscribers:
+                subscribers[address] = set(by_address.get(address, ()))
+            if operation == 'add':
+                if user_id not in subscribers[address]:
+                    users[user_id].append(address)
+                subscribers[address].add(user_id)
+            else:
+                if user_id in subscribers[address]:
+                    users[user_id].remove(address)
+                subscribers[address].discard(user_id)
+
+        for user_id, addresses in users.items():
+            if addresses:
+                by_user[user_id] = tuple(addresses)
+            else:
+                by_user.pop(user_id, None)
+        for address, user_ids in subscribers.items():
+            if user_ids:
+                by_address[address] = frozenset(user_ids)
+            else:
+                by_address.pop(address, None)
+        # 原子替换：读者要么看到旧版本，要么看到完整的新版本
+        self._current = SubscriptionSnapshot(current.version + 1, by_user, by_address)